@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+"""Замеры производительности pyyaru.
+Не требуют доступа к серверу. Запуск: python benchmarks.py
+
+"""
+
+import pyyaru
+import export
+import index
+import datetime
+import io
+import os
+import subprocess
+import sys
+import time
+
+
+def make_entries(count):
+    """Создает count несвязанных объектов yaEntry для замеров."""
+    return [pyyaru.yaEntry(
+        attributes={
+            'type': 'text',
+            'title': 'Заголовок публикации %s' % i,
+            'content': '<p>Это сообщение <b>номер %s</b> является тестовым.</p>' % i,
+            'access': 'public',
+            'comments_disabled': bool(i % 2),
+            'meta': {'person': {'id': 'urn:ya.ru:person/%s' % i}},
+        }
+        ) for i in range(count)]
+
+
+def report(name, count, started):
+    """Выводит результат замера в виде количества операций в секунду."""
+    elapsed = time.time() - started
+    print '%-40s %10.0f/s  (%s in %.3fs)' % (name, count / elapsed, count, elapsed)
+
+
+def bench_compose(count=10000):
+    """Замер скорости компоновки публикаций: по одной и единым документом."""
+    entries = make_entries(count)
+
+    started = time.time()
+    for entry in entries:
+        entry._compose()
+    report('yaEntry._compose() entries', count, started)
+
+    started = time.time()
+    pyyaru.compose_entries(entries, io.BytesIO())
+    report('compose_entries() entries', count, started)
+
+
+def make_corpus(pages=100, per_page=100):
+    """Создает корпус страниц коллекции публикаций (по умолчанию 10000 публикаций),
+    по образцу ответов ресурса публикаций пользователя.
+
+    """
+    entry = (
+        '<entry><id>urn:ya.ru:post/153990/%(n)s</id>'
+        '<author><name>idle sign</name><uri>https://api-yaru.yandex.ru/person/153990/</uri>'
+        '<y:id>urn:ya.ru:person/153990</y:id></author>'
+        '<title>Заголовок публикации %(n)s</title><updated>2010-06-01T12:%(m)02d:00Z</updated>'
+        '<category scheme="urn:ya.ru:posttypes" term="text"/>'
+        '<category scheme="https://api-yaru.yandex.ru/person/153990/tag" term="pyyaru"/>'
+        '<content type="html">&amp;lt;p>Это сообщение &amp;lt;b>номер %(n)s&amp;lt;/b> является тестовым.&amp;lt;/p></content>'
+        '<link rel="self" href="https://api-yaru.yandex.ru/person/153990/post/%(n)s/"/>'
+        '<link rel="edit" href="https://api-yaru.yandex.ru/person/153990/post/%(n)s/"/>'
+        '<link rel="comments" href="https://api-yaru.yandex.ru/person/153990/post/%(n)s/comment/"/>'
+        '<y:access>public</y:access></entry>')
+    corpus = []
+    for page in range(pages):
+        entries = ''.join(entry % {'n': page * per_page + i, 'm': i % 60} for i in range(per_page))
+        corpus.append(
+            '<?xml version="1.0" encoding="utf-8"?>'
+            '<feed xmlns="http://www.w3.org/2005/Atom" xmlns:y="http://api.yandex.ru/yaru/">'
+            '<link rel="next" href="https://api-yaru.yandex.ru/person/153990/post/?p=%s"/>%s</feed>' % (page + 1, entries))
+    return corpus
+
+
+def bench_parse(corpus=None, processes=(1, 2, 4)):
+    """Замер скорости разбора корпуса страниц: в текущем процессе
+    и в пуле дочерних процессов (yaParseExecutor).
+
+    """
+    if corpus is None:
+        corpus = make_corpus()
+
+    started = time.time()
+    count = 0
+    for body in corpus:
+        entries = pyyaru.yaEntries(None)
+        entries._parse((None, body, True))
+        count += len(entries)
+    report('parse in-process entries', count, started)
+
+    for process_count in processes:
+        executor = pyyaru.yaParseExecutor(process_count)
+        started = time.time()
+        count = sum(len(entries) for entries in executor.parse_many(corpus))
+        report('yaParseExecutor(%s) entries' % process_count, count, started)
+        executor.close()
+
+
+def bench_export(corpus=None):
+    """Замер скорости выгрузки корпуса страниц в таблицу: через объекты
+    yaEntry и dict(), и прямым разбором в столбцы (yaEntryColumns).
+
+    """
+    if corpus is None:
+        corpus = make_corpus()
+
+    started = time.time()
+    rows = []
+    for body in corpus:
+        entries = pyyaru.yaEntries(None)
+        entries._parse((None, body, True))
+        rows.extend(dict(entry) for entry in entries.objects)
+    report('objects and dict() entries', len(rows), started)
+
+    started = time.time()
+    columns = export.yaEntryColumns()
+    for body in corpus:
+        columns.parse(body)
+    report('yaEntryColumns.parse() entries', len(columns), started)
+
+
+def bench_item_cache(corpus=None):
+    """Замер скорости повторного разбора корпуса страниц с кэшем элементов
+    (yaItemCache), когда элементы не изменились с прошлой загрузки.
+
+    """
+    if corpus is None:
+        corpus = make_corpus()
+
+    session = pyyaru.yaSession(item_cache=pyyaru.yaItemCache())
+    for repeat, name in ((0, 'parse with empty yaItemCache entries'), (1, 'parse with warm yaItemCache entries')):
+        started = time.time()
+        count = 0
+        for body in corpus:
+            entries = pyyaru.yaEntries(None, session=session)
+            entries._parse((None, body, True))
+            count += len(entries.changes()['unchanged' if repeat else 'added'])
+        report(name, count, started)
+
+
+def bench_index(count=1000000, queries=1000):
+    """Замер скорости наполнения указателя публикаций (yaEntryIndex)
+    и времени ответа на избирательные запросы к нему.
+
+    """
+    first = datetime.datetime(2010, 6, 1)
+    entries = []
+    for i in range(count):
+        entry = pyyaru.yaEntry('urn:ya.ru:post/%s/%s' % (i % 1000, i))
+        entry.__dict__.update(title=u'Заголовок публикации слово%s' % (i % 10000), type=('text', 'link', 'photo')[i % 3],
+                              author={'id': 'urn:ya.ru:person/%s' % (i % 1000)},
+                              updated=first + datetime.timedelta(seconds=i))
+        entries.append(entry)
+
+    entries_index = index.yaEntryIndex()
+    started = time.time()
+    entries_index.update(entries)
+    report('yaEntryIndex.update() entries', count, started)
+
+    since = first + datetime.timedelta(seconds=count // 2)
+    until = since + datetime.timedelta(seconds=100)
+    searches = (
+        ('word', lambda i: entries_index.search(u'слово%s' % (i % 10000), limit=10)),
+        ('word and author', lambda i: entries_index.search(u'слово%s' % (i % 10000),
+                                                           author='urn:ya.ru:person/%s' % (i % 1000), limit=10)),
+        ('date range', lambda i: entries_index.search(since=since, until=until, limit=10)),
+    )
+    for name, search in searches:
+        # Первый запрос по дате упорядочивает указатель дат
+        search(0)
+        started = time.time()
+        for i in range(queries):
+            search(i)
+        elapsed = time.time() - started
+        print '%-40s %10.3fms (mean of %s, %s entries)' % ('yaEntryIndex.search() by %s' % name,
+                                                           elapsed / queries * 1000, queries, count)
+
+
+def bench_import(count=20):
+    """Замер времени импорта pyyaru в отдельном интерпретаторе."""
+    code = 'import time; started = time.time(); import pyyaru; print time.time() - started'
+    cwd = os.path.dirname(os.path.abspath(pyyaru.__file__))
+    timings = sorted(float(subprocess.check_output([sys.executable, '-c', code], cwd=cwd)) for i in range(count))
+    print '%-40s %10.1fms (median of %s)' % ('import pyyaru', timings[count // 2] * 1000, count)
+
+
+if __name__ == '__main__':
+    bench_import()
+    bench_compose()
+    bench_parse()
+    bench_export()
+    bench_item_cache()
+    bench_index()
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""Консольная утилита pyyaru: потоковая выгрузка лент публикаций
+пользователей, клубов и друзей, а также обхода социального графа
+в формате JSON Lines или CSV.
+
+Примеры:
+    pyyaru person /me/ -o me.jsonl
+    pyyaru friends /me/ --since 2010-06-01 -o friends.csv
+    pyyaru club urn:ya.ru:club/4611686018427400000 --checkpoint club.json -o club.jsonl
+    pyyaru crawl /me/ --depth 2 --expand friends clubs -o graph.jsonl
+
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+import pyyaru
+import crawler
+import export
+
+
+# Ленты публикаций: команда -> (тип объекта, ссылка на ленту в links объекта).
+FEEDS = {
+    'person': ('person', 'posts'),
+    'friends': ('person', 'friends_posts'),
+    'club': ('club', 'posts'),
+}
+
+ENTRY_FIELDS = ('id', 'updated', 'type', 'access', 'author', 'title')
+CRAWL_FIELDS = ('event', 'id', 'type', 'name', 'source', 'relation', 'target')
+
+_DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%SZ')
+
+
+def _parse_date(value):
+    """Разбирает дату аргумента командной строки (UTC)."""
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError('Invalid date "%s". Use YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS.' % value)
+
+
+def _encode_value(value):
+    """Приводит значение поля к виду, пригодному для записи."""
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+    return value
+
+
+class yaJsonLinesWriter(object):
+    """Записывает строки выгрузки в поток по одному объекту JSON на строку."""
+
+    def __init__(self, output, fields, header=True):
+        self.output = output
+
+    def write(self, row):
+        """Записывает строку выгрузки (словарь)."""
+        line = json.dumps(dict((key, _encode_value(value)) for key, value in row.items()), ensure_ascii=False)
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        self.output.write(line + '\n')
+
+
+class yaCsvWriter(object):
+    """Записывает строки выгрузки в поток в формате CSV (кодировка utf-8).
+    Флаг header определяет, нужно ли записать строку заголовка.
+
+    """
+
+    def __init__(self, output, fields, header=True):
+        self.output = output
+        self.fields = fields
+        self._writer = csv.writer(output)
+        if header:
+            self._writer.writerow(fields)
+
+    def write(self, row):
+        """Записывает строку выгрузки (словарь); поля, не вошедшие в fields, отбрасываются."""
+        values = []
+        for field in self.fields:
+            value = _encode_value(row.get(field))
+            if value is None:
+                value = ''
+            elif isinstance(value, unicode):
+                value = value.encode('utf-8')
+            values.append(value)
+        self._writer.writerow(values)
+
+
+WRITERS = {
+    'jsonl': yaJsonLinesWriter,
+    'csv': yaCsvWriter,
+}
+
+
+class yaProgress(object):
+    """Строка хода выгрузки в stderr: количество запросов, выгруженных строк
+    и полученных байт, скорость запросов и строк в секунду, а также
+    количество лент, выгрузка которых не удалась.
+    Строка обновляется не чаще раза в interval секунд.
+
+    """
+
+    def __init__(self, traffic, stream=None, interval=0.5, enabled=True):
+        self.traffic = traffic
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.enabled = enabled
+        self.items = 0
+        self.errors = 0
+        self._started = time.time()
+        self._shown = 0
+
+    def add(self, count):
+        """Учитывает выгруженные строки и при необходимости обновляет строку хода."""
+        self.items += count
+        self.show()
+
+    def fail(self):
+        """Учитывает ленту, выгрузка которой не удалась, и обновляет строку хода."""
+        self.errors += 1
+        self.show(True)
+
+    def line(self):
+        """Возвращает строку хода выгрузки."""
+        elapsed = max(time.time() - self._started, 0.001)
+        line = 'requests: %d (%.1f/s)  items: %d (%.1f/s)  received: %.1f KB' % (
+            self.traffic.requests, self.traffic.requests / elapsed,
+            self.items, self.items / elapsed, self.traffic.bytes / 1024.0)
+        if self.errors:
+            line += '  failed: %d' % self.errors
+        return line
+
+    def show(self, force=False):
+        """Выводит строку хода, если с прошлого вывода прошло не менее interval секунд."""
+        now = time.time()
+        if not self.enabled or (not force and now - self._shown < self.interval):
+            return
+        self._shown = now
+        self.stream.write('\r' + self.line())
+        self.stream.flush()
+
+    def finish(self):
+        """Выводит итоговую строку хода."""
+        if self.enabled:
+            self.show(True)
+            self.stream.write('\n')
+
+
+class yaFeedCheckpoint(object):
+    """Контрольная точка выгрузки лент: адрес очередной страницы каждой ленты
+    (None для выгруженных полностью) и количество выгруженных строк.
+    Записывается после каждой страницы, так что при повторном запуске
+    выгрузка продолжается со страницы, следующей за последней записанной.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.feeds = {}
+        self.items = 0
+        self.resumed = path is not None and os.path.exists(path)
+        if self.resumed:
+            checkpoint_file = open(path, 'rb')
+            try:
+                state = json.load(checkpoint_file)
+            finally:
+                checkpoint_file.close()
+            self.feeds = state['feeds']
+            self.items = state['items']
+
+    def save(self):
+        """Записывает контрольную точку в файл."""
+        if self.path is None:
+            return
+        pyyaru._dump_json_atomic(self.path, {'v': 1, 'feeds': self.feeds, 'items': self.items})
+
+
+def _feed_url(command, target, by_type, session):
+    """Возвращает адрес ленты публикаций объекта target."""
+    object_type, link = FEEDS[command]
+    obj = getattr(session, object_type)(target).get()
+    return pyyaru.yaEntries(obj.links[link], by_type, session=session).id
+
+
+def export_feeds(command, targets, writer, session, checkpoint, progress, by_type='ANY', filter=None,
+                 content=False, workers=None):
+    """Выгружает ленты публикаций command ('person', 'friends', 'club')
+    объектов targets, одновременно загружая до workers лент.
+    Ленты проходятся постранично; строки каждой страницы записываются writer,
+    после чего обновляется контрольная точка.
+    Сбой ленты (в т.ч. сетевой, либо ответ, не являющийся xml) не прерывает
+    выгрузку остальных; страница, на которой он произошёл, в контрольную точку
+    не попадает и при продолжении выгрузки загружается заново.
+    Вернёт список пар (объект, исключение) для лент, выгрузка которых не удалась.
+
+    """
+    from multiprocessing.pool import ThreadPool
+
+    lock = threading.Lock()
+
+    def export_feed(target):
+        try:
+            if target in checkpoint.feeds:
+                url = checkpoint.feeds[target]
+            else:
+                url = _feed_url(command, target, by_type, session)
+            strings = export.yaStringTable()
+            while url is not None:
+                resource_data = pyyaru.yaResource(url, session).get()
+                chunk = export.yaEntryColumns(strings, content)
+                url, crossed = chunk.parse(resource_data[1], filter)
+                if crossed:
+                    url = None
+                with lock:
+                    for row in chunk.rows():
+                        writer.write(row)
+                    writer.output.flush()
+                    checkpoint.feeds[target] = url
+                    checkpoint.items += len(chunk)
+                    checkpoint.save()
+                    progress.add(len(chunk))
+        except pyyaru._fetch_errors() as e:
+            return target, e
+        return target, None
+
+    pending = [target for target in targets if checkpoint.feeds.get(target, '') is not None]
+    failed = []
+    pool = ThreadPool(workers or pyyaru.BATCH_WORKERS)
+    try:
+        for target, error in pool.imap_unordered(pyyaru.yaDeadline.bind(export_feed), pending):
+            if error is not None:
+                failed.append((target, error))
+                progress.fail()
+    finally:
+        pool.close()
+        pool.join()
+    return failed
+
+
+def export_crawl(seeds, writer, session, checkpoint_path, progress, depth=1, expand=('friends',), workers=None):
+    """Выгружает события обхода графа (см. crawler.yaCrawler) от объектов seeds.
+    Вернёт количество ошибок загрузки.
+
+    """
+    graph_crawler = crawler.yaCrawler(seeds, depth, expand, workers or pyyaru.BATCH_WORKERS,
+                                      session=session, checkpoint=checkpoint_path)
+    for event, value in graph_crawler.crawl():
+        if event == 'node':
+            writer.write({'event': event, 'id': value.id, 'type': value._type, 'name': value.__dict__.get('name')})
+        else:
+            writer.write({'event': event, 'source': value[0], 'relation': value[1], 'target': value[2]})
+        progress.add(1)
+    return graph_crawler.stats['errors']
+
+
+def make_parser():
+    """Создаёт разборщик аргументов командной строки."""
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-o', '--output', help='output file (default: stdout)')
+    common.add_argument('-f', '--format', choices=sorted(WRITERS),
+                        help='output format (default: csv for *.csv output, jsonl otherwise)')
+    common.add_argument('--checkpoint', help='checkpoint file to resume an interrupted export from')
+    common.add_argument('-w', '--workers', type=int, default=pyyaru.BATCH_WORKERS,
+                        help='number of concurrent requests (default: %(default)s)')
+    common.add_argument('--rate', type=float, help='maximum requests per second')
+    common.add_argument('--burst', type=int, default=1, help='requests allowed at once under --rate')
+    common.add_argument('--token', help='OAuth access token (default: token file)')
+    common.add_argument('--api-server', help='API server address (default: %s)' % pyyaru.API_SERVER)
+    common.add_argument('--connect-timeout', type=float, help='connection timeout in seconds')
+    common.add_argument('--read-timeout', type=float, help='response timeout in seconds')
+    common.add_argument('-q', '--quiet', action='store_true', help='do not show the progress line')
+
+    parser = argparse.ArgumentParser(prog='pyyaru', description='Export ya.ru feeds and social graph.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    helps = {
+        'person': 'export entries of persons',
+        'friends': 'export entries of friends of persons',
+        'club': 'export entries of clubs',
+    }
+    for command in sorted(FEEDS):
+        feed_parser = subparsers.add_parser(command, parents=[common], help=helps[command])
+        feed_parser.add_argument('targets', nargs='+', metavar='ID', help='URN, URL or URI of %s' % FEEDS[command][0])
+        feed_parser.add_argument('--type', default='ANY', choices=['ANY'] + pyyaru.yaEntry._TYPES,
+                                 help='entry type')
+        feed_parser.add_argument('--since', type=_parse_date, help='export entries updated since date (UTC)')
+        feed_parser.add_argument('--until', type=_parse_date, help='export entries updated until date (UTC)')
+        feed_parser.add_argument('--content', action='store_true', help='export entry contents')
+
+    crawl_parser = subparsers.add_parser('crawl', parents=[common], help='export social graph')
+    crawl_parser.add_argument('targets', nargs='+', metavar='ID', help='URN, URL or URI of person or club')
+    crawl_parser.add_argument('--depth', type=int, default=1, help='crawl depth (default: %(default)s)')
+    crawl_parser.add_argument('--expand', nargs='+', default=['friends'], choices=sorted(crawler.RELATIONS),
+                              help='relations to follow (default: friends)')
+    return parser
+
+
+def main(argv=None):
+    """Точка входа консольной утилиты. Вернёт код завершения."""
+    args = make_parser().parse_args(argv)
+
+    output_format = args.format
+    if output_format is None:
+        output_format = 'csv' if args.output and args.output.endswith('.csv') else 'jsonl'
+
+    traffic = pyyaru.yaTrafficCounter()
+    session = pyyaru.yaSession(
+        args.token if args.token is not None else pyyaru.load_token_file(), args.api_server,
+        rate_limiter=pyyaru.yaRateLimiter(args.rate, args.burst) if args.rate else None,
+        connect_timeout=args.connect_timeout, read_timeout=args.read_timeout, traffic=traffic)
+    progress = yaProgress(traffic, enabled=not args.quiet)
+
+    if args.command == 'crawl':
+        fields = CRAWL_FIELDS
+        resumed = args.checkpoint is not None and os.path.exists(args.checkpoint)
+    else:
+        fields = ENTRY_FIELDS + (('content',) if args.content else ())
+        checkpoint = yaFeedCheckpoint(args.checkpoint)
+        resumed = checkpoint.resumed
+
+    # При продолжении выгрузки строки дописываются в конец файла
+    output = open(args.output, 'ab' if resumed else 'wb') if args.output else sys.stdout
+    writer = WRITERS[output_format](output, fields, header=not resumed)
+
+    failed = []
+    try:
+        if args.command == 'crawl':
+            errors = export_crawl(args.targets, writer, session, args.checkpoint, progress,
+                                  args.depth, args.expand, args.workers)
+        else:
+            progress.items = checkpoint.items
+            if args.since is not None or args.until is not None:
+                entries_filter = pyyaru.yaFilter(since=args.since, until=args.until)
+            else:
+                entries_filter = None
+            failed = export_feeds(args.command, args.targets, writer, session, checkpoint, progress,
+                                  args.type, entries_filter, args.content, args.workers)
+            errors = len(failed)
+    except KeyboardInterrupt:
+        progress.finish()
+        sys.stderr.write('Interrupted.\n')
+        return 130
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        else:
+            output.flush()
+        session.close()
+
+    progress.finish()
+    for target, error in failed:
+        sys.stderr.write('Failed to export "%s": %s\n' % (target, error))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Чтение обсуждений публикаций: одновременная загрузка комментариев
+множества публикаций и сборка деревьев ответов.
+
+"""
+
+import datetime
+import threading
+
+import pyyaru
+
+
+class yaCommentNode(object):
+    """Узел дерева обсуждения: публикация (либо комментарий) entry и список
+    ответов на неё replies (узлов yaCommentNode) в порядке создания.
+
+    """
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.replies = []
+
+    def __len__(self):
+        """Возвращает количество ответов во всём поддереве."""
+        return sum(len(reply) + 1 for reply in self.replies)
+
+    def __iter__(self):
+        """Проходит поддерево в глубину, выбрасывая пары (уровень вложенности, комментарий).
+        Ответы на публикацию имеют уровень 1.
+
+        """
+        stack = [(1, reply) for reply in reversed(self.replies)]
+        while stack:
+            depth, node = stack.pop()
+            yield depth, node.entry
+            stack.extend((depth + 1, reply) for reply in reversed(node.replies))
+
+
+def _thread_total(entry):
+    """Возвращает количество ответов на публикацию по данным thr:total, либо None."""
+    return (entry.__dict__.get('thread') or {}).get('total')
+
+
+def _created_key(entry):
+    """Ключ упорядочивания комментариев по дате, комментарии без даты идут первыми."""
+    return entry.__dict__.get('updated') or datetime.datetime.min
+
+
+class yaThreadWalker(object):
+    """Обходчик обсуждений. Загружает комментарии (ресурсы links['comments'])
+    множества публикаций одновременно и собирает из них деревья ответов
+    по сведениям thr:in-reply-to. Если у комментария по данным thr:total
+    есть ответы, не вошедшие в загруженную коллекцию, загружаются и они,
+    уровень за уровнем (не глубже max_depth).
+
+    Обходчик запоминает деревья и количество ответов (thr:total) каждой
+    обойдённой публикации: при следующем обходе обсуждения публикаций,
+    количество ответов которых не изменилось, не загружаются повторно.
+
+    Пример:
+        walker = yaThreadWalker(workers=8)
+        for entry_id, tree in walker.walk(me.friends_entries()).items():
+            for depth, comment in tree:
+                print '  ' * depth, comment.content
+
+    """
+
+    __logger = pyyaru.Logger()
+
+    def __init__(self, workers=None, max_depth=None):
+        """workers - количество одновременных загрузок (по умолчанию BATCH_WORKERS);
+        max_depth - наибольший уровень вложенности ответов, загружаемых отдельно.
+
+        """
+        self.workers = workers or pyyaru.BATCH_WORKERS
+        self.max_depth = max_depth
+        self.threads = {}
+        self.stats = {'fetched': 0, 'skipped': 0, 'errors': 0}
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def _fetch(self, task):
+        """Загружает все комментарии ресурса. Выполняется в потоке пула.
+        Вернёт кортеж из задачи, списка комментариев и исключения (None в случае успеха).
+
+        """
+        node, root = task
+        entry = node.entry
+        try:
+            collection = pyyaru.yaEntries(entry.links['comments'], session=entry._session).get()
+            comments = list(collection.iter())
+        except pyyaru._fetch_errors() as e:
+            return task, [], e
+        return task, comments, None
+
+    def _assemble(self, node, comments):
+        """Собирает дерево ответов узла node из загруженных комментариев.
+        Комментарии, отвечающие на неизвестные публикации, считаются ответами
+        на сам узел. Комментарии, уже имеющиеся в поддереве узла (например,
+        при дозагрузке ответов на вложенный комментарий), повторно не добавляются.
+        Вернёт список созданных узлов.
+
+        """
+        nodes = {node.entry.id: node}
+        stack = [node]
+        while stack:
+            for reply in stack.pop().replies:
+                nodes[reply.entry.id] = reply
+                stack.append(reply)
+        created = []
+        for comment in sorted(comments, key=_created_key):
+            if comment.id in nodes:
+                continue
+            nodes[comment.id] = yaCommentNode(comment)
+            created.append(nodes[comment.id])
+        for child in created:
+            parent_id = (child.entry.__dict__.get('thread') or {}).get('in_reply_to')
+            nodes.get(parent_id, node).replies.append(child)
+        return created
+
+    def walk(self, entries):
+        """Обходит обсуждения публикаций entries (списка объектов yaEntry,
+        либо загруженной коллекции yaEntries).
+        Вернёт словарь деревьев (yaCommentNode) по идентификаторам публикаций.
+        Обсуждение, загрузить которое не удалось, при следующем обходе
+        загружается заново, а до тех пор вместо него выдаётся запомненное ранее.
+
+        """
+        from multiprocessing.pool import ThreadPool
+
+        if isinstance(entries, pyyaru.yaEntries):
+            entries = entries.objects
+
+        result = {}
+        pending = []
+        for entry in entries:
+            total = _thread_total(entry)
+            if entry.id in self.threads and total is not None and self._totals.get(entry.id) == total:
+                self.stats['skipped'] += 1
+                result[entry.id] = self.threads[entry.id]
+                continue
+            tree = yaCommentNode(entry)
+            result[entry.id] = tree
+            if total == 0 or 'comments' not in entry.__dict__.get('links', {}):
+                self._store(tree, total)
+                continue
+            pending.append((tree, tree))
+
+        failed = set()
+        complete = []
+        # Потоки пула выполняются в рамках срока, действующего у вызывающего
+        fetch = pyyaru.yaDeadline.bind(self._fetch)
+        pool = ThreadPool(self.workers)
+        try:
+            depth = 0
+            while pending:
+                next_pending = []
+                for (node, root), comments, error in pool.imap_unordered(fetch, pending):
+                    self.stats['fetched'] += 1
+                    if error is not None:
+                        self.stats['errors'] += 1
+                        self.__logger.error('Unable to fetch comments of "%s": %s' % (node.entry.id, error))
+                        failed.add(root.entry.id)
+                        continue
+                    if node is root:
+                        complete.append(root)
+                    for child in self._assemble(node, comments):
+                        total = _thread_total(child.entry)
+                        # Ответы, не вошедшие в коллекцию, загружаются со следующим уровнем
+                        if total and len(child.replies) < total and 'comments' in child.entry.links and \
+                                (self.max_depth is None or depth < self.max_depth):
+                            next_pending.append((child, root))
+                pending = next_pending
+                depth += 1
+        finally:
+            pool.close()
+            pool.join()
+
+        for tree in complete:
+            if tree.entry.id not in failed:
+                self._store(tree, _thread_total(tree.entry))
+        for entry_id in failed:
+            if entry_id in self.threads:
+                result[entry_id] = self.threads[entry_id]
+        return result
+
+    def _store(self, tree, total):
+        """Запоминает дерево обсуждения и количество ответов на публикацию."""
+        with self._lock:
+            self.threads[tree.entry.id] = tree
+            self._totals[tree.entry.id] = total
+
+    def forget(self, entry_id=None):
+        """Забывает запомненное обсуждение публикации, либо все обсуждения,
+        если идентификатор не задан.
+
+        """
+        with self._lock:
+            if entry_id is None:
+                self.threads.clear()
+                self._totals.clear()
+            else:
+                self.threads.pop(entry_id, None)
+                self._totals.pop(entry_id, None)
@@ -0,0 +1,673 @@
+# -*- coding: utf-8 -*-
+"""Обход социального графа Я.ру: друзья пользователей, их клубы и члены клубов."""
+
+import base64
+import hashlib
+import json
+import math
+import os
+import socket
+import sqlite3
+import struct
+import time
+import zlib
+from collections import deque
+
+import pyyaru
+
+
+# Отношения, по которым можно расширять граф: имя отношения -> (тип исходного
+# объекта, метод исходного объекта, тип целевых объектов).
+RELATIONS = {
+    'friends': ('person', 'friends', 'person'),
+    'clubs': ('person', 'clubs', 'club'),
+    'members': ('club', 'members', 'person'),
+}
+
+
+class yaVisitedSet(object):
+    """Множество посещённых URN с ограниченным расходом памяти (фильтр Блума).
+    Объём памяти определяется ожидаемым количеством элементов capacity
+    и допустимой долей ложных срабатываний error_rate, и не растёт
+    с количеством добавленных элементов. Ложное срабатывание означает,
+    что ещё не посещённый объект будет сочтён посещённым.
+
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / float(capacity) * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, urn):
+        """Вычисляет позиции битов элемента (двойное хэширование)."""
+        if isinstance(urn, unicode):
+            urn = urn.encode('utf-8')
+        first, second = struct.unpack('<QQ', hashlib.md5(urn).digest())
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, urn):
+        for position in self._positions(urn):
+            if not self._bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, urn):
+        """Добавляет элемент. Вернёт False, если элемент уже был в множестве."""
+        added = False
+        for position in self._positions(urn):
+            mask = 1 << (position & 7)
+            if not self._bits[position >> 3] & mask:
+                self._bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __len__(self):
+        """Приблизительное количество добавленных элементов."""
+        return self.count
+
+    def dump(self, bits=True):
+        """Возвращает состояние множества в виде словаря для записи в контрольную точку.
+        Если bits ложно, битовый массив в словарь не включается; его можно
+        сохранить отдельно, получив методом bits().
+
+        """
+        state = {'capacity': self.capacity, 'error_rate': self.error_rate, 'count': self.count}
+        if bits:
+            state['bits'] = base64.b64encode(self.bits())
+        return state
+
+    def bits(self):
+        """Возвращает битовый массив фильтра в виде строки байтов."""
+        return bytes(self._bits)
+
+    @classmethod
+    def load(cls, state, bits=None):
+        """Восстанавливает множество из словаря, полученного от dump().
+        Битовый массив, сохранённый отдельно, передаётся в параметре bits.
+
+        """
+        visited = cls(state['capacity'], state['error_rate'])
+        if bits is None and 'bits' in state:
+            bits = base64.b64decode(state['bits'])
+        if bits is not None:
+            visited.count = state['count']
+            visited._bits = bytearray(bits)
+        return visited
+
+
+def _expand_node(node, depth, expand, session):
+    """Загружает объект узла (тип, идентификатор, глубина) и его отношения.
+    Вернёт кортеж из узла, загруженного объекта, списка пар
+    (отношение, объект) и исключения (None в случае успеха).
+
+    """
+    node_type, node_id, node_depth = node
+    cl = getattr(pyyaru, pyyaru.URN_TYPES[node_type])
+    try:
+        obj = cl(node_id, session=session).get()
+
+        related = []
+        if node_depth < depth:
+            for relation in expand:
+                source_type, method, target_type = RELATIONS[relation]
+                if source_type != node_type:
+                    continue
+                for target in getattr(obj, method)().iter():
+                    related.append((relation, target))
+    except pyyaru._fetch_errors() as e:
+        # Сетевой сбой одного узла не прерывает обход
+        return node, None, [], e
+    return node, obj, related, None
+
+
+def _seed_node(seed):
+    """Возвращает узел очереди (тип, идентификатор, глубина) для исходного объекта."""
+    if isinstance(seed, pyyaru.yaClub):
+        return ['club', seed.id, 0]
+    if isinstance(seed, pyyaru.yaPerson):
+        return ['person', seed.id, 0]
+    if seed.startswith(pyyaru.URN_PREFIX + 'club') or '/club/' in seed:
+        return ['club', seed, 0]
+    return ['person', seed, 0]
+
+
+class yaCrawler(object):
+    """Обходчик графа, расширяющий граф в ширину от исходных пользователей
+    и клубов по заданным отношениям (friends, clubs, members) до глубины depth.
+
+    Объекты одного уровня загружаются одновременно пулом потоков по batch_size
+    за раз. Посещённые объекты отмечаются по URN в yaVisitedSet.
+    Если задан путь checkpoint, после обработки порции, но не чаще одного раза
+    в checkpoint_interval секунд, а также по завершении обхода, состояние
+    обхода (очередь и посещённые объекты) записывается в файл, а при повторном
+    запуске обход продолжается с места остановки. Битовый массив множества
+    посещённых объектов хранится рядом, в файле с расширением .bloom,
+    и переписывается, только если изменился.
+
+    Пример:
+        crawler = yaCrawler(['/me/'], depth=2, expand=('friends', 'clubs'))
+        for event in crawler.crawl():
+            if event[0] == 'node':
+                print event[1].name
+            else:
+                print '%s -%s-> %s' % event[1]
+
+    """
+
+    __logger = pyyaru.Logger()
+
+    def __init__(self, seeds, depth=1, expand=('friends',), workers=4, batch_size=None,
+                 session=None, checkpoint=None, capacity=1000000, error_rate=0.001,
+                 checkpoint_interval=10):
+        """seeds - список исходных объектов: yaPerson, yaClub, либо их идентификаторы
+        (URN, URL, URI); идентификатор считается пользователем, если не является
+        URN клуба или адресом ресурса клуба;
+        depth - глубина обхода;
+        expand - отношения, по которым расширяется граф (см. RELATIONS);
+        workers - количество одновременных загрузок;
+        batch_size - количество объектов, загружаемых за одну порцию
+        (по умолчанию workers * 4);
+        session - сессия yaSession (по умолчанию DEFAULT_SESSION);
+        checkpoint - путь к файлу контрольной точки;
+        capacity, error_rate - параметры множества посещённых объектов;
+        checkpoint_interval - наименьший промежуток в секундах между записями контрольной точки.
+
+        """
+        for relation in expand:
+            if relation not in RELATIONS:
+                raise pyyaru.yaError('Unknown relation "%s". Valid choices: %s.' % (relation, sorted(RELATIONS)))
+
+        self.depth = depth
+        self.expand = tuple(expand)
+        self.workers = workers
+        self.batch_size = batch_size or workers * 4
+        self.session = session or pyyaru.DEFAULT_SESSION
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.stats = {'fetched': 0, 'nodes': 0, 'edges': 0, 'errors': 0}
+
+        self._frontier = deque()
+        self._visited = yaVisitedSet(capacity, error_rate)
+        self._seeds = seeds
+        self._resumed = False
+        self._saved_at = time.time()
+        # Количество посещённых объектов на момент последней записи битового массива
+        self._saved_count = None
+
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self._load_checkpoint()
+
+    def _expand(self, node):
+        """Загружает объект узла и его отношения. Выполняется в потоке пула.
+        См. _expand_node().
+
+        """
+        return _expand_node(node, self.depth, self.expand, self.session)
+
+    def crawl(self):
+        """Итератор, проходящий граф. Выбрасывает события:
+        ('node', объект) - для каждого впервые встреченного объекта;
+        ('edge', (URN источника, отношение, URN цели)) - для каждой связи.
+
+        """
+        from multiprocessing.pool import ThreadPool
+
+        if not self._resumed:
+            for seed in self._seeds:
+                self._frontier.append(_seed_node(seed))
+
+        # Потоки пула выполняются в рамках срока, действующего у вызывающего
+        expand = pyyaru.yaDeadline.bind(self._expand)
+        pool = ThreadPool(self.workers)
+        try:
+            while self._frontier:
+                batch = [self._frontier.popleft() for i in range(min(self.batch_size, len(self._frontier)))]
+                for node, obj, related, error in pool.imap_unordered(expand, batch):
+                    self.stats['fetched'] += 1
+                    if error is not None:
+                        self.stats['errors'] += 1
+                        self.__logger.error('Unable to expand "%s": %s' % (node[1], error))
+                        continue
+
+                    if node[2] == 0 and self._visited.add(obj.id):
+                        # Исходные объекты становятся узлами после загрузки
+                        self.stats['nodes'] += 1
+                        yield ('node', obj)
+
+                    for relation, target in related:
+                        self.stats['edges'] += 1
+                        yield ('edge', (obj.id, relation, target.id))
+                        if self._visited.add(target.id):
+                            self.stats['nodes'] += 1
+                            yield ('node', target)
+                            # Объекты последнего уровня не расширяются, и загружать их незачем
+                            if node[2] + 1 < self.depth:
+                                self._frontier.append([target._type, target.id, node[2] + 1])
+
+                if time.time() - self._saved_at >= self.checkpoint_interval:
+                    self._save_checkpoint()
+            # Завершённый обход записывается всегда, чтобы повторный запуск не начинал его заново
+            self._save_checkpoint()
+        finally:
+            pool.close()
+            pool.join()
+
+    def _bloom_path(self):
+        return '%s.bloom' % self.checkpoint
+
+    def _save_checkpoint(self):
+        """Записывает состояние обхода в файл контрольной точки, а битовый
+        массив множества посещённых объектов - в отдельный файл, если он
+        изменился с прошлой записи.
+
+        """
+        self._saved_at = time.time()
+        if self.checkpoint is None:
+            return
+        state = {
+            'v': 2,
+            'depth': self.depth,
+            'expand': self.expand,
+            'frontier': list(self._frontier),
+            'visited': self._visited.dump(bits=False),
+            'stats': self.stats,
+        }
+        # Очередь записывается первой: если битовый массив записать не удастся,
+        # при продолжении обхода объекты последней порции лишь встретятся повторно
+        pyyaru._dump_json_atomic(self.checkpoint, state)
+        if self._visited.count != self._saved_count:
+            pyyaru._write_atomic(self._bloom_path(), self._visited.bits())
+            self._saved_count = self._visited.count
+
+    def _load_checkpoint(self):
+        """Восстанавливает состояние обхода из файла контрольной точки."""
+        checkpoint_file = open(self.checkpoint, 'rb')
+        try:
+            state = json.load(checkpoint_file)
+        finally:
+            checkpoint_file.close()
+        bits = None
+        if os.path.exists(self._bloom_path()):
+            bloom_file = open(self._bloom_path(), 'rb')
+            try:
+                bits = bloom_file.read()
+            finally:
+                bloom_file.close()
+        self._frontier = deque(state['frontier'])
+        self._visited = yaVisitedSet.load(state['visited'], bits)
+        self.stats = dict((str(key), value) for key, value in state['stats'].items())
+        self._resumed = True
+        self.__logger.info('Resuming crawl with %s nodes in frontier.' % len(self._frontier))
+
+
+class yaCrawlQueue(object):
+    """Очередь задач обхода в базе SQLite, общая для нескольких процессов.
+
+    Каждая задача - объект графа (URN, тип, глубина), закреплённый за одним
+    из shards сегментов по контрольной сумме URN. Процесс получает задачи
+    своего сегмента в аренду на lease_time секунд; если процесс завершился
+    аварийно и не отчитался о задачах, по истечении аренды они снова
+    становятся доступными. Задача, аренда которой истекала max_attempts раз,
+    считается неудавшейся.
+    Таблица задач одновременно служит множеством посещённых объектов,
+    поэтому каждый URN попадает в очередь ровно один раз.
+
+    """
+
+    PENDING, LEASED, DONE, FAILED = range(4)
+    STATES = ('pending', 'leased', 'done', 'failed')
+
+    def __init__(self, path, shards=1, lease_time=60, max_attempts=3):
+        self.path = path
+        self.shards = shards
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+
+        # Транзакции открываются явно, чтобы аренда задач была атомарной
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS tasks (urn TEXT PRIMARY KEY, type TEXT NOT NULL, '
+                         'depth INTEGER NOT NULL, shard INTEGER NOT NULL, state INTEGER NOT NULL, '
+                         'owner TEXT, expires REAL, attempts INTEGER NOT NULL DEFAULT 0)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS tasks_shard_state ON tasks (shard, state)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._db.create_function('shard_of', 1, self.shard_of)
+
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'shards'").fetchone()
+            if row is None or int(row[0]) != shards:
+                # Количество сегментов изменилось: задачи перераспределяются заново
+                self._db.execute('UPDATE tasks SET shard = shard_of(urn)')
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('shards', ?)", (str(shards),))
+            self._db.execute('COMMIT')
+        except:
+            self._db.execute('ROLLBACK')
+            raise
+
+    def shard_of(self, urn):
+        """Возвращает номер сегмента для URN."""
+        if isinstance(urn, unicode):
+            urn = urn.encode('utf-8')
+        return (zlib.crc32(urn) & 0xffffffff) % self.shards
+
+    def add_many(self, tasks):
+        """Добавляет задачи - кортежи (URN, тип, глубина, состояние).
+        Вернёт множество URN, которых до этого не было в очереди.
+
+        """
+        added = set()
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            for urn, node_type, depth, state in tasks:
+                cursor = self._db.execute('INSERT OR IGNORE INTO tasks (urn, type, depth, shard, state) '
+                                          'VALUES (?, ?, ?, ?, ?)',
+                                          (urn, node_type, depth, self.shard_of(urn), state))
+                if cursor.rowcount == 1:
+                    added.add(urn)
+            self._db.execute('COMMIT')
+        except:
+            self._db.execute('ROLLBACK')
+            raise
+        return added
+
+    def add(self, urn, node_type, depth, state=PENDING):
+        """Добавляет задачу. Вернёт False, если URN уже был в очереди."""
+        return urn in self.add_many([(urn, node_type, depth, state)])
+
+    def lease(self, shard, owner, limit):
+        """Берёт в аренду владельцу owner до limit доступных задач сегмента shard:
+        ожидающих и тех, аренда которых истекла.
+        Вернёт список узлов (тип, URN, глубина).
+
+        """
+        now = time.time()
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            self._db.execute('UPDATE tasks SET state = ? WHERE shard = ? AND state = ? AND expires < ? '
+                             'AND attempts >= ?', (self.FAILED, shard, self.LEASED, now, self.max_attempts))
+            rows = self._db.execute('SELECT urn, type, depth FROM tasks WHERE shard = ? '
+                                    'AND (state = ? OR (state = ? AND expires < ?)) LIMIT ?',
+                                    (shard, self.PENDING, self.LEASED, now, limit)).fetchall()
+            self._db.executemany('UPDATE tasks SET state = ?, owner = ?, expires = ?, attempts = attempts + 1 '
+                                 'WHERE urn = ?', [(self.LEASED, owner, now + self.lease_time, row[0])
+                                                   for row in rows])
+            self._db.execute('COMMIT')
+        except:
+            self._db.execute('ROLLBACK')
+            raise
+        return [[node_type, urn, depth] for urn, node_type, depth in rows]
+
+    def _finish(self, owner, urns, state):
+        """Переводит арендованные владельцем задачи в состояние state.
+        Задачи, аренда которых перешла к другому владельцу, не затрагиваются.
+
+        """
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            self._db.executemany('UPDATE tasks SET state = ?, owner = NULL, expires = NULL '
+                                 'WHERE urn = ? AND owner = ? AND state = ?',
+                                 [(state, urn, owner, self.LEASED) for urn in urns])
+            self._db.execute('COMMIT')
+        except:
+            self._db.execute('ROLLBACK')
+            raise
+
+    def complete(self, owner, urns):
+        """Отмечает арендованные задачи выполненными."""
+        self._finish(owner, urns, self.DONE)
+
+    def fail(self, owner, urns):
+        """Отмечает арендованные задачи неудавшимися."""
+        self._finish(owner, urns, self.FAILED)
+
+    def abandon(self, shard):
+        """Отмечает все невыполненные задачи сегмента неудавшимися."""
+        self._db.execute('UPDATE tasks SET state = ? WHERE shard = ? AND state IN (?, ?)',
+                         (self.FAILED, shard, self.PENDING, self.LEASED))
+
+    def unfinished(self):
+        """Количество ожидающих и арендованных задач во всех сегментах."""
+        return self._db.execute('SELECT COUNT(*) FROM tasks WHERE state IN (?, ?)',
+                                (self.PENDING, self.LEASED)).fetchone()[0]
+
+    def counts(self):
+        """Возвращает словарь с количеством задач в каждом состоянии."""
+        counts = dict((name, 0) for name in self.STATES)
+        for state, count in self._db.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state'):
+            counts[self.STATES[state]] = count
+        return counts
+
+    def close(self):
+        self._db.close()
+
+
+def _crawl_worker(path, shard, options, events):
+    """Рабочий процесс распределённого обхода. Получает в аренду задачи
+    своего сегмента, расширяет их пулом потоков через собственную сессию
+    и передаёт события обхода координатору через очередь events.
+    Завершается, когда во всей очереди не остаётся невыполненных задач.
+
+    """
+    from multiprocessing.pool import ThreadPool
+
+    queue = yaCrawlQueue(path, options['shards'], options['lease_time'], options['max_attempts'])
+    # Каждый процесс работает через собственный пул соединений и кэш
+    session = pyyaru.yaSession(options['access_token'], options['api_server'])
+    depth = options['depth']
+    owner = '%s:%s' % (socket.gethostname(), os.getpid())
+
+    def expand(node):
+        return _expand_node(node, depth, options['expand'], session)
+
+    pool = ThreadPool(options['workers'])
+    try:
+        while True:
+            batch = queue.lease(shard, owner, options['batch_size'])
+            if not batch:
+                if not queue.unfinished():
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            started = time.time()
+            done, failed = [], []
+            for node, obj, related, error in pool.imap_unordered(expand, batch):
+                if error is not None:
+                    failed.append(node[1])
+                    events.put(('error', (node[1], str(error))))
+                    continue
+
+                if node[2] == 0 and (node[1] == obj.id or queue.add(obj.id, node[0], 0, yaCrawlQueue.DONE)):
+                    events.put(('node', obj))
+
+                # Объекты последнего уровня не расширяются, поэтому сразу считаются выполненными
+                target_state = yaCrawlQueue.PENDING if node[2] + 1 < depth else yaCrawlQueue.DONE
+                added = queue.add_many([(target.id, target._type, node[2] + 1, target_state)
+                                        for relation, target in related])
+                for relation, target in related:
+                    events.put(('edge', (obj.id, relation, target.id)))
+                    if target.id in added:
+                        added.discard(target.id)
+                        events.put(('node', target))
+                done.append(node[1])
+
+            queue.complete(owner, done)
+            queue.fail(owner, failed)
+            events.put(('stats', (shard, len(batch), len(failed), time.time() - started)))
+    finally:
+        pool.close()
+        pool.join()
+        queue.close()
+        session.close()
+
+
+class yaCrawlCoordinator(object):
+    """Координатор обхода графа несколькими процессами.
+
+    Пространство URN делится на processes сегментов, каждый из которых
+    обходит отдельный рабочий процесс со своей сессией, пулом соединений
+    и пулом из workers потоков. Задачи хранятся в базе SQLite по пути path
+    (см. yaCrawlQueue) и выдаются процессам в аренду на lease_time секунд.
+    Аварийно завершившийся процесс перезапускается (не более max_restarts раз
+    на сегмент), а его незавершённые задачи возвращаются в работу по истечении
+    аренды. Ошибка загрузки отдельного объекта, в т.ч. сетевая, аварией процесса
+    не считается: задача отмечается неудавшейся, а координатору отправляется
+    событие 'error'. Прерванный обход продолжается при повторном запуске с той же базой.
+
+    События те же, что у yaCrawler; кроме того, выбрасываются события
+    ('error', (URN, сообщение)). После восстановления процесса связи
+    повторно обработанных объектов могут быть выброшены ещё раз.
+    Сводная статистика собирается в словарь stats, в том числе скорость
+    обработки ('rate', объектов в секунду) общая и по сегментам.
+
+    Пример:
+        coordinator = yaCrawlCoordinator(['/me/'], 'crawl.db', depth=3, processes=4)
+        for event in coordinator.crawl():
+            ...
+        print coordinator.stats['rate']
+
+    """
+
+    __logger = pyyaru.Logger()
+
+    def __init__(self, seeds, path, depth=1, expand=('friends',), processes=4, workers=4, batch_size=None,
+                 session=None, lease_time=60, max_attempts=3, max_restarts=3, poll_interval=0.5):
+        """seeds, depth, expand, workers, batch_size, session - см. yaCrawler;
+        из сессии берутся только токен доступа и адрес сервера;
+        path - путь к базе SQLite с очередью задач;
+        processes - количество рабочих процессов (сегментов);
+        lease_time - срок аренды задачи в секундах;
+        max_attempts - количество попыток обработать задачу;
+        max_restarts - количество перезапусков процесса одного сегмента;
+        poll_interval - пауза в секундах, когда у процесса нет задач.
+
+        """
+        for relation in expand:
+            if relation not in RELATIONS:
+                raise pyyaru.yaError('Unknown relation "%s". Valid choices: %s.' % (relation, sorted(RELATIONS)))
+
+        session = session or pyyaru.DEFAULT_SESSION
+        self.path = path
+        self.processes = processes
+        self.max_restarts = max_restarts
+        self.stats = {'fetched': 0, 'nodes': 0, 'edges': 0, 'errors': 0, 'restarts': 0,
+                      'elapsed': 0.0, 'rate': 0.0, 'shards': {}}
+
+        self._seeds = seeds
+        self._options = {
+            'shards': processes,
+            'depth': depth,
+            'expand': tuple(expand),
+            'workers': workers,
+            'batch_size': batch_size or workers * 4,
+            'access_token': session.access_token,
+            'api_server': session.api_server,
+            'lease_time': lease_time,
+            'max_attempts': max_attempts,
+            'poll_interval': poll_interval,
+        }
+
+    def _start(self, shard, events):
+        """Запускает рабочий процесс сегмента."""
+        import multiprocessing
+        process = multiprocessing.Process(target=_crawl_worker, args=(self.path, shard, self._options, events))
+        process.daemon = True
+        process.start()
+        return process
+
+    def _account(self, event, started):
+        """Учитывает событие в статистике. Вернёт False для служебных событий."""
+        kind, data = event
+        if kind == 'stats':
+            shard, fetched, errors, busy = data
+            shard_stats = self.stats['shards'].setdefault(shard, {'fetched': 0, 'errors': 0, 'busy': 0.0,
+                                                                  'rate': 0.0})
+            shard_stats['fetched'] += fetched
+            shard_stats['errors'] += errors
+            shard_stats['busy'] += busy
+            if shard_stats['busy']:
+                shard_stats['rate'] = shard_stats['fetched'] / shard_stats['busy']
+            self.stats['fetched'] += fetched
+            self.stats['errors'] += errors
+            self.stats['elapsed'] = time.time() - started
+            if self.stats['elapsed']:
+                self.stats['rate'] = self.stats['fetched'] / self.stats['elapsed']
+            return False
+        if kind == 'node':
+            self.stats['nodes'] += 1
+        elif kind == 'edge':
+            self.stats['edges'] += 1
+        return True
+
+    def crawl(self):
+        """Итератор, проходящий граф силами рабочих процессов.
+        См. yaCrawler.crawl().
+
+        """
+        import multiprocessing
+        import Queue
+
+        queue = yaCrawlQueue(self.path, self.processes, self._options['lease_time'], self._options['max_attempts'])
+        queue.add_many([(urn, node_type, depth, yaCrawlQueue.PENDING)
+                        for node_type, urn, depth in (_seed_node(seed) for seed in self._seeds)])
+
+        events = multiprocessing.Queue()
+        started = time.time()
+        restarts = dict((shard, 0) for shard in range(self.processes))
+        processes = dict((shard, self._start(shard, events)) for shard in range(self.processes))
+        checked = time.time()
+        try:
+            while processes:
+                try:
+                    event = events.get(timeout=self._options['poll_interval'])
+                except Queue.Empty:
+                    pass
+                else:
+                    if self._account(event, started):
+                        yield event
+                    # Пока другие процессы присылают события, аварийно завершившийся
+                    # процесс всё равно должен быть замечен не позднее чем через poll_interval
+                    if time.time() - checked < self._options['poll_interval']:
+                        continue
+
+                checked = time.time()
+                for shard, process in processes.items():
+                    if process.is_alive():
+                        continue
+                    process.join()
+                    del processes[shard]
+                    if process.exitcode == 0 or not queue.unfinished():
+                        continue
+                    if restarts[shard] < self.max_restarts:
+                        self.__logger.error('Crawl worker for shard %s exited with code %s, restarting.' %
+                                            (shard, process.exitcode))
+                        restarts[shard] += 1
+                        self.stats['restarts'] += 1
+                        processes[shard] = self._start(shard, events)
+                    else:
+                        # Остальные процессы ждут завершения всех задач, поэтому сегмент закрывается
+                        self.__logger.error('Crawl worker for shard %s failed too many times, abandoning shard.' %
+                                            shard)
+                        queue.abandon(shard)
+
+            # Дочитываем события, отправленные процессами перед завершением
+            while True:
+                try:
+                    event = events.get_nowait()
+                except Queue.Empty:
+                    break
+                if self._account(event, started):
+                    yield event
+        finally:
+            for process in processes.values():
+                process.terminate()
+                process.join()
+            self.stats['elapsed'] = time.time() - started
+            queue.close()
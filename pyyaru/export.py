@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""Выгрузка публикаций в столбцы для анализа данных.
+
+Публикации разбираются из xml прямо в столбцы, без создания объектов
+yaEntry: даты обновления хранятся массивом меток времени, типы и уровни
+доступа - кодами, а URN авторов - номерами в общей таблице строк.
+
+"""
+
+import calendar
+import datetime
+import io
+from array import array
+
+import pyyaru
+
+
+_POSTTYPES = pyyaru.URN_PREFIX + 'posttypes'
+
+
+def _parse_timestamp(value):
+    """Переводит дату в формате Atom (2010-06-01T12:00:00Z) в метку
+    времени Unix без обращения к strptime.
+
+    """
+    return calendar.timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                            int(value[11:13]), int(value[14:16]), int(value[17:19]), 0, 0, 0))
+
+
+class yaStringTable(object):
+    """Таблица строк: каждой различной строке сопоставляется номер.
+    Используется для хранения повторяющихся значений (URN авторов) в столбцах.
+
+    """
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def code(self, value):
+        """Возвращает номер строки, добавляя её в таблицу при необходимости."""
+        try:
+            return self._codes[value]
+        except KeyError:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+            return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+class yaEntryColumns(object):
+    """Порция публикаций в виде столбцов:
+    ids, titles (и contents, если включены) - списки строк;
+    updated - массив меток времени Unix (NaN, если дата не задана);
+    types, access - массивы кодов (номера в TYPES и ACCESS_LEVELS, -1 для неизвестных);
+    authors - массив номеров URN авторов в таблице strings (-1, если автор не задан).
+
+    """
+
+    TYPES = tuple(pyyaru.yaEntry._TYPES)
+    ACCESS_LEVELS = tuple(pyyaru.yaEntry._ACCESS_LEVELS)
+
+    _TYPE_CODES = dict((name, code) for code, name in enumerate(TYPES))
+    _ACCESS_CODES = dict((name, code) for code, name in enumerate(ACCESS_LEVELS))
+
+    def __init__(self, strings=None, content=False):
+        """strings - таблица строк (yaStringTable), общая для порций одной
+        выгрузки, чтобы номера авторов в них совпадали;
+        content - выгружать ли тексты публикаций.
+
+        """
+        self.strings = strings if strings is not None else yaStringTable()
+        self.ids = []
+        self.updated = array('d')
+        self.types = array('b')
+        self.access = array('b')
+        self.authors = array('l')
+        self.titles = []
+        self.contents = [] if content else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append_element(self, element):
+        """Добавляет публикацию из xml-элемента entry."""
+        ns_a = pyyaru.NS_A
+        ns_y = pyyaru.NS_Y
+
+        self.ids.append(element.findtext(ns_a + 'id'))
+        updated = element.findtext(ns_a + 'updated')
+        self.updated.append(_parse_timestamp(updated) if updated else float('nan'))
+
+        entry_type = -1
+        for category in element.iterchildren(ns_a + 'category'):
+            if category.get('scheme') == _POSTTYPES:
+                entry_type = self._TYPE_CODES.get(category.get('term'), -1)
+        self.types.append(entry_type)
+        self.access.append(self._ACCESS_CODES.get(element.findtext(ns_y + 'access') or 'public', -1))
+
+        author = element.find(ns_a + 'author')
+        author_id = author.findtext(ns_y + 'id') if author is not None else None
+        self.authors.append(self.strings.code(author_id) if author_id is not None else -1)
+
+        self.titles.append(element.findtext(ns_a + 'title') or '')
+        if self.contents is not None:
+            content = element.findtext(ns_a + 'content') or ''
+            self.contents.append(content.replace('&amp;', '&').replace('&lt;', '<'))
+
+    def append(self, entry):
+        """Добавляет уже созданный объект yaEntry."""
+        self.ids.append(entry.id)
+        updated = entry.__dict__.get('updated')
+        self.updated.append(calendar.timegm(updated.timetuple()) if updated is not None else float('nan'))
+        self.types.append(self._TYPE_CODES.get(entry.type, -1))
+        self.access.append(self._ACCESS_CODES.get(entry.access, -1))
+        author_id = (entry.__dict__.get('author') or {}).get('id')
+        self.authors.append(self.strings.code(author_id) if author_id is not None else -1)
+        self.titles.append(entry.__dict__.get('title') or '')
+        if self.contents is not None:
+            self.contents.append(entry.__dict__.get('content') or '')
+
+    def rows(self):
+        """Итератор, выбрасывающий строки порции в виде словарей
+        с раскодированными значениями.
+
+        """
+        for i in range(len(self.ids)):
+            updated = self.updated[i]
+            row = {
+                'id': self.ids[i],
+                'updated': datetime.datetime.utcfromtimestamp(updated) if updated == updated else None,
+                'type': self.TYPES[self.types[i]] if self.types[i] >= 0 else None,
+                'access': self.ACCESS_LEVELS[self.access[i]] if self.access[i] >= 0 else None,
+                'author': self.strings.values[self.authors[i]] if self.authors[i] >= 0 else None,
+                'title': self.titles[i],
+            }
+            if self.contents is not None:
+                row['content'] = self.contents[i]
+            yield row
+
+    def to_numpy(self):
+        """Возвращает словарь столбцов в виде массивов NumPy.
+        Числовые столбцы копируются одним блоком, так что массивы не зависят
+        от порции: её дальнейшее наполнение может перераспределить память
+        массивов array, на которую ссылался бы массив NumPy без копирования.
+        Требует установленного пакета numpy.
+
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise pyyaru.yaError('numpy is required for "to_numpy()".')
+
+        columns = {
+            'ids': numpy.array(self.ids, dtype=object),
+            'titles': numpy.array(self.titles, dtype=object),
+        }
+        for name in ('updated', 'types', 'access', 'authors'):
+            column = getattr(self, name)
+            columns[name] = numpy.frombuffer(column, dtype=column.typecode).copy() if len(column) else \
+                numpy.array([], dtype=column.typecode)
+        if self.contents is not None:
+            columns['contents'] = numpy.array(self.contents, dtype=object)
+        return columns
+
+    def parse(self, data, filter=None):
+        """Разбирает страницу коллекции публикаций (строку, либо поток) прямо
+        в столбцы. Если задано условие filter (yaFilter), добавляются только
+        подходящие публикации.
+        Вернёт пару из адреса следующей страницы (либо None) и признака того,
+        что встретилась публикация старше нижней границы даты условия.
+
+        """
+        return _parse_page(data, [self], filter)[1:]
+
+
+def _parse_page(data, chunks, filter=None, content=False, chunk_size=None):
+    """Разбирает страницу коллекции публикаций в последнюю порцию списка
+    chunks, начиная новую порцию при достижении chunk_size строк.
+    Вернёт кортеж из списка заполненных порций, адреса следующей страницы
+    и признака пересечения нижней границы даты условия filter.
+
+    """
+    if not hasattr(data, 'read'):
+        data = io.BytesIO(data)
+
+    ns_a = pyyaru.NS_A
+    entry_tag = ns_a + 'entry'
+    filled = []
+    crossed = False
+    next_url = None
+    root = None
+    for event, el in pyyaru.etree.iterparse(data, events=('start', 'end')):
+        if root is None:
+            root = el
+        elif event == 'end' and el.getparent() is root:
+            if el.tag == entry_tag:
+                if filter is None or filter.match(el):
+                    chunks[-1].append_element(el)
+                    if chunk_size is not None and len(chunks[-1]) >= chunk_size:
+                        filled.append(chunks[-1])
+                        chunks.append(yaEntryColumns(chunks[-1].strings, content))
+                elif filter.is_past(el.findtext(ns_a + 'updated')):
+                    crossed = True
+                root.remove(el)
+            elif el.tag == ns_a + 'link' and el.get('rel') == 'next':
+                next_url = el.get('href')
+    return filled, next_url, crossed
+
+
+def iter_columns(feed, chunk_size=10000, content=False, filter=None, session=None, stream=True):
+    """Проходит ленту публикаций постранично и выбрасывает порции yaEntryColumns
+    не более чем по chunk_size публикаций, так что расход памяти не зависит
+    от длины ленты. Номера авторов во всех порциях ссылаются на общую таблицу строк.
+
+    feed - лента: объект yaEntries, yaPerson или yaClub (их публикации),
+    либо адрес ресурса-коллекции публикаций;
+    content - выгружать ли тексты публикаций;
+    filter - условие отбора публикаций (yaFilter); проход прекращается,
+    как только встретится публикация старше нижней границы даты;
+    session - сессия для ленты, заданной адресом (по умолчанию DEFAULT_SESSION);
+    stream - разбирать ли ответы сервера потоком.
+
+    Пример:
+        for chunk in iter_columns(person, chunk_size=50000):
+            frame = pandas.DataFrame(chunk.to_numpy())
+
+    """
+    session = session or pyyaru.DEFAULT_SESSION
+    chunks = [yaEntryColumns(content=content)]
+
+    if isinstance(feed, (pyyaru.yaPerson, pyyaru.yaClub)):
+        session = feed._session
+        url = feed.links['posts']
+    elif isinstance(feed, pyyaru.yaEntries):
+        session = feed._session
+        url = feed.id
+        if feed.is_loaded():
+            # Уже загруженные публикации переносятся в столбцы, проход продолжается со следующей страницы
+            for entry in feed.objects:
+                if filter is None or filter.match_object(entry):
+                    chunks[-1].append(entry)
+                    if len(chunks[-1]) >= chunk_size:
+                        yield chunks[-1]
+                        chunks = [yaEntryColumns(chunks[-1].strings, content)]
+            url = feed.__dict__.get('links', {}).get('next')
+    else:
+        url = feed
+
+    while url is not None:
+        resource_data = pyyaru.yaResource(url, session).get(stream=stream)
+        try:
+            filled, url, crossed = _parse_page(resource_data[1], chunks, filter, content, chunk_size)
+        finally:
+            if stream and hasattr(resource_data[1], 'close'):
+                resource_data[1].close()
+        for chunk in filled:
+            yield chunk
+        del chunks[:-1]
+        if crossed:
+            break
+
+    if len(chunks[-1]):
+        yield chunks[-1]
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""Работа с множеством лент публикаций: объединённая лента нескольких
+пользователей и клубов, опрос лент с адаптивным интервалом.
+
+"""
+
+import calendar
+import heapq
+import itertools
+import random
+import threading
+import time
+
+import pyyaru
+
+
+def _timestamp(updated):
+    """Переводит дату обновления публикации (UTC) в метку времени Unix."""
+    return calendar.timegm(updated.timetuple())
+
+
+def _entry_key(entry):
+    """Ключ сортировки публикации: более поздние публикации идут раньше.
+    Публикации без даты обновления считаются самыми старыми.
+
+    """
+    updated = entry.__dict__.get('updated')
+    if updated is None:
+        return 0
+    return -_timestamp(updated)
+
+
+class _yaFeedCursor(object):
+    """Курсор по одной ленте публикаций. Держит в памяти только текущую
+    страницу ленты и, возможно, запрос следующей.
+
+    """
+
+    def __init__(self, timeline, collection):
+        self._timeline = timeline
+        self._page = collection.objects
+        self._position = 0
+        self._next = collection.__dict__.get('links', {}).get('next')
+        self._pending = None
+
+    def _fetch_next(self):
+        """Ставит загрузку следующей страницы в пул потоков ленты."""
+        self._pending = self._timeline._pool.apply_async(self._timeline._loader, (self._next,))
+        self._next = None
+
+    def pop(self):
+        """Возвращает очередную публикацию ленты, либо None, если лента закончилась."""
+        if self._position >= len(self._page):
+            if self._pending is None:
+                if self._next is None:
+                    return None
+                self._fetch_next()
+            page = self._pending.get()
+            self._pending = None
+            if page is None or not page.objects:
+                return None
+            self._page = page.objects
+            self._position = 0
+            self._next = page.__dict__.get('links', {}).get('next')
+
+        entry = self._page[self._position]
+        self._position += 1
+        # Последняя публикация страницы стала головой ленты - загружаем
+        # следующую страницу заранее, пока потребитель разбирает другие ленты
+        if self._timeline.prefetch and self._position == len(self._page) and self._next is not None:
+            self._fetch_next()
+        return entry
+
+
+class yaTimeline(object):
+    """Объединённая лента публикаций нескольких лент (пользователей, клубов,
+    произвольных ресурсов-коллекций публикаций).
+
+    Публикации выдаются в порядке убывания даты обновления (updated) слиянием
+    лент через кучу: в каждый момент в памяти находится лишь текущая страница
+    каждой ленты. Следующая страница ленты загружается, только когда
+    до неё доходит очередь (при prefetch=True - заблаговременно, в пуле потоков),
+    поэтому для получения нескольких последних публикаций тысячи лент
+    загружаются лишь их первые страницы. Первые страницы всех лент загружаются
+    одновременно. Публикации, доступные через несколько лент, выдаются один раз.
+    Предполагается, что каждая лента упорядочена по убыванию даты обновления,
+    как это делает сервер.
+
+    Пример:
+        persons = [pyyaru.yaPerson(id) for id in ids]
+        for entry in yaTimeline(persons).latest(20):
+            print entry.updated, entry.title
+
+    """
+
+    __logger = pyyaru.Logger()
+
+    def __init__(self, feeds, workers=None, prefetch=True, session=None):
+        """feeds - список лент: объектов yaEntries (загруженных или нет),
+        yaPerson и yaClub (используются их публикации), либо адресов
+        ресурсов-коллекций публикаций;
+        workers - количество одновременных загрузок (по умолчанию BATCH_WORKERS);
+        prefetch - загружать ли следующую страницу ленты заранее;
+        session - сессия для лент, заданных адресами (по умолчанию DEFAULT_SESSION).
+
+        """
+        self.feeds = list(feeds)
+        self.workers = workers or pyyaru.BATCH_WORKERS
+        self.prefetch = prefetch
+        self.session = session or pyyaru.DEFAULT_SESSION
+        self.stats = {'pages': 0, 'errors': 0, 'duplicates': 0}
+        self._pool = None
+        self._loader = None
+        # Счётчики страниц и ошибок изменяются потоками пула
+        self._lock = threading.Lock()
+
+    def _load(self, feed):
+        """Загружает страницу ленты. Выполняется в потоке пула.
+        Ошибки загрузки записываются в журнал, а лента считается закончившейся.
+
+        """
+        try:
+            if isinstance(feed, (pyyaru.yaPerson, pyyaru.yaClub)):
+                feed = pyyaru.yaEntries(feed.links['posts'], session=feed._session)
+            elif not isinstance(feed, pyyaru.yaEntries):
+                feed = pyyaru.yaEntries(feed, session=self.session)
+            if not feed.is_loaded():
+                feed.get()
+                with self._lock:
+                    self.stats['pages'] += 1
+        except pyyaru._fetch_errors() as e:
+            with self._lock:
+                self.stats['errors'] += 1
+            self.__logger.error('Unable to load feed "%s": %s' % (getattr(feed, 'id', feed), e))
+            return None
+        return feed
+
+    def iter(self):
+        """Итератор, выбрасывающий публикации объединённой ленты."""
+        from multiprocessing.pool import ThreadPool
+
+        # Потоки пула выполняются в рамках срока, действующего у вызывающего
+        self._loader = pyyaru.yaDeadline.bind(self._load)
+        self._pool = ThreadPool(self.workers)
+        try:
+            cursors = [_yaFeedCursor(self, feed) for feed in self._pool.map(self._loader, self.feeds)
+                       if feed is not None]
+
+            heap = []
+            for index, cursor in enumerate(cursors):
+                entry = cursor.pop()
+                if entry is not None:
+                    heap.append((_entry_key(entry), index, entry))
+            heapq.heapify(heap)
+
+            seen = set()
+            while heap:
+                key, index, entry = heap[0]
+                following = cursors[index].pop()
+                if following is not None:
+                    heapq.heapreplace(heap, (_entry_key(following), index, following))
+                else:
+                    heapq.heappop(heap)
+
+                if entry.id in seen:
+                    with self._lock:
+                        self.stats['duplicates'] += 1
+                    continue
+                seen.add(entry.id)
+                yield entry
+        finally:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            self._loader = None
+
+    def latest(self, count):
+        """Возвращает список из count последних публикаций объединённой ленты."""
+        return list(itertools.islice(self.iter(), count))
+
+
+class _yaWatchedFeed(object):
+    """Состояние отслеживаемой ленты."""
+
+    def __init__(self, key, feed, interval, due):
+        self.key = key
+        self.feed = feed
+        self.interval = interval
+        self.due = due
+        self.rate = None
+        self.polled = None
+        self.last_updated = None
+        self.last_ids = set()
+
+
+class yaFeedPoller(object):
+    """Планировщик опроса лент публикаций с адаптивным интервалом.
+
+    Для каждой ленты по датам обновления публикаций оценивается частота
+    появления новых публикаций (экспоненциальным сглаживанием с коэффициентом
+    smoothing), и интервал опроса подбирается так, чтобы за один опрос
+    в среднем появлялась одна новая публикация, в пределах от min_interval
+    до max_interval секунд. После неудачного опроса интервал увеличивается.
+    Моменты опроса сдвигаются на случайную долю jitter интервала, а впервые
+    добавленные ленты распределяются по первому интервалу, чтобы запросы
+    не шли пачками. Если задан ограничитель rate_limiter (yaRateLimiter),
+    каждый опрос дожидается его разрешения, так что опрос укладывается
+    в общий бюджет запросов; первыми опрашиваются самые просроченные ленты.
+
+    Опрос выполняется методом poll_due() пулом из workers потоков; его можно
+    вызывать из собственного цикла приложения, либо запустить опрос
+    в фоновом потоке методом start().
+    Новые публикации передаются функции callback(ключ ленты, список публикаций).
+
+    Пример:
+        def on_entries(key, entries):
+            for entry in entries:
+                print key, entry.title
+
+        poller = yaFeedPoller(on_entries, min_interval=60, max_interval=3600)
+        for person in persons:
+            poller.watch(person)
+        poller.start()
+
+    """
+
+    __logger = pyyaru.Logger()
+
+    def __init__(self, callback=None, min_interval=60, max_interval=3600, workers=None, session=None,
+                 rate_limiter=None, smoothing=0.5, backoff=2, jitter=0.1, report_existing=False):
+        """callback - функция, получающая новые публикации;
+        min_interval, max_interval - границы интервала опроса в секундах;
+        workers - количество одновременных опросов (по умолчанию BATCH_WORKERS);
+        session - сессия для лент, заданных адресами (по умолчанию DEFAULT_SESSION);
+        rate_limiter - ограничитель частоты опросов;
+        smoothing - коэффициент сглаживания оценки частоты публикаций;
+        backoff - множитель интервала после неудачного опроса;
+        jitter - доля интервала, на которую случайно сдвигается момент опроса;
+        report_existing - передавать ли в callback публикации, найденные
+        при первом опросе ленты.
+
+        """
+        self.callback = callback
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.workers = workers or pyyaru.BATCH_WORKERS
+        self.session = session or pyyaru.DEFAULT_SESSION
+        self.rate_limiter = rate_limiter
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self.jitter = jitter
+        self.report_existing = report_existing
+        self.stats = {'polls': 0, 'entries': 0, 'errors': 0}
+
+        self._feeds = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def watch(self, feed, key=None, now=None):
+        """Добавляет ленту для отслеживания. feed - объект yaEntries,
+        yaPerson или yaClub (отслеживаются их публикации), либо адрес
+        ресурса-коллекции публикаций (н.п. ленты друзей).
+        key - ключ ленты (по умолчанию её адрес или идентификатор объекта).
+        Вернёт ключ ленты.
+
+        """
+        if key is None:
+            key = getattr(feed, 'id', feed)
+        now = time.time() if now is None else now
+        with self._lock:
+            if key not in self._feeds:
+                # Первые опросы распределяются по интервалу, а не идут разом
+                due = now + random.uniform(0, self.min_interval)
+                self._feeds[key] = _yaWatchedFeed(key, feed, self.min_interval, due)
+        return key
+
+    def unwatch(self, key):
+        """Прекращает отслеживание ленты."""
+        with self._lock:
+            self._feeds.pop(key, None)
+
+    def interval(self, key):
+        """Возвращает текущий интервал опроса ленты в секундах."""
+        return self._feeds[key].interval
+
+    def next_due(self):
+        """Возвращает момент ближайшего опроса (метка времени Unix), либо None."""
+        with self._lock:
+            if not self._feeds:
+                return None
+            return min(watched.due for watched in self._feeds.values())
+
+    def _fetch(self, watched):
+        """Загружает публикации ленты, появившиеся со времени прошлого опроса.
+        Выполняется в потоке пула. Вернёт пару из ленты и списка
+        публикаций (None в случае ошибки).
+
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+        feed = watched.feed
+        try:
+            if isinstance(feed, (pyyaru.yaPerson, pyyaru.yaClub)):
+                feed = pyyaru.yaEntries(feed.links['posts'], session=feed._session)
+            elif isinstance(feed, pyyaru.yaEntries):
+                feed = pyyaru.yaEntries(feed.id, session=feed._session)
+            else:
+                feed = pyyaru.yaEntries(feed, session=self.session)
+            feed.get()
+
+            if watched.last_updated is None:
+                # При первом опросе смотрим лишь первую страницу, не перебирая всю ленту
+                return watched, list(feed.objects)
+
+            fresh = []
+            for entry in feed.iter():
+                updated = entry.__dict__.get('updated')
+                if updated is not None and updated < watched.last_updated:
+                    break
+                if updated == watched.last_updated and entry.id in watched.last_ids:
+                    continue
+                fresh.append(entry)
+        except pyyaru._fetch_errors() as e:
+            self.__logger.error('Unable to poll feed "%s": %s' % (watched.key, e))
+            return watched, None
+        return watched, fresh
+
+    def _reschedule(self, watched, entries, now):
+        """Обновляет оценку частоты публикаций ленты и назначает следующий опрос."""
+        first_poll = watched.last_updated is None
+        if entries is None:
+            watched.interval = min(self.max_interval, watched.interval * self.backoff)
+        else:
+            stamps = [entry.updated for entry in entries if entry.__dict__.get('updated') is not None]
+            if first_poll:
+                # Частота оценивается по датам публикаций первой страницы
+                sample = None
+                if len(stamps) > 1:
+                    sample = (len(stamps) - 1) / float(max(1, _timestamp(max(stamps)) - _timestamp(min(stamps))))
+            else:
+                # Новые публикации за время от последней известной публикации
+                sample = len(entries) / float(max(1, now - _timestamp(watched.last_updated)))
+
+            if sample is not None:
+                if watched.rate is None:
+                    watched.rate = sample
+                else:
+                    watched.rate = self.smoothing * sample + (1 - self.smoothing) * watched.rate
+            if watched.rate:
+                watched.interval = min(self.max_interval, max(self.min_interval, 1.0 / watched.rate))
+            else:
+                watched.interval = self.max_interval
+
+            if stamps and (watched.last_updated is None or max(stamps) >= watched.last_updated):
+                newest = max(stamps)
+                if newest != watched.last_updated:
+                    watched.last_ids = set()
+                watched.last_updated = newest
+                watched.last_ids.update(entry.id for entry in entries if entry.__dict__.get('updated') == newest)
+
+        watched.polled = now
+        watched.due = now + watched.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def poll_due(self, now=None):
+        """Опрашивает ленты, время опроса которых наступило.
+        Вернёт список пар (ключ ленты, список новых публикаций) для лент,
+        в которых появились новые публикации.
+
+        """
+        from multiprocessing.pool import ThreadPool
+
+        now = time.time() if now is None else now
+        with self._lock:
+            due = sorted((watched for watched in self._feeds.values() if watched.due <= now),
+                         key=lambda watched: watched.due)
+        if not due:
+            return []
+
+        results = []
+        pool = ThreadPool(min(self.workers, len(due)))
+        try:
+            for watched, entries in pool.imap(pyyaru.yaDeadline.bind(self._fetch), due):
+                self.stats['polls'] += 1
+                if entries is None:
+                    self.stats['errors'] += 1
+                first_poll = watched.last_updated is None
+                self._reschedule(watched, entries, time.time())
+                if not entries or (first_poll and not self.report_existing):
+                    continue
+                self.stats['entries'] += len(entries)
+                results.append((watched.key, entries))
+                if self.callback is not None:
+                    self.callback(watched.key, entries)
+        finally:
+            pool.close()
+            pool.join()
+        return results
+
+    def run(self):
+        """Опрашивает ленты до вызова stop(), ожидая между опросами
+        наступления времени ближайшего опроса.
+
+        """
+        while not self._stop.is_set():
+            self.poll_due()
+            next_due = self.next_due()
+            delay = self.max_interval if next_due is None else next_due - time.time()
+            self._stop.wait(min(self.max_interval, max(0, delay)))
+
+    def start(self):
+        """Запускает опрос в фоновом потоке."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Останавливает опрос в фоновом потоке."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Указатель публикаций в памяти: поиск загруженных публикаций по словам,
+типу, меткам, автору и дате обновления без перебора.
+
+"""
+
+import bisect
+import calendar
+import heapq
+import re
+import threading
+from collections import defaultdict
+
+import pyyaru
+
+
+_TAG_RE = re.compile(r'<[^>]*>')
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Разбивает текст на слова в нижнем регистре, отбрасывая html-разметку."""
+    if not text:
+        return []
+    if not isinstance(text, unicode):
+        text = pyyaru._to_unicode(text)
+    return _WORD_RE.findall(_TAG_RE.sub(' ', text).lower())
+
+
+def _timestamp(updated):
+    """Переводит дату обновления публикации (UTC) в метку времени Unix."""
+    return calendar.timegm(updated.timetuple())
+
+
+class yaEntryIndex(object):
+    """Указатель публикаций (объектов yaEntry) в памяти.
+
+    Содержит обратный указатель слов заголовка и текста публикаций,
+    а также указатели по типу, меткам (categories), URN автора и дате
+    обновления. Запрос пересекает множества, начиная с наименьшего, так что
+    время ответа определяется размером результата, а не количеством публикаций.
+    Повторно добавленная публикация (с тем же id) замещает прежнюю.
+
+    Указатель можно наполнять вручную методом update(), либо задать его
+    сессии (параметр index yaSession, для сессии по умолчанию - ENTRY_INDEX),
+    и тогда в него попадут все загружаемые публикации, в том числе очередные
+    порции коллекций при проходе iter().
+
+    Пример:
+        index = yaEntryIndex()
+        session = pyyaru.yaSession(access_token, index=index)
+        for entry in session.person('/me/').friends_entries().iter():
+            pass
+        for entry in index.search(u'python', type='text', limit=10):
+            print entry.title
+
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        """Создаёт пустые указатели. Блокировка при этом не заменяется."""
+        self._entries = {}
+        # Ключи сохраняются, чтобы удалить публикацию, изменённую после добавления
+        self._entry_keys = {}
+        self._docids = {}
+        self._next_docid = 0
+        self._words = defaultdict(set)
+        self._types = defaultdict(set)
+        self._categories = defaultdict(set)
+        self._authors = defaultdict(set)
+        self._stamps = {}
+        # Пары (метка времени, номер) упорядочиваются лениво, при первом запросе по дате
+        self._updated = []
+        self._updated_sorted = True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, entry_id):
+        return entry_id in self._docids
+
+    def _keys(self, entry):
+        """Возвращает ключи указателей публикации."""
+        author = entry.__dict__.get('author') or {}
+        words = set(tokenize(entry.__dict__.get('title')))
+        words.update(tokenize(entry.__dict__.get('content')))
+        return {
+            'words': words,
+            'type': entry.type,
+            'categories': set(entry.__dict__.get('categories') or ()),
+            'author': author.get('id'),
+        }
+
+    def update(self, entries):
+        """Добавляет публикации в указатель. Вернёт количество добавленных."""
+        count = 0
+        with self._lock:
+            for entry in entries:
+                if not isinstance(entry, pyyaru.yaEntry) or entry.__dict__.get('id') is None:
+                    continue
+                self._remove(entry.id)
+
+                docid = self._next_docid
+                self._next_docid += 1
+                self._docids[entry.id] = docid
+                self._entries[docid] = entry
+
+                keys = self._entry_keys[docid] = self._keys(entry)
+                for word in keys['words']:
+                    self._words[word].add(docid)
+                self._types[keys['type']].add(docid)
+                for category in keys['categories']:
+                    self._categories[category].add(docid)
+                if keys['author'] is not None:
+                    self._authors[keys['author']].add(docid)
+
+                updated = entry.__dict__.get('updated')
+                if updated is not None:
+                    stamp = _timestamp(updated)
+                    self._stamps[docid] = stamp
+                    if self._updated and self._updated_sorted and stamp < self._updated[-1][0]:
+                        self._updated_sorted = False
+                    self._updated.append((stamp, docid))
+                count += 1
+        return count
+
+    def add(self, entry):
+        """Добавляет публикацию в указатель."""
+        self.update([entry])
+
+    def _discard(self, mapping, key, docid):
+        """Удаляет номер из множества указателя, удаляя опустевшие множества."""
+        docids = mapping.get(key)
+        if docids is not None:
+            docids.discard(docid)
+            if not docids:
+                del mapping[key]
+
+    def _remove(self, entry_id):
+        """Удаляет публикацию из указателей. Вызывается под блокировкой."""
+        docid = self._docids.pop(entry_id, None)
+        if docid is None:
+            return False
+        del self._entries[docid]
+        keys = self._entry_keys.pop(docid)
+        for word in keys['words']:
+            self._discard(self._words, word, docid)
+        self._discard(self._types, keys['type'], docid)
+        for category in keys['categories']:
+            self._discard(self._categories, category, docid)
+        self._discard(self._authors, keys['author'], docid)
+        # Пара в списке дат остаётся и отбрасывается при запросе и упорядочивании
+        self._stamps.pop(docid, None)
+        return True
+
+    def remove(self, entry_id):
+        """Удаляет публикацию из указателя. Вернёт False, если её там не было."""
+        with self._lock:
+            return self._remove(entry_id)
+
+    def clear(self):
+        """Очищает указатель."""
+        with self._lock:
+            self._reset()
+
+    def _updated_range(self, since, until):
+        """Возвращает множество номеров публикаций, обновлённых в промежутке [since, until]."""
+        if not self._updated_sorted:
+            self._updated = sorted(pair for pair in self._updated if pair[1] in self._entries)
+            self._updated_sorted = True
+        low = 0 if since is None else bisect.bisect_left(self._updated, (_timestamp(since), -1))
+        high = len(self._updated)
+        if until is not None:
+            high = bisect.bisect_right(self._updated, (_timestamp(until), self._next_docid))
+        return set(docid for stamp, docid in self._updated[low:high] if docid in self._entries)
+
+    def search(self, words=None, type=None, category=None, author=None, since=None, until=None, limit=None):
+        """Ищет публикации, удовлетворяющие всем заданным условиям:
+        words - слова (строка или список слов), каждое из которых должно
+        встречаться в заголовке или тексте публикации;
+        type - тип публикации;
+        category - метка публикации;
+        author - URN автора;
+        since, until - границы даты обновления (datetime, UTC) включительно.
+        Вернёт список публикаций (не более limit) в порядке убывания даты обновления.
+
+        """
+        with self._lock:
+            candidates = []
+            if words is not None:
+                if isinstance(words, basestring):
+                    words = tokenize(words)
+                else:
+                    words = [word for item in words for word in tokenize(item)]
+                for word in words:
+                    candidates.append(self._words.get(word, ()))
+            if type is not None:
+                candidates.append(self._types.get(type, ()))
+            if category is not None:
+                candidates.append(self._categories.get(category, ()))
+            if author is not None:
+                candidates.append(self._authors.get(author, ()))
+
+            if candidates:
+                candidates.sort(key=len)
+                result = set(candidates[0])
+                for docids in candidates[1:]:
+                    if not result:
+                        break
+                    result.intersection_update(docids)
+                if since is not None or until is not None:
+                    # Отбор по дате среди немногих кандидатов дешевле прохода по списку дат
+                    low = None if since is None else _timestamp(since)
+                    high = None if until is None else _timestamp(until)
+                    result = set(docid for docid in result if docid in self._stamps
+                                 and (low is None or self._stamps[docid] >= low)
+                                 and (high is None or self._stamps[docid] <= high))
+            elif since is not None or until is not None:
+                result = self._updated_range(since, until)
+            else:
+                result = set(self._entries)
+
+            def key(docid):
+                return self._stamps.get(docid, 0)
+
+            if limit is not None:
+                ordered = heapq.nlargest(limit, result, key=key)
+            else:
+                ordered = sorted(result, key=key, reverse=True)
+            return [self._entries[docid] for docid in ordered]
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""Загрузка аватаров и прочих медиаданных с сохранением на диске.
+
+Файлы хранятся под именами, полученными из хэша их содержимого, так что
+одинаковые изображения (например, аватар по умолчанию) хранятся однократно.
+Устаревшие копии проверяются условными запросами (If-None-Match,
+If-Modified-Since) и загружаются заново, только если изменились.
+
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import pyyaru
+
+
+# Размер порции, которыми тело ответа переписывается в файл.
+CHUNK_SIZE = 64 * 1024
+
+
+class _yaByteBudget(object):
+    """Ограничение суммарного объёма одновременно загружаемых данных."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size):
+        """Резервирует size байт, дожидаясь освобождения бюджета.
+        Загрузка, превышающая весь бюджет, резервирует его целиком.
+        Вернёт зарезервированный объём.
+
+        """
+        size = min(size, self.limit)
+        with self._condition:
+            while self.used and self.used + size > self.limit:
+                self._condition.wait()
+            self.used += size
+        return size
+
+    def release(self, size):
+        """Освобождает зарезервированные байты."""
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+class yaMediaCache(object):
+    """Дисковый кэш медиаданных (аватаров, изображений публикаций).
+
+    Загружает множество адресов одновременно через пул соединений сессии,
+    переписывая ответы в файлы порциями, без чтения в память целиком.
+    Копия, загруженная не ранее max_age секунд назад, выдаётся без обращения
+    к серверу; более старая проверяется условным запросом.
+    Суммарный объём одновременно загружаемых ответов ограничен max_in_flight;
+    ответы неизвестной длины загружаются по одному.
+
+    Пример:
+        cache = yaMediaCache('userpics')
+        for person_id, path in cache.userpics(me.friends()).items():
+            print person_id, path
+
+    """
+
+    __logger = pyyaru.Logger()
+
+    def __init__(self, path, max_age=86400, workers=None, max_in_flight=8 * 1024 * 1024, session=None):
+        """path - каталог кэша;
+        max_age - время в секундах, в течение которого копия не проверяется (None - не проверять никогда);
+        workers - количество одновременных загрузок (по умолчанию BATCH_WORKERS);
+        max_in_flight - наибольший суммарный объём одновременно загружаемых ответов в байтах;
+        session - сессия для запросов (по умолчанию DEFAULT_SESSION).
+
+        """
+        self.path = path
+        self.max_age = max_age
+        self.workers = workers or pyyaru.BATCH_WORKERS
+        self.session = session or pyyaru.DEFAULT_SESSION
+        self.stats = {'downloaded': 0, 'revalidated': 0, 'fresh': 0, 'errors': 0, 'bytes': 0}
+        self._budget = _yaByteBudget(max_in_flight)
+        self._index = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        if os.path.exists(self._index_path()):
+            self._load()
+
+    def _index_path(self):
+        return os.path.join(self.path, 'index.json')
+
+    def _object_path(self, digest):
+        """Возвращает путь к файлу с содержимым, имеющим хэш digest."""
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def cached(self, url):
+        """Возвращает путь к сохранённой копии url без обращения к серверу, либо None."""
+        with self._lock:
+            record = self._index.get(url)
+        if record is None:
+            return None
+        path = self._object_path(record['sha1'])
+        return path if os.path.exists(path) else None
+
+    def fetch(self, url, timeout=None):
+        """Возвращает путь к локальной копии url, загружая либо проверяя её
+        при необходимости. Параметр timeout ограничивает время загрузки в секундах.
+        Одновременные запросы одного адреса из разных потоков выполняются однократно.
+
+        """
+        path = self._fetch_once(url, timeout)
+        self.save()
+        return path
+
+    def fetch_many(self, urls, timeout=None):
+        """Загружает адреса urls одновременно.
+        Вернёт словарь путей к локальным копиям по адресам; для адресов,
+        загрузить которые не удалось, значением будет None.
+        Параметр timeout ограничивает время загрузки каждого адреса в секундах.
+
+        """
+        urls = list(set(url for url in urls if url))
+
+        def fetch(url):
+            # Сбой одного адреса (в т.ч. сетевой, либо записи на диск) не прерывает остальные
+            try:
+                return url, self._fetch_once(url, timeout)
+            except pyyaru._fetch_errors() + (EnvironmentError,) as e:
+                self.__logger.error('Unable to fetch "%s": %s' % (url, e))
+                with self._lock:
+                    self.stats['errors'] += 1
+                return url, None
+
+        try:
+            return dict(pyyaru._map_concurrently(fetch, urls, self.workers, ordered=False))
+        finally:
+            self.save()
+
+    def userpics(self, persons, timeout=None):
+        """Загружает аватары пользователей persons (списка объектов yaPerson,
+        либо загруженной коллекции yaPersons).
+        Вернёт словарь путей к файлам аватаров по идентификаторам пользователей
+        (None, если аватар не задан или загрузить его не удалось).
+
+        """
+        if isinstance(persons, pyyaru.yaPersons):
+            persons = persons.objects
+        urls = dict((person.id, person.__dict__.get('links', {}).get('userpic')) for person in persons)
+        paths = self.fetch_many(urls.values(), timeout)
+        return dict((person_id, paths.get(url)) for person_id, url in urls.items())
+
+    def _fetch_once(self, url, timeout):
+        """Загружает адрес, дожидаясь завершения его загрузки другим потоком, если она уже идёт."""
+        while True:
+            with self._lock:
+                event = self._pending.get(url)
+                if event is None:
+                    event = self._pending[url] = threading.Event()
+                    break
+            event.wait()
+        try:
+            return self._fetch(url, timeout)
+        finally:
+            with self._lock:
+                del self._pending[url]
+            event.set()
+
+    def _fetch(self, url, timeout):
+        """Возвращает путь к локальной копии url. См. fetch()."""
+        with self._lock:
+            record = self._index.get(url)
+
+        headers = {}
+        if record is not None and os.path.exists(self._object_path(record['sha1'])):
+            if self.max_age is None or time.time() - record['checked'] < self.max_age:
+                with self._lock:
+                    self.stats['fresh'] += 1
+                return self._object_path(record['sha1'])
+            if record.get('etag'):
+                headers['If-None-Match'] = record['etag']
+            if record.get('modified'):
+                headers['If-Modified-Since'] = record['modified']
+        else:
+            record = None
+
+        stream = pyyaru.yaResource(url, self.session).open(headers, timeout)
+        try:
+            if stream.status == 304 and record is not None:
+                record = dict(record, checked=time.time())
+                with self._lock:
+                    self._index[url] = record
+                    self.stats['revalidated'] += 1
+                return self._object_path(record['sha1'])
+
+            digest, size = self._download(stream)
+            record = {
+                'sha1': digest,
+                'etag': stream.getheader('ETag'),
+                'modified': stream.getheader('Last-Modified'),
+                'type': stream.getheader('Content-Type'),
+                'checked': time.time(),
+            }
+        finally:
+            stream.close()
+
+        with self._lock:
+            self._index[url] = record
+            self.stats['downloaded'] += 1
+            self.stats['bytes'] += size
+        return self._object_path(digest)
+
+    def _download(self, stream):
+        """Переписывает тело ответа в файл кэша, вычисляя хэш содержимого.
+        Вернёт пару из хэша и размера.
+
+        Ответ резервирует бюджет по заголовку Content-Length, а ответ
+        неизвестной длины - весь бюджет, так что бюджет превышается лишь
+        единственным ответом, который больше его целиком.
+
+        """
+        length = stream.getheader('Content-Length')
+        reserved = self._budget.acquire(int(length) if length and length.isdigit() else self._budget.limit)
+        try:
+            descriptor, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+            try:
+                sha1 = hashlib.sha1()
+                size = 0
+                media_file = os.fdopen(descriptor, 'wb')
+                try:
+                    while True:
+                        chunk = stream.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        sha1.update(chunk)
+                        size += len(chunk)
+                        media_file.write(chunk)
+                finally:
+                    media_file.close()
+
+                digest = sha1.hexdigest()
+                path = self._object_path(digest)
+                with self._lock:
+                    if os.path.exists(path):
+                        # Такое содержимое уже сохранено по другому адресу
+                        os.remove(temp_path)
+                    else:
+                        if not os.path.isdir(os.path.dirname(path)):
+                            os.makedirs(os.path.dirname(path))
+                        os.rename(temp_path, path)
+            except:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        finally:
+            self._budget.release(reserved)
+        return digest, size
+
+    def save(self):
+        """Записывает указатель адресов кэша в файл."""
+        with self._lock:
+            state = {'v': 1, 'urls': self._index.copy()}
+        with self._save_lock:
+            pyyaru._dump_json_atomic(self._index_path(), state)
+
+    def _load(self):
+        """Восстанавливает указатель адресов кэша из файла."""
+        index_file = open(self._index_path(), 'rb')
+        try:
+            state = json.load(index_file)
+        finally:
+            index_file.close()
+        self._index = state['urls']
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""Слежение за составом друзей пользователей и членов клубов: компактные
+снимки множеств идентификаторов и их разности.
+
+"""
+
+import base64
+import bisect
+import io
+import json
+import os
+import struct
+import threading
+import time
+from array import array
+
+import pyyaru
+
+
+# Отношения, состав которых можно отслеживать: имя отношения -> (тип объекта, ссылка на коллекцию в links).
+RELATIONS = {
+    'friends': ('person', 'friends'),
+    'members': ('club', 'club_members'),
+}
+
+
+def _split_urn(urn):
+    """Разделяет URN на префикс и числовой номер. Вернёт None, если номер не числовой."""
+    position = urn.rfind('/') + 1
+    try:
+        return urn[:position], int(urn[position:])
+    except ValueError:
+        return None
+
+
+class yaMembershipSnapshot(object):
+    """Снимок состава коллекции (друзей пользователя или членов клуба):
+    упорядоченное множество URN её элементов.
+
+    URN вида urn:ya.ru:person/<номер> хранятся номерами в массиве (8 байт
+    на элемент), так что снимок клуба из сотен тысяч членов занимает
+    единицы мегабайт; прочие URN хранятся упорядоченным списком строк.
+    В файл номера записываются 8-байтовыми целыми с порядком байтов
+    little-endian независимо от платформы.
+    Проверка вхождения выполняется двоичным поиском, а разность снимков -
+    слиянием упорядоченных последовательностей за линейное время.
+
+    """
+
+    def __init__(self, urns=(), taken=None):
+        """urns - URN элементов коллекции;
+        taken - время снимка (метка времени Unix, по умолчанию текущее).
+
+        """
+        self.taken = taken if taken is not None else time.time()
+        self.prefix = None
+        self.ids = []
+
+        urns = set(urns)
+        split = [_split_urn(urn) for urn in urns]
+        prefixes = set(item[0] for item in split if item is not None)
+        if urns and None not in split and len(prefixes) == 1:
+            try:
+                self.ids = array('L', sorted(item[1] for item in split))
+                self.prefix = prefixes.pop()
+            except OverflowError:
+                pass
+        if self.prefix is None:
+            self.ids = sorted(urns)
+
+    def _key(self, urn):
+        """Возвращает ключ URN в упорядоченной последовательности снимка, либо None."""
+        if self.prefix is None:
+            return urn
+        split = _split_urn(urn)
+        if split is None or split[0] != self.prefix:
+            return None
+        return split[1]
+
+    def _urn(self, key):
+        """Восстанавливает URN по ключу."""
+        if self.prefix is None:
+            return key
+        return '%s%s' % (self.prefix, key)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, urn):
+        key = self._key(urn)
+        if key is None:
+            return False
+        position = bisect.bisect_left(self.ids, key)
+        return position < len(self.ids) and self.ids[position] == key
+
+    def __iter__(self):
+        """Проходит URN элементов снимка по возрастанию."""
+        for key in self.ids:
+            yield self._urn(key)
+
+    def diff(self, previous):
+        """Сравнивает снимок с предыдущим снимком previous.
+        Вернёт пару списков URN: добавившиеся и выбывшие элементы.
+
+        """
+        if self.prefix != previous.prefix:
+            # Снимки хранятся по-разному: сравниваются множества URN
+            current = set(self)
+            former = set(previous)
+            return sorted(current - former), sorted(former - current)
+
+        added = []
+        removed = []
+        new, old = self.ids, previous.ids
+        i = j = 0
+        while i < len(new) and j < len(old):
+            if new[i] == old[j]:
+                i += 1
+                j += 1
+            elif new[i] < old[j]:
+                added.append(self._urn(new[i]))
+                i += 1
+            else:
+                removed.append(self._urn(old[j]))
+                j += 1
+        added.extend(self._urn(key) for key in new[i:])
+        removed.extend(self._urn(key) for key in old[j:])
+        return added, removed
+
+    def dump(self):
+        """Возвращает снимок в виде словаря для записи в файл."""
+        if self.prefix is None:
+            return {'taken': self.taken, 'urns': self.ids}
+        ids = struct.pack('<%sQ' % len(self.ids), *self.ids)
+        return {'taken': self.taken, 'prefix': self.prefix, 'format': '<Q', 'ids': base64.b64encode(ids)}
+
+    @classmethod
+    def load(cls, state):
+        """Восстанавливает снимок из словаря, полученного от dump()."""
+        snapshot = cls(taken=state['taken'])
+        if 'prefix' not in state:
+            snapshot.ids = sorted(state['urns'])
+            return snapshot
+
+        data = base64.b64decode(state['ids'])
+        if state.get('format') != '<Q' or len(data) % 8:
+            raise pyyaru.yaError('Unsupported membership snapshot format "%s".' % state.get('format'))
+        ids = struct.unpack('<%sQ' % (len(data) // 8), data)
+        try:
+            snapshot.ids = array('L', ids)
+            snapshot.prefix = state['prefix']
+        except OverflowError:
+            # Номера не умещаются в массив этой платформы: снимок хранится строками
+            return cls(['%s%s' % (state['prefix'], key) for key in ids], state['taken'])
+        return snapshot
+
+
+def _iter_page_ids(data, item_tag):
+    """Проходит страницу коллекции (строку, либо поток), выбрасывая URN
+    её элементов с полным именем тэга item_tag; объекты элементов не создаются.
+    Последним выбрасывается адрес следующей страницы (либо None).
+
+    """
+    if not hasattr(data, 'read'):
+        data = io.BytesIO(data)
+
+    next_url = None
+    root = None
+    for event, el in pyyaru.etree.iterparse(data, events=('start', 'end')):
+        if root is None:
+            root = el
+        elif event == 'end' and el.getparent() is root:
+            ns = el.tag[:el.tag.find('}') + 1]
+            if el.tag == ns + 'link':
+                if el.get('rel') == 'next':
+                    next_url = el.get('href')
+            elif el.tag == item_tag:
+                item_id = el.findtext(ns + 'id')
+                if item_id is not None:
+                    yield item_id
+            root.remove(el)
+    yield next_url
+
+
+def _item_tag(url, resource_type, session):
+    """Возвращает полное имя тэга элементов коллекции по типу ресурса
+    из заголовка Content-Type (см. yaCollection._item_tag()).
+
+    """
+    # Для лент публикаций тип ресурса сервером не задаётся (см. yaBase.get())
+    collection_class = getattr(pyyaru, pyyaru.URN_TYPES.get(resource_type or 'entries', 'yaBase'))
+    if not issubclass(collection_class, pyyaru.yaCollection):
+        raise pyyaru.yaObjectTypeMismatchError('Data type "%s" defined by resource "%s" is not a collection'
+                                               % (resource_type, url))
+    return collection_class(url, session=session)._item_tag()[1]
+
+
+def iter_ids(url, session=None, stream=True):
+    """Итератор, проходящий все страницы ресурса-коллекции url и выбрасывающий
+    URN её элементов без создания объектов.
+
+    """
+    session = session or pyyaru.DEFAULT_SESSION
+    while url is not None:
+        resource_data = pyyaru.yaResource(url, session).get(stream=stream)
+        try:
+            items = list(_iter_page_ids(resource_data[1], _item_tag(url, resource_data[0], session)))
+        finally:
+            if stream and hasattr(resource_data[1], 'close'):
+                resource_data[1].close()
+        url = items.pop()
+        for item_id in items:
+            yield item_id
+
+
+def take_snapshot(subject, relation=None, session=None):
+    """Делает снимок состава коллекции:
+    subject - пользователь (yaPerson), клуб (yaClub), либо их идентификатор,
+    или же адрес ресурса-коллекции, если relation не задано;
+    relation - 'friends' (друзья пользователя) или 'members' (члены клуба).
+
+    Пример:
+        before = take_snapshot(club, 'members')
+        ...
+        joined, left = take_snapshot(club, 'members').diff(before)
+
+    """
+    if relation is None:
+        return yaMembershipSnapshot(iter_ids(subject, session))
+
+    if relation not in RELATIONS:
+        raise pyyaru.yaError('Unknown relation "%s". Valid choices: %s.' % (relation, sorted(RELATIONS)))
+    subject_type, link = RELATIONS[relation]
+    if isinstance(subject, basestring):
+        cl = getattr(pyyaru, pyyaru.URN_TYPES[subject_type])
+        subject = cl(subject, session=session)
+    return yaMembershipSnapshot(iter_ids(subject.links[link], subject._session))
+
+
+class yaMembershipMonitor(object):
+    """Наблюдатель за составом друзей пользователей и членов клубов.
+    Хранит последний снимок каждой отслеживаемой коллекции и при очередной
+    проверке сообщает о добавившихся и выбывших элементах.
+    Если задан путь path, снимки сохраняются в файл и восстанавливаются
+    из него при создании наблюдателя.
+
+    Пример:
+        monitor = yaMembershipMonitor('membership.json')
+        changes = monitor.check([(me, 'friends'), (club, 'members')])
+        for (subject_id, relation), (added, removed) in changes.items():
+            print subject_id, relation, len(added), len(removed)
+
+    """
+
+    __logger = pyyaru.Logger()
+
+    def __init__(self, path=None, workers=None, session=None):
+        """path - путь к файлу снимков;
+        workers - количество одновременно проверяемых коллекций (по умолчанию BATCH_WORKERS);
+        session - сессия для объектов, заданных идентификаторами (по умолчанию DEFAULT_SESSION).
+
+        """
+        self.path = path
+        self.workers = workers or pyyaru.BATCH_WORKERS
+        self.session = session or pyyaru.DEFAULT_SESSION
+        self.snapshots = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self._load()
+
+    def _take(self, task):
+        """Делает снимок коллекции. Выполняется в потоке пула.
+        Вернёт кортеж из ключа снимка (URN объекта, отношение), снимка
+        и исключения (None в случае успеха).
+
+        """
+        subject, relation = task
+        if isinstance(subject, basestring):
+            subject_type = RELATIONS[relation][0]
+            subject = getattr(pyyaru, pyyaru.URN_TYPES[subject_type])(subject, session=self.session)
+        try:
+            snapshot = take_snapshot(subject, relation)
+        except pyyaru._fetch_errors() as e:
+            return (subject.id, relation), None, e
+        # Объект загружен, и его идентификатор - URN
+        return (subject.id, relation), snapshot, None
+
+    def check(self, subjects):
+        """Проверяет состав коллекций subjects - списка пар (объект или
+        его идентификатор, отношение 'friends' или 'members').
+        Вернёт словарь пар списков URN (добавившиеся, выбывшие) по ключам
+        (идентификатор объекта, отношение). Для коллекций, проверяемых впервые,
+        значением будет None. Коллекции, загрузить которые не удалось,
+        в результат не попадают.
+
+        """
+        subjects = list(subjects)
+        for subject, relation in subjects:
+            if relation not in RELATIONS:
+                raise pyyaru.yaError('Unknown relation "%s". Valid choices: %s.' % (relation, sorted(RELATIONS)))
+
+        changes = {}
+        for key, snapshot, error in pyyaru._map_concurrently(self._take, subjects, self.workers, ordered=False):
+            if error is not None:
+                self.__logger.error('Unable to check %s of "%s": %s' % (key[1], key[0], error))
+                continue
+            with self._lock:
+                previous = self.snapshots.get(key)
+                self.snapshots[key] = snapshot
+            changes[key] = snapshot.diff(previous) if previous is not None else None
+        self.save()
+        return changes
+
+    def save(self):
+        """Записывает снимки в файл, если он задан."""
+        if self.path is None:
+            return
+        with self._lock:
+            state = {'v': 1, 'snapshots': [[key[0], key[1], snapshot.dump()]
+                                           for key, snapshot in self.snapshots.items()]}
+        pyyaru._dump_json_atomic(self.path, state)
+
+    def _load(self):
+        """Восстанавливает снимки из файла."""
+        snapshots_file = open(self.path, 'rb')
+        try:
+            state = json.load(snapshots_file)
+        finally:
+            snapshots_file.close()
+        for subject_id, relation, snapshot in state['snapshots']:
+            self.snapshots[(subject_id, relation)] = yaMembershipSnapshot.load(snapshot)
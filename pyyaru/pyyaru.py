@@ -8,14 +8,43 @@
 import logging
 import os
 import datetime
-import httplib
 import urlparse
-from collections import defaultdict
-from lxml import etree
+import socket
+import threading
+import time
+import io
+import zlib
+from collections import OrderedDict, defaultdict, deque
 from __init__ import VERSION
 
+
+class _LazyModule(object):
+    """Модуль, импортируемый при первом обращении к его содержимому.
+    Позволяет не тратить время на импорт тяжеловесных модулей (lxml, httplib)
+    при импорте pyyaru.
+
+    """
+
+    def __init__(self, name):
+        self.__name = name
+
+    def __getattr__(self, name):
+        module = __import__(self.__name, fromlist=['__name__'])
+        value = getattr(module, name)
+        # Последующие обращения обойдутся без __getattr__
+        setattr(self, name, value)
+        return value
+
+
+etree = _LazyModule('lxml.etree')
+httplib = _LazyModule('httplib')
+
 LOG_LEVEL = logging.ERROR
 
+# Если флаг выставлен, тело ответа сервера не вычитывается в память целиком,
+# а отдаётся потоком непосредственно в инкрементальный парсер lxml.
+STREAM_RESPONSES = False
+
 API_SERVER = 'https://api-yaru.yandex.ru'
 
 URN_PREFIX = 'urn:ya.ru:'
@@ -36,19 +65,98 @@ NAMESPACES = {
     'thr': 'http://purl.org/syndication/thread/1.0',
 }
 
+# Префиксы пространств имён для формирования имён xml-тэгов.
+NS_A = '{%s}' % NAMESPACES['a']
+NS_Y = '{%s}' % NAMESPACES['y']
+NS_THR = '{%s}' % NAMESPACES['thr']
+
+# Количество одновременных соединений, используемых пакетными операциями.
+BATCH_WORKERS = 4
+
+# Таймауты в секундах: установки соединения с сервером и ожидания очередной
+# порции данных от него. None означает ожидание без ограничения.
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+# Строгий автономный режим: если флаг выставлен, обращение к незагруженным
+# свойствам объектов не приводит к запросу на сервер, а возбуждает yaOfflineError.
+OFFLINE = False
+
+# Очередь отложенной записи (yaWriteQueue). Если задана, публикации
+# (смена настроения, комментарии, дружба, вступление в клубы) ставятся в очередь,
+# а вызывающему сразу возвращается объект yaFuture.
+WRITE_QUEUE = None
+
+# Указатель публикаций (pyyaru.index.yaEntryIndex). Если задан, в него
+# автоматически попадают все публикации, загруженные с сервера.
+ENTRY_INDEX = None
+
+# Кэш элементов коллекций (yaItemCache). Если задан, неизменившиеся с прошлой
+# загрузки элементы коллекций не разбираются повторно.
+ITEM_CACHE = None
+
 ACCESS_TOKEN = None
 
 # Если в директории библиотеки лежит файл token в формате JSON, полученный
 # в ходе авторизации OAuth 2 и ACCESS_TOKEN не задан, то берем реквизиты из этого файла.
-token_filepath = '%s/token' % os.path.dirname(os.path.realpath(__file__))
-if os.path.exists(token_filepath) and ACCESS_TOKEN is None:
-    token_file = open(token_filepath, 'rb')
-    token = eval(token_file.read())
-    if isinstance(token, dict):
-        ACCESS_TOKEN = token['access_token']
-    token_file.close()
+# Файл читается при первом запросе к серверу (см. load_token_file()).
+TOKEN_FILEPATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'token')
+
+# Журнал пакета: журналы всех его модулей (pyyaru.crawler.yaCrawler и т.п.) - его потомки.
+_LOGGER_NAME = __name__.split('.')[0]
+
+# Библиотека не настраивает журналирование самостоятельно (см. configure_logging()).
+logging.getLogger(_LOGGER_NAME).addHandler(logging.NullHandler())
+
 
-logging.basicConfig(level=LOG_LEVEL, format="** %(asctime)s - %(name)s - %(levelname)s\n%(message)s\n")
+def configure_logging(level=None):
+    """Настраивает вывод журнала pyyaru в stderr с уровнем level
+    (по умолчанию LOG_LEVEL). Настройка действует на журналы всех модулей
+    пакета; корневой журнал приложения не затрагивается.
+
+    """
+    logger = logging.getLogger(_LOGGER_NAME)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("** %(asctime)s - %(name)s - %(levelname)s\n%(message)s\n"))
+    logger.addHandler(handler)
+    logger.setLevel(level or LOG_LEVEL)
+    return logger
+
+
+_file_token = None
+_file_token_loaded = False
+
+
+def load_token_file(filepath=None):
+    """Возвращает токен доступа (access_token) из файла в формате JSON,
+    полученного в ходе авторизации OAuth 2, либо None.
+    Файл по умолчанию (TOKEN_FILEPATH) читается лишь однажды.
+
+    """
+    global _file_token, _file_token_loaded
+    if filepath is None:
+        if _file_token_loaded:
+            return _file_token
+        _file_token = load_token_file(TOKEN_FILEPATH)
+        _file_token_loaded = True
+        return _file_token
+
+    if not os.path.exists(filepath):
+        return None
+
+    import json
+    token_file = open(filepath, 'rb')
+    try:
+        token = json.load(token_file)
+    except ValueError as e:
+        logging.getLogger(__name__).error('Unable to read token file "%s": %s' % (filepath, e))
+        return None
+    finally:
+        token_file.close()
+
+    if isinstance(token, dict):
+        return token.get('access_token')
+    return None
 
 
 class yaError(Exception):
@@ -106,6 +214,29 @@ class yaAccessForbiddenError(yaError):
     pass
 
 
+class yaOfflineError(yaError):
+    """Ошибка обращения к незагруженному свойству объекта в строгом автономном режиме."""
+
+
+class yaTimeoutError(yaError):
+    """Ошибка превышения времени ожидания ответа сервера, либо срока выполнения (yaDeadline)."""
+    pass
+
+
+class yaConnectionError(yaError):
+    """Ошибка установки соединения с сервером: запрос не был отправлен."""
+    pass
+
+
+def _fetch_errors():
+    """Ошибки загрузки ресурса: ошибки модуля, а также сбои сети и ошибки разбора
+    испорченного ответа, не приводимые к yaError.
+    Используется пакетными операциями, чтобы сбой одного ресурса не прерывал остальные.
+
+    """
+    return (yaError, httplib.HTTPException, socket.error, etree.XMLSyntaxError)
+
+
 class Logger(object):
     """Класс логирования."""
 
@@ -119,15 +250,212 @@ class Logger(object):
         return self._logger
 
 
+class yaFuture(object):
+    """Результат операции, выполняемой в фоне."""
+
+    def __init__(self):
+        self._finished = threading.Event()
+        self._result = None
+        self._exception = None
+
+    def set_result(self, result):
+        """Выставляет результат операции."""
+        self._result = result
+        self._finished.set()
+
+    def set_exception(self, exception):
+        """Выставляет исключение, которым завершилась операция."""
+        self._exception = exception
+        self._finished.set()
+
+    def done(self):
+        """Вернёт True, если операция завершена."""
+        return self._finished.is_set()
+
+    def exception(self, timeout=None):
+        """Дожидается завершения операции и возвращает исключение, которым
+        она завершилась, либо None.
+
+        """
+        if not self._finished.wait(timeout):
+            raise yaOperationError('Operation is still pending.')
+        return self._exception
+
+    def result(self, timeout=None):
+        """Дожидается завершения операции и возвращает её результат.
+        Если операция завершилась исключением, оно будет возбуждено повторно.
+
+        """
+        if self.exception(timeout) is not None:
+            raise self._exception
+        return self._result
+
+
+class yaWriteQueue(object):
+    """Очередь отложенной записи.
+    Операции выполняются пулом фоновых потоков, при сбоях на стороне
+    сервера или сети предпринимаются повторные попытки.
+    Операции с одинаковым ключом схлопывания (coalesce_key), ещё не взятые
+    в работу, заменяются последней из них: так, несколько смен настроения
+    одного пользователя подряд превратятся в единственный запрос.
+
+    """
+
+    __logger = Logger()
+
+    def _retry_errors(self, idempotent=False):
+        """Ошибки, после которых имеет смысл повторить запрос.
+        Сбой сети может произойти уже после того, как сервер выполнил запрос
+        (например, создал публикацию), поэтому после него повторяются только
+        идемпотентные операции; прочие - лишь если запрос не был отправлен.
+
+        """
+        if idempotent:
+            return (yaInternalServerError, yaConnectionError, httplib.HTTPException, socket.error)
+        return (yaInternalServerError, yaConnectionError)
+
+    def __init__(self, workers=2, retries=3, retry_delay=1):
+        """workers - количество фоновых потоков;
+        retries - количество повторных попыток;
+        retry_delay - задержка перед первой повторной попыткой в секундах,
+        каждая следующая удваивается.
+
+        """
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._tasks = deque()
+        self._coalesced = {}
+        self._unfinished = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name='pyyaru-writer-%s' % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, func, args=(), coalesce_key=None, idempotent=False):
+        """Ставит вызов func(*args) в очередь и возвращает объект yaFuture.
+        Флаг idempotent указывает, что повторное выполнение операции безопасно
+        (например, обновление ресурса), и её можно повторить после сбоя сети.
+
+        """
+        future = yaFuture()
+        with self._condition:
+            if self._closed:
+                raise yaOperationError('Unable to submit to a closed write queue.')
+
+            task = self._coalesced.get(coalesce_key) if coalesce_key is not None else None
+            if task is not None:
+                # Операция ещё не начата: заменяем её новой, результат получат все.
+                self.__logger.debug('Coalescing write operation "%s".' % (coalesce_key,))
+                task[0] = func
+                task[1] = args
+                task[2].append(future)
+                task[4] = idempotent
+            else:
+                task = [func, args, [future], coalesce_key, idempotent]
+                if coalesce_key is not None:
+                    self._coalesced[coalesce_key] = task
+                self._tasks.append(task)
+                self._unfinished += 1
+                self._condition.notify()
+        return future
+
+    def _work(self):
+        """Цикл фонового потока, разбирающего очередь."""
+        while True:
+            with self._condition:
+                while not self._tasks and not self._closed:
+                    self._condition.wait()
+                if not self._tasks:
+                    return
+                task = self._tasks.popleft()
+                if task[3] is not None:
+                    del(self._coalesced[task[3]])
+
+            func, args, futures = task[0], task[1], task[2]
+            retry_errors = self._retry_errors(task[4])
+            attempt = 0
+            while True:
+                try:
+                    result = func(*args)
+                except retry_errors as e:
+                    if attempt >= self.retries:
+                        self._finish(futures, exception=e)
+                        break
+                    self.__logger.warning('Write operation failed with "%s", retrying.' % e)
+                    time.sleep(self.retry_delay * 2 ** attempt)
+                    attempt += 1
+                except Exception as e:
+                    self._finish(futures, exception=e)
+                    break
+                else:
+                    self._finish(futures, result=result)
+                    break
+
+    def _finish(self, futures, result=None, exception=None):
+        """Выставляет результат всем ожидающим операции."""
+        for future in futures:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+        with self._condition:
+            self._unfinished -= 1
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Дожидается выполнения всех операций, поставленных в очередь.
+        Вернёт False, если за timeout секунд очередь опустошить не удалось.
+
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._condition:
+            while self._unfinished:
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """Закрывает очередь для новых операций, дожидается выполнения
+        имеющихся и останавливает фоновые потоки.
+
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        flushed = self.flush(timeout)
+        for worker in self._workers:
+            worker.join(timeout)
+        return flushed
+
+
 class yaBase(object):
     """Класс, осуществляющий базовое представление ресурса Я.ру в виде объекта pyyaru."""
 
     __logger = Logger()
 
+    _session = None
+
     def __init__(self, id, **kwargs):
+        """Параметр session позволяет привязать объект к сессии yaSession.
+        По умолчанию объект привязывается к сессии DEFAULT_SESSION.
+
+        """
         self.__parsed = False
         self.id = id
         self._type = self.__class__.__name__.lstrip('ya').lower()
+        self._session = kwargs.get('session') or DEFAULT_SESSION
 
         if 'attributes' in kwargs and isinstance(kwargs['attributes'], dict):
             for key in kwargs['attributes'].keys():
@@ -137,15 +465,105 @@ class yaBase(object):
         """При обращении к любому из свойств объекта, в случае, если данные
         еще не были загружены с ресурса, происходит загрузка.
 
+        Загрузка производится не более одного раза: если после неё свойство
+        так и не появилось, возбуждается AttributeError без повторного запроса.
+        Служебные имена (начинающиеся с подчеркивания, в т.ч. __getstate__,
+        __length_hint__ и пр.) загрузки не вызывают никогда.
+        В строгом автономном режиме сессии (см. yaSession.offline) вместо
+        загрузки возбуждается yaOfflineError.
+
         """
-        if self.id is not None and self.__parsed == False:
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        state = self.__dict__
+        if not state.get('_yaBase__parsed', True) and state.get('id') is not None:
+            if self._session.offline:
+                raise yaOfflineError('Unable to load "%s" attribute of unloaded "%s" in offline mode.' % (name, state['id']))
             self.get()
 
         try:
-            return self.__dict__[name]
+            return state[name]
         except KeyError as e:
             raise AttributeError(e)
 
+    def __setattr__(self, name, value):
+        """Запоминает имена изменённых свойств (в т.ч. через свойства-сеттеры),
+        чтобы save() отправлял на сервер только изменённые объекты.
+
+        """
+        super(yaBase, self).__setattr__(name, value)
+        if not name.startswith('_') and name != 'id':
+            self.__dict__.setdefault('_dirty', set()).add(name)
+
+    def is_loaded(self):
+        """Вернёт True, если данные объекта уже получены с ресурса."""
+        return self.__parsed
+
+    def is_dirty(self):
+        """Вернёт True, если свойства объекта изменялись с момента загрузки
+        (либо сохранения), а также для объектов, ещё не созданных на сервере.
+
+        """
+        return self.id is None or bool(self.__dict__.get('_dirty'))
+
+    def mark_dirty(self, *names):
+        """Помечает свойства names изменёнными. Используется после изменения
+        значений на месте (например, словаря meta), которое не отслеживается.
+
+        """
+        self.__dict__.setdefault('_dirty', set()).update(names or ['*'])
+
+    def _mark_clean(self):
+        """Сбрасывает сведения об изменённых свойствах: данные объекта совпадают с ресурсом."""
+        self.__dict__['_dirty'] = set()
+
+    def __getstate__(self):
+        """Сессия и сведения об изменённых свойствах в сериализованное состояние объекта не попадают."""
+        state = self.__dict__.copy()
+        state.pop('_session', None)
+        state.pop('_dirty', None)
+        return state
+
+    def __setstate__(self, state):
+        """Восстановленный объект привязывается к сессии по умолчанию."""
+        self.__dict__.update(state)
+        self.__dict__['_session'] = DEFAULT_SESSION
+
+    def __copy__(self):
+        """Копия объекта остаётся привязанной к сессии исходного объекта
+        и сохраняет сведения об изменённых свойствах, в отличие от объекта,
+        восстановленного из pickle или снимка.
+
+        """
+        return self._copy(self.__getstate__())
+
+    def __deepcopy__(self, memo):
+        """См. __copy__()."""
+        import copy
+        obj = memo[id(self)] = self.__class__.__new__(self.__class__)
+        return self._copy(copy.deepcopy(self.__getstate__(), memo), obj)
+
+    def _copy(self, state, obj=None):
+        """Наполняет копию объекта obj (по умолчанию - новую) состоянием state."""
+        if obj is None:
+            obj = self.__class__.__new__(self.__class__)
+        obj.__dict__.update(state)
+        obj.__dict__['_session'] = self._session
+        if '_dirty' in self.__dict__:
+            obj.__dict__['_dirty'] = set(self.__dict__['_dirty'])
+        return obj
+
+    def _load_record(self, record):
+        """Наполняет объект данными из компактной записи (см. yaParseExecutor),
+        сохраняя привязку к сессии.
+
+        """
+        state = record[1]
+        if 'objects' in state:
+            state['objects'] = [_compact_restore(item, self._session) for item in state['objects']]
+        self.__dict__.update(state)
+
     def __str__(self):
         """Трансляцией объекта в строку является идентификатор объекта."""
         return '%s' % self.id
@@ -164,17 +582,33 @@ class yaBase(object):
     def _parse(self, resource_data):
         """Запускает механизм парсинга xml, полученного с ресурса.
         Дерево xml транслирует в свойства объекта.
+        Данные ресурса могут быть как строкой, так и потоком (объектом
+        с методом read()), в последнем случае документ разбирается по мере чтения.
+
+        """
+        self._parse_element(self._parse_root(resource_data[1]))
+
+    def _parse_root(self, data):
+        """Возвращает корневой элемент xml-документа, полученного с ресурса."""
+        if hasattr(data, 'read'):
+            return etree.parse(data).getroot()
+        return etree.fromstring(data)
+
+    def _parse_element(self, root):
+        """Транслирует xml-элемент в свойства объекта.
+        Элемент может являться как корнем документа, так и вложенным
+        элементом документа-коллекции.
 
         """
-        root = etree.fromstring(resource_data[1])
         for attrib in self.__parse_recursion(root):
             self.__dict__[attrib[0]] = attrib[1]
 
         self.__dict__['links'] = {}
-        for link in root.xpath('/*/a:link | /*/y:link', namespaces=NAMESPACES):
+        for link in root.xpath('a:link | y:link', namespaces=NAMESPACES):
             self.__dict__['links'][link.attrib['rel']] = link.attrib['href']
 
         self.__parsed = True
+        self._mark_clean()
 
     def __parse_recursion(self, root, usedict=None):
         """Итератор, проходящий по xml дереву и составляющий списки,
@@ -220,31 +654,68 @@ class yaBase(object):
 
             yield [tagname, tagcontent]
 
-    def get(self):
-        """Запрашивает объект с сервера и направляет его в парсер."""
-        resource_data = yaResource(self.id).get()
+    def get(self, stream=None, timeout=None):
+        """Запрашивает объект с сервера и направляет его в парсер.
+        Параметр stream позволяет разобрать ответ сервера потоком, не вычитывая
+        его в память целиком. По умолчанию берется значение, заданное сессией.
+        Если сессией задан исполнитель yaParseExecutor, то ответ (полученный
+        не потоком) разбирается в дочернем процессе.
+        Параметр timeout ограничивает время загрузки в секундах (см. yaDeadline).
+
+        """
+        with yaDeadline(timeout):
+            return self.__get(stream)
+
+    def __get(self, stream):
+        """Загружает объект. См. get()."""
+        if stream is None:
+            stream = self._session.stream
+
+        resource_data = yaResource(self.id, self._session).get(stream)
         if resource_data is not None:
-            # FIXME: API багфикс (не задан тип в Content-type) для entries
-            if resource_data[0] == self._type or self._type == 'entries':
-                self._parse(resource_data)
-            else:
-                raise yaObjectTypeMismatchError('Data type "%s" defined by resource mismatches pyyaru object "%s"'
-                       % (resource_data[0], self.__class__.__name__))
+            try:
+                # FIXME: API багфикс (не задан тип в Content-type) для entries
+                if resource_data[0] == self._type or self._type == 'entries':
+                    if self._session.parse_executor is not None and not stream:
+                        self._load_record(self._session.parse_executor.parse(self.__class__.__name__, resource_data[1]))
+                    else:
+                        self._parse(resource_data)
+                else:
+                    raise yaObjectTypeMismatchError('Data type "%s" defined by resource mismatches pyyaru object "%s"'
+                           % (resource_data[0], self.__class__.__name__))
+            finally:
+                # Ответ с неожиданным кодом прочитан целиком, а не потоком
+                if stream and hasattr(resource_data[1], 'close'):
+                    resource_data[1].close()
+            self._loaded()
         return self
 
-    def save(self, target_url=None):
+    def _loaded(self):
+        """Вызывается по загрузке объекта с сервера. Потомки дополняют
+        метод, например, для передачи публикаций указателю сессии.
+
+        """
+        pass
+
+    def save(self, target_url=None, force=False):
         """Используется для создания нового ресурса, либо обновляния имеющегося.
         В случае удачного свершения свойство вернёт объект.
+        Имеющийся ресурс обновляется, только если свойства объекта изменялись
+        с момента загрузки (см. is_dirty()), либо задан флаг force.
 
         """
+        if not force and not self.is_dirty():
+            self.__logger.debug('Resource "%s" is unchanged, skipping update.' % self.id)
+            return self
+
         data = self._compose()
 
         if self.id is None:
-            resource_data = yaResource(target_url).create(data, self._content_type)
+            resource_data = yaResource(target_url, self._session).create(data, self._content_type)
             if not resource_data[2]:
                 raise yaOperationError('Unable to create resource at "%s".' % target_url)
         else:
-            resource_data = yaResource(self.links['edit']).update(data, self._content_type)
+            resource_data = yaResource(self.links['edit'], self._session).update(data, self._content_type)
             if not resource_data[2]:
                 raise yaOperationError('Unable to update resource at "%s".' % self.links['edit'])
 
@@ -260,7 +731,7 @@ class yaBase(object):
         """
         if self.id is not None:
             try:
-                resource_data = yaResource(self.links['edit']).delete()
+                resource_data = yaResource(self.links['edit'], self._session).delete()
             except KeyError:
                 raise yaOperationError('Unable to delete resource: edit resource link is undefined.')
 
@@ -272,6 +743,97 @@ class yaBase(object):
         return self
 
 
+class yaFilter(object):
+    """Условие отбора элементов коллекции, проверяемое по xml-элементу
+    ещё до создания объекта, так что неподходящие элементы не разбираются.
+    Все заданные условия должны выполняться одновременно.
+
+    Пример:
+        since = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        statuses = yaFilter(type='status', since=since)
+        for entry in me.friends_entries().iter(filter=statuses):
+            print entry.content
+
+    """
+
+    _UPDATED_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+    def __init__(self, type=None, author=None, since=None, until=None, ids=None):
+        """type - тип публикации, либо список типов;
+        author - URN автора публикации, либо список URN;
+        since, until - границы даты обновления публикации (datetime, UTC) включительно;
+        ids - множество идентификаторов (URN) элементов.
+        Условия type, author и даты применимы только к публикациям.
+
+        """
+        self.types = self._to_set(type)
+        self.authors = self._to_set(author)
+        self.since = since
+        self.until = until
+        self.ids = self._to_set(ids)
+        # Даты в xml записаны в формате, сравнение строк которого совпадает со сравнением дат
+        self._since = since.strftime(self._UPDATED_FORMAT) if since is not None else None
+        self._until = until.strftime(self._UPDATED_FORMAT) if until is not None else None
+
+    def _to_set(self, value):
+        """Приводит значение условия к множеству."""
+        if value is None:
+            return None
+        if isinstance(value, basestring):
+            return set([value])
+        return set(value)
+
+    def match(self, element):
+        """Проверяет xml-элемент коллекции."""
+        ns = element.tag[:element.tag.find('}') + 1]
+        if self.ids is not None and element.findtext(ns + 'id') not in self.ids:
+            return False
+        if self._since is not None or self._until is not None:
+            updated = element.findtext(NS_A + 'updated')
+            if updated is None or (self._since is not None and updated < self._since) or \
+                    (self._until is not None and updated > self._until):
+                return False
+        if self.types is not None:
+            entry_type = None
+            for category in element.iterchildren(NS_A + 'category'):
+                if category.get('scheme') == yaEntry._COMPOSE_POSTTYPES:
+                    entry_type = category.get('term')
+            if entry_type not in self.types:
+                return False
+        if self.authors is not None:
+            author = element.find(NS_A + 'author')
+            if author is None or author.findtext(NS_Y + 'id') not in self.authors:
+                return False
+        return True
+
+    def match_object(self, obj):
+        """Проверяет уже созданный объект."""
+        if self.ids is not None and obj.__dict__.get('id') not in self.ids:
+            return False
+        if self.since is not None or self.until is not None:
+            updated = obj.__dict__.get('updated')
+            if updated is None or (self.since is not None and updated < self.since) or \
+                    (self.until is not None and updated > self.until):
+                return False
+        if self.types is not None and getattr(obj, 'type', None) not in self.types:
+            return False
+        if self.authors is not None and (obj.__dict__.get('author') or {}).get('id') not in self.authors:
+            return False
+        return True
+
+    def is_past(self, updated):
+        """Проверяет, что дата обновления (строка xml, либо datetime) раньше
+        нижней границы since. Так как публикации коллекций упорядочены
+        по убыванию даты обновления, следующие порции можно не загружать.
+
+        """
+        if updated is None or self.since is None:
+            return False
+        if isinstance(updated, basestring):
+            return updated < self._since
+        return updated < self.since
+
+
 class yaCollection(yaBase):
     """Класс описывает ресурсы-коллекции (н.п. список друзей, список клубов, список публикаций).
     В случае удачного свершения, свойство objects объекта класса будет заполнено
@@ -282,27 +844,139 @@ class yaCollection(yaBase):
 
     objects = []
 
-    def _parse(self, resource_data):
-        """Для получения списка объектов дополняем механизм разбора xml, определенный
-        в супер-классе yaBase.
+    # Условие отбора (yaFilter), действующее во время загрузки, и признак того,
+    # что в загруженной порции встретился элемент старше нижней границы даты.
+    _filter = None
+    _crossed = False
+    # Сведения об изменении элементов с прошлой загрузки (см. changes()).
+    _changes = None
+
+    def __getstate__(self):
+        """Условие отбора, признак его пересечения и сведения об изменениях в состояние не попадают."""
+        state = super(yaCollection, self).__getstate__()
+        state.pop('_filter', None)
+        state.pop('_crossed', None)
+        state.pop('_changes', None)
+        return state
+
+    def changes(self):
+        """Возвращает сведения о том, как изменились элементы коллекции с прошлой
+        загрузки: словарь со списками объектов 'added' (новые элементы), 'changed'
+        (изменившиеся) и 'unchanged' (неизменившиеся; их объекты взяты из кэша,
+        если не изменялись локально).
+        Сведения доступны, если сессией задан кэш элементов (yaItemCache), и
+        охватывают все порции, загруженные методами get(), more() и iter().
+        Для ответов, разобранных в дочернем процессе (yaParseExecutor), вернёт None.
+
+        """
+        return self._changes
+
+    def _accept(self, element):
+        """Проверяет xml-элемент условием отбора, действующим во время загрузки."""
+        if self._filter is None:
+            return True
+        if self._filter.is_past(element.findtext(NS_A + 'updated')):
+            self._crossed = True
+        return self._filter.match(element)
+
+    def get(self, stream=None, timeout=None, filter=None):
+        """Запрашивает коллекцию с сервера (см. yaBase.get()).
+        Если задано условие отбора filter (yaFilter), то объекты создаются
+        только для подходящих элементов.
+
+        """
+        self._crossed = False
+        self._filter = filter
+        try:
+            super(yaCollection, self).get(stream, timeout)
+        finally:
+            self.__dict__.pop('_filter', None)
+        if filter is not None:
+            # Ответ, разобранный в дочернем процессе (yaParseExecutor), не отобран
+            objects = []
+            for obj in self.__dict__.get('objects', []):
+                if filter.is_past(obj.__dict__.get('updated')):
+                    self._crossed = True
+                if filter.match_object(obj):
+                    objects.append(obj)
+            self.__dict__['objects'] = objects
+        return self
+
+    def _item_tag(self):
+        """Возвращает пару из класса вложенных объектов и полного (с пространством
+        имён) имени xml-тэга, которым описывается элемент коллекции.
 
         """
-        super(yaCollection, self)._parse(resource_data)
-        root = etree.fromstring(resource_data[1])
         ns = 'y'
         tagname = self._type.rstrip('s')
         if self._type == 'entries':
             ns = 'a'
             tagname = tagname.replace('ie', 'y')
+        return globals()['ya%s' % tagname.capitalize()], '{%s}%s' % (NAMESPACES[ns], tagname)
 
-        for item in root.xpath('//%s:%s' % (ns, tagname), namespaces=NAMESPACES):
-            obj = globals()['ya%s' % tagname.capitalize()](None)
-            resource_data = [item.tag, etree.tostring(item, xml_declaration=True, encoding='utf-8')]
-            obj._parse(resource_data)
-            self.objects.append(obj)
+    def _parse_root(self, data):
+        """Для коллекций, получаемых потоком, используется инкрементальный
+        разбор: каждый элемент коллекции транслируется в объект сразу по прочтении
+        и удаляется из дерева, так что в памяти не держится вся страница целиком.
 
-        if tagname in self.__dict__:
-            del(self.__dict__[tagname])
+        """
+        self.__dict__['objects'] = []
+        if self._session.item_cache is not None:
+            self._changes = {'added': [], 'changed': [], 'unchanged': []}
+        if not hasattr(data, 'read'):
+            return super(yaCollection, self)._parse_root(data)
+
+        item_cls, item_tag = self._item_tag()
+        root = None
+        for event, el in etree.iterparse(data, events=('start', 'end')):
+            if root is None:
+                root = el
+            elif event == 'end' and el.tag == item_tag and el.getparent() is root:
+                if self._accept(el):
+                    self.__dict__['objects'].append(self._spawn_item(item_cls, el))
+                root.remove(el)
+        return root
+
+    def _spawn_item(self, item_cls, element):
+        """Создает объект для элемента коллекции.
+        Если сессией задан кэш элементов, объект неизменившегося элемента
+        берётся из кэша без разбора, если только он не изменялся локально.
+
+        """
+        cache = self._session.item_cache
+        if cache is None:
+            obj = item_cls(None, session=self._session)
+            obj._parse_element(element)
+            return obj
+
+        item_id = element.findtext(element.tag[:element.tag.find('}') + 1] + 'id')
+        fingerprint = cache.fingerprint(element)
+        obj, state = cache.lookup(item_id, fingerprint)
+        if obj is not None and obj.is_dirty():
+            # Изменённый на месте объект уже не совпадает с ресурсом: элемент разбирается заново
+            obj = None
+        if obj is None:
+            obj = item_cls(None, session=self._session)
+            obj._parse_element(element)
+            cache.store(item_id, fingerprint, obj)
+        self._changes[state].append(obj)
+        return obj
+
+    def _parse_element(self, root):
+        """Для получения списка объектов дополняем механизм разбора xml, определенный
+        в супер-классе yaBase.
+        Элементы, уже разобранные потоком (см. _parse_root), в дереве отсутствуют.
+
+        """
+        item_cls, item_tag = self._item_tag()
+        self.__dict__.setdefault('objects', [])
+
+        for item in list(root.iterchildren(item_tag)):
+            if self._accept(item):
+                self.__dict__['objects'].append(self._spawn_item(item_cls, item))
+            root.remove(item)
+
+        super(yaCollection, self)._parse_element(root)
 
     def __len__(self):
         """Возвращает количество вложенных объектов (содержащихся в self.objects)."""
@@ -316,34 +990,60 @@ class yaCollection(yaBase):
         """Для коллекций метод не поддерживается."""
         raise yaUnsupportedMethodError('"delete" method is unsupported by collections.')
 
-    def more(self):
+    def more(self, filter=None):
         """Запрашивает с сервера следующую порцию объектов.
         Возвращает список новых объектов, при этом дополняет список objects текущего
         класса-коллекции новыми.
         В случае, если заявленный ресурс-коллекция со следующей порцией не описывает
         объектов, вернёт False.
+        Если задано условие отбора filter (yaFilter), порции, в которых не нашлось
+        подходящих объектов, пропускаются; загрузка прекращается (возвращается
+        False), как только встретится публикация старше нижней границы даты.
 
         """
-        if 'links' in self.__dict__ and 'next' in self.links:
-            more_items = globals()[self.__class__.__name__](self.links['next']).get()
-            if len(more_items.objects) > 0:
-                self.objects += more_items.objects
+        while 'links' in self.__dict__ and 'next' in self.links and not (filter is not None and self._crossed):
+            more_items = globals()[self.__class__.__name__](self.links['next'], session=self._session).get(filter=filter)
+            if filter is None and not more_items.objects:
+                break
+            if 'next' in more_items.links:
                 self.links['next'] = more_items.links['next']
+            else:
+                del(self.links['next'])
+            if more_items._crossed:
+                self._crossed = True
+            if more_items._changes is not None and self._changes is not None:
+                for state, objects in more_items._changes.items():
+                    self._changes[state].extend(objects)
+            if more_items.objects:
+                self.objects.extend(more_items.objects)
                 return more_items.objects
 
         return False
 
-    def iter(self):
+    def iter(self, filter=None):
         """Итератор осуществляет проход про всем элементам, которые описывает
         ресурс-коллекция, задействуя при этом постраничное перемещение more().
         Выбрасывает объект, созданный на основе очередного элемента.
+        Если задано условие отбора filter (yaFilter), выбрасываются только
+        подходящие объекты, а следующие порции отбираются ещё до создания
+        объектов; проход прекращается, как только встретится публикация
+        старше нижней границы даты.
 
         """
+        if filter is None:
+            # Проход без условия идёт до последней порции
+            self._crossed = False
         for obj in self.objects:
-            yield obj
+            if filter is None:
+                yield obj
+                continue
+            if filter.is_past(obj.__dict__.get('updated')):
+                self._crossed = True
+            if filter.match_object(obj):
+                yield obj
 
         while True:
-            more_items = self.more()
+            more_items = self.more(filter)
             if more_items:
                 for obj in more_items:
                     yield obj
@@ -351,6 +1051,244 @@ class yaCollection(yaBase):
                 break
 
 
+def _to_unicode(value):
+    """Приводит строку к unicode, считая байтовые строки закодированными в utf-8."""
+    if isinstance(value, unicode):
+        return value
+    return value.decode('utf-8')
+
+
+def compose_entries(entries, output):
+    """Записывает публикации (объекты yaEntry) единым Atom-документом
+    (элементом feed) в output, который может быть именем файла, либо
+    файлоподобным объектом. Документ пишется потоком, по одной публикации.
+    Вернёт количество записанных публикаций.
+
+    """
+    count = 0
+    with etree.xmlfile(output, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element(NS_A + 'feed', nsmap=yaEntry._COMPOSE_NSMAP):
+            for entry in entries:
+                entry._compose_to(xf)
+                count += 1
+    return count
+
+
+def _publish(target_url, entry, session):
+    """Публикует объект yaEntry по адресу target_url в рамках сессии session.
+    Если сессией задана очередь отложенной записи, публикация ставится в неё,
+    и возвращается объект yaFuture. Смены настроения по одному адресу при этом
+    схлопываются.
+
+    """
+    entry._session = session
+    if session.write_queue is None:
+        return entry.save(target_url)
+
+    coalesce_key = None
+    if entry.type == 'status':
+        coalesce_key = ('status', target_url)
+    # Обновление имеющейся публикации можно безопасно повторить, создание - нет
+    return session.write_queue.submit(entry.save, (target_url,), coalesce_key, idempotent=entry.id is not None)
+
+
+def _publish_batch(target_url, entries, session, workers=None, ordered=True):
+    """Публикует объекты yaEntry по адресу target_url в рамках сессии session,
+    используя несколько одновременных соединений из пула.
+    Вернёт список кортежей из объекта публикации, идентификатора созданного
+    ресурса и исключения (None в случае успеха).
+    Если задан флаг ordered, то порядок результатов соответствует
+    порядку публикаций в entries, иначе — порядку завершения запросов.
+
+    """
+    entries = list(entries)
+    for entry in entries:
+        if not isinstance(entry, yaEntry):
+            raise yaError('Entry parameter is not an object of yaEntry type.')
+        entry._session = session
+
+    def publish(entry):
+        # Сбой одной публикации (в т.ч. сетевой) не прерывает пакет
+        try:
+            entry.save(target_url)
+        except Exception as e:
+            return (entry, None, e)
+        return (entry, entry.id, None)
+
+    return _map_concurrently(publish, entries, workers, ordered)
+
+
+def save_all(objects, workers=None, ordered=True):
+    """Сохраняет изменённые объекты objects (см. yaBase.is_dirty()),
+    используя несколько одновременных соединений из пула (не более workers,
+    по умолчанию BATCH_WORKERS). Неизменённые объекты не отправляются.
+    Вернёт пару из списка кортежей (объект, исключение или None в случае
+    успеха) для отправленных объектов и количества пропущенных.
+    Порядок результатов соответствует порядку объектов, если задан флаг ordered.
+
+    """
+    objects = list(objects)
+    dirty = [obj for obj in objects if obj.is_dirty()]
+
+    def save(obj):
+        # Сбой одного объекта (в т.ч. сетевой) не прерывает сохранение остальных
+        try:
+            obj.save()
+        except Exception as e:
+            return (obj, e)
+        return (obj, None)
+
+    return _map_concurrently(save, dirty, workers, ordered), len(objects) - len(dirty)
+
+
+def _hydrate_authors(entries, session, workers=None, persons=None):
+    """Загружает профили различных авторов публикаций entries одновременно
+    и прикрепляет общие объекты yaPerson к публикациям. См. yaEntries.hydrate_authors().
+
+    """
+    persons = persons if persons is not None else {}
+    by_author = defaultdict(list)
+    for entry in entries:
+        author_id = (entry.__dict__.get('author') or {}).get('id')
+        if author_id is None:
+            continue
+        person = entry.__dict__.get('_author_person')
+        if author_id not in persons and person is not None and person.is_loaded():
+            persons[author_id] = person
+        by_author[author_id].append(entry)
+
+    def load(author_id):
+        try:
+            return author_id, yaPerson(author_id, session=session).get(), None
+        except _fetch_errors() as e:
+            # Сбой загрузки одного автора не прерывает загрузку остальных
+            return author_id, None, e
+
+    missing = [author_id for author_id in by_author if author_id not in persons]
+    for author_id, person, error in _map_concurrently(load, missing, workers, ordered=False):
+        if error is not None:
+            logging.getLogger(__name__).warning('Unable to load author "%s": %s' % (author_id, error))
+            continue
+        persons[author_id] = person
+
+    for author_id, author_entries in by_author.items():
+        if author_id in persons:
+            for entry in author_entries:
+                entry.__dict__['_author_person'] = persons[author_id]
+    return persons
+
+
+def _map_concurrently(func, items, workers=None, ordered=True):
+    """Применяет func к каждому элементу items в пуле потоков
+    (не более workers, по умолчанию BATCH_WORKERS) и возвращает список результатов.
+
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    from multiprocessing.pool import ThreadPool
+    # Потоки пула выполняются в рамках срока, действующего у вызывающего
+    func = yaDeadline.bind(func)
+    pool = ThreadPool(min(workers or BATCH_WORKERS, len(items)))
+    try:
+        if ordered:
+            return list(pool.imap(func, items))
+        return list(pool.imap_unordered(func, items))
+    finally:
+        pool.close()
+        pool.join()
+
+
+class yaResolutionCache(object):
+    """Кэш сопоставлений адресов ресурсов (URL, URI) их URN-идентификаторам,
+    а также профилей текущего пользователя (ресурс /me/) для каждого токена.
+    Позволяет не запрашивать ресурс повторно лишь ради его идентификатора.
+
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._me = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, resource_type, target, session=None):
+        """Возвращает URN-идентификатор ресурса типа resource_type.
+        target может содержать идентификатор, URL ресурса, либо ya-объект.
+        Ресурс запрашивается с сервера (в рамках сессии session)
+        только при отсутствии его в кэше.
+
+        """
+        cl = globals()[URN_TYPES[resource_type]]
+
+        target_id = target
+        if isinstance(target, cl):
+            target_id = target.id
+
+        if target_id.startswith('%s%s' % (URN_PREFIX, resource_type)):
+            return target_id
+
+        key = (resource_type, target_id)
+        with self._lock:
+            urn = self._ids.get(key)
+        if urn is None:
+            urn = cl(target_id, session=session).get().id
+            with self._lock:
+                self._ids[key] = urn
+        return urn
+
+    def me(self, refresh=False, session=None):
+        """Возвращает профиль текущего пользователя (yaPerson) для токена
+        доступа сессии session, запрашивая его с сервера лишь однажды.
+        Параметр refresh вынуждает запросить профиль заново.
+
+        """
+        session = session or DEFAULT_SESSION
+        token = session.access_token
+        with self._lock:
+            me = self._me.get(token)
+        if me is None or refresh:
+            me = yaPerson('/me/', session=session).get()
+            with self._lock:
+                self._me[token] = me
+        return me
+
+    def invalidate(self, target=None):
+        """Сбрасывает кэш. Если задан target, забывается только он
+        (адрес ресурса, либо '/me/' для профиля текущего пользователя).
+
+        """
+        with self._lock:
+            if target is None:
+                self._ids.clear()
+                self._me.clear()
+            elif target == '/me/':
+                self._me.clear()
+            else:
+                for key in [key for key in self._ids if key[1] == target]:
+                    del(self._ids[key])
+
+
+RESOLUTION_CACHE = yaResolutionCache()
+
+
+def get_me(refresh=False):
+    """Возвращает закэшированный профиль текущего пользователя
+    сессии по умолчанию. См. yaSession.me().
+
+    """
+    return DEFAULT_SESSION.me(refresh)
+
+
+def invalidate_me():
+    """Сбрасывает закэшированный профиль текущего пользователя
+    сессии по умолчанию.
+
+    """
+    DEFAULT_SESSION.cache.invalidate('/me/')
+
+
 class yaPerson(yaBase):
     """Класс описывает ресурс пользователя Я.ру (профиль)."""
 
@@ -376,12 +1314,26 @@ class yaPerson(yaBase):
         raise NotImplementedError('This method is not yet implemented.')
 
     def publish_entry(self, entry):
-        """Публикует указанный объект yaEntry в дневнике пользователя."""
+        """Публикует указанный объект yaEntry в дневнике пользователя.
+        Если сессией задана очередь отложенной записи, вернёт объект yaFuture.
+
+        """
         if isinstance(entry, yaEntry):
-            return entry.save(self.links['posts'])
+            return _publish(self.links['posts'], entry, self._session)
         else:
             raise yaError('Entry parameter is not an object of yaEntry type.')
 
+    def publish_entries(self, entries, workers=None, ordered=True):
+        """Публикует несколько объектов yaEntry в дневнике пользователя,
+        используя одновременно несколько соединений (не более workers,
+        по умолчанию BATCH_WORKERS).
+        Вернёт список кортежей (публикация, id созданного ресурса, исключение).
+        Флаг ordered определяет, следует ли результатам идти в порядке entries.
+        Для сохранения порядка публикаций на сервере используйте workers=1.
+
+        """
+        return _publish_batch(self.links['posts'], entries, self._session, workers, ordered)
+
     def set_status(self, status, access='public', comments_disabled=False):
         """Смена настроения. Под капотом происходит создание
         новой записи типа 'status'.
@@ -393,7 +1345,8 @@ class yaPerson(yaBase):
                 'content': status,
                 'access': access,
                 'comments_disabled': comments_disabled,
-            }
+            },
+            session=self._session
             )
 
         return self.publish_entry(entry)
@@ -405,29 +1358,51 @@ class yaPerson(yaBase):
         дружбы (пользователь-пользователь) и т.д.
 
         """
-        cl = globals()[URN_TYPES[resource_type]]
+        target_id = self._session.cache.resolve(resource_type, target, self._session)
+        return self.publish_entry(self.__related_entry(resource_type, target_id, action, entry_text, access, comments_disabled))
 
-        target_id = target
+    def _make_related_entries(self, resource_type, targets, action, entry_text, access, comments_disabled, workers):
+        """Пакетный вариант _make_related_entry(): идентификаторы всех целей
+        выясняются одновременно, после чего записи публикуются пакетом.
+        Вернёт список кортежей (публикация, id созданного ресурса, исключение)
+        в порядке целей. Записи для целей, идентификатор которых выяснить
+        не удалось, не публикуются: в их кортежах указано исключение,
+        а в meta записи - цель в исходном виде.
 
-        if isinstance(target, cl):
-            target_id = target.id
-
-        if not target_id.startswith('%s%s' % (URN_PREFIX, resource_type)):
-            target = cl(target_id).get()
-            target_id = target.id
+        """
+        def resolve(target):
+            try:
+                return target, self._session.cache.resolve(resource_type, target, self._session), None
+            except Exception as e:
+                return target, None, e
+
+        resolved = _map_concurrently(resolve, targets, workers)
+        entries = [self.__related_entry(resource_type, target_id, action, entry_text, access, comments_disabled)
+                   for target, target_id, error in resolved if error is None]
+        published = iter(self.publish_entries(entries, workers))
+
+        results = []
+        for target, target_id, error in resolved:
+            if error is None:
+                results.append(next(published))
+            else:
+                entry = self.__related_entry(resource_type, '%s' % target, action, entry_text, access, comments_disabled)
+                results.append((entry, None, error))
+        return results
 
-        entry = yaEntry(
+    def __related_entry(self, resource_type, target_id, action, entry_text, access, comments_disabled):
+        """Создаёт объект записи, описывающей отношение к ресурсу target_id."""
+        return yaEntry(
             attributes={
                 'type': action,
                 'content': entry_text,
                 'access': access,
                 'comments_disabled': comments_disabled,
                 'meta': {resource_type: {'id': target_id}}
-            }
+            },
+            session=self._session
             )
 
-        return self.publish_entry(entry)
-
     def friend(self, whom, entry_text='', access='public', comments_disabled=False):
         """Подружиться. Под капотом происходит создание
         новой записи типа 'friend'.
@@ -439,6 +1414,17 @@ class yaPerson(yaBase):
         """
         return self._make_related_entry('person', whom, 'friend', entry_text, access, comments_disabled)
 
+    def friend_many(self, whoms, entry_text='', access='public', comments_disabled=False, workers=None):
+        """Подружиться сразу с несколькими пользователями.
+        Идентификаторы пользователей выясняются одновременно, после чего
+        записи типа 'friend' публикуются пакетом (см. publish_entries()).
+
+        -- whoms - список, элементы которого описываются так же,
+                   как параметр whom метода friend()
+
+        """
+        return self._make_related_entries('person', whoms, 'friend', entry_text, access, comments_disabled, workers)
+
     def unfriend(self, whom, entry_text='', access='public', comments_disabled=False):
         """Раздружиться. Под капотом происходит создание
         новой записи типа 'unfriend'.
@@ -461,6 +1447,17 @@ class yaPerson(yaBase):
         """
         return self._make_related_entry('club', club, 'join', entry_text, access, comments_disabled)
 
+    def join_clubs(self, clubs, entry_text='', access='public', comments_disabled=False, workers=None):
+        """Вступить сразу в несколько клубов.
+        Идентификаторы клубов выясняются одновременно, после чего
+        записи типа 'join' публикуются пакетом (см. publish_entries()).
+
+        -- clubs - список, элементы которого описываются так же,
+                   как параметр club метода join_club()
+
+        """
+        return self._make_related_entries('club', clubs, 'join', entry_text, access, comments_disabled, workers)
+
     def leave_club(self, club, entry_text='', access='public', comments_disabled=False):
         """Покинуть клуб. Под капотом происходит создание
         новой записи типа 'unjoin'.
@@ -482,32 +1479,34 @@ class yaPerson(yaBase):
         if not where_role in self._inclub_roles:
             raise yaPersonInclubRoleUnkwnownError('Supplied role "%s" is unknown. Valid choices: %s.' % (where_role, self._inclub_roles))
 
-        return yaClubs(self.links[where_role + '_of_clubs']).get()
+        return yaClubs(self.links[where_role + '_of_clubs'], session=self._session).get()
 
     def friends(self):
         """Запрашивает с сервера друзей пользователя и возвращает их
         в виде объекта-контейнера yaPersons.
 
         """
-        return yaPersons(self.links['friends']).get()
+        return yaPersons(self.links['friends'], session=self._session).get()
 
-    def entries(self, by_type='ANY'):
+    def entries(self, by_type='ANY', filter=None):
         """Запрашивает с сервера публикации пользователя и возвращает их
         в виде объекта-контейнера yaEntries.
         Параметр by_type позволяет запросить публикации определенного типа
         (см. список _TYPES класса yaEntry).
+        Параметр filter задаёт условие отбора публикаций (yaFilter).
 
         """
-        return yaEntries(self.links['posts'], by_type).get()
+        return yaEntries(self.links['posts'], by_type, session=self._session).get(filter=filter)
 
-    def friends_entries(self, by_type='ANY'):
+    def friends_entries(self, by_type='ANY', filter=None):
         """Запрашивает с сервера публикации друзей пользователя и возвращает их
         в виде объекта-контейнера yaEntries.
         Параметр by_type позволяет запросить публикации определенного типа
         (см. список _TYPES класса yaEntry).
+        Параметр filter задаёт условие отбора публикаций (yaFilter).
 
         """
-        return yaEntries(self.links['friends_posts'], by_type).get()
+        return yaEntries(self.links['friends_posts'], by_type, session=self._session).get(filter=filter)
 
 
 class yaPersons(yaCollection):
@@ -527,12 +1526,22 @@ class yaClub(yaBase):
     _content_type = 'application/x-yaru+xml; type=club;'
 
     def publish_entry(self, entry):
-        """Публикует указанный объект yaEntry в клубе."""
+        """Публикует указанный объект yaEntry в клубе.
+        Если сессией задана очередь отложенной записи, вернёт объект yaFuture.
+
+        """
         if isinstance(entry, yaEntry):
-            return entry.save(self.links['posts'])
+            return _publish(self.links['posts'], entry, self._session)
         else:
             raise yaError('Entry parameter is not an object of yaEntry type.')
 
+    def publish_entries(self, entries, workers=None, ordered=True):
+        """Публикует несколько объектов yaEntry в клубе.
+        См. описание yaPerson.publish_entries().
+
+        """
+        return _publish_batch(self.links['posts'], entries, self._session, workers, ordered)
+
     def add_news(self, news_text):
         """Публикация новости клуба. Под капотом происходит создание
         новой записи типа 'news'.
@@ -550,34 +1559,37 @@ class yaClub(yaBase):
     def join(self, entry_text='', access='public', comments_disabled=False):
         """Вступление в клуб. Под капотом происходит обращение
         к ресурсу /me/ и создание новой записи типа 'join'.
+        Профиль текущего пользователя кэшируется (см. yaSession.me()).
 
         """
-        me = yaPerson('/me/').get()
-        me.join_club(self, entry_text, access, comments_disabled)
+        me = self._session.me()
+        return me.join_club(self, entry_text, access, comments_disabled)
 
     def leave(self, entry_text='', access='public', comments_disabled=False):
         """Уход из клуба. Под капотом происходит обращение
         к ресурсу /me/ и создание новой записи типа 'unjoin'.
+        Профиль текущего пользователя кэшируется (см. yaSession.me()).
 
         """
-        me = yaPerson('/me/').get()
-        me.leave_club(self, entry_text, access, comments_disabled)
+        me = self._session.me()
+        return me.leave_club(self, entry_text, access, comments_disabled)
 
-    def entries(self, by_type='ANY'):
+    def entries(self, by_type='ANY', filter=None):
         """Запрашивает с сервера публикации клуба и возвращает их
         в виде объекта-контейнера yaEntries.
         Параметр by_type позволяет запросить публикации определенного типа
         (см. список _TYPES класса yaEntry).
+        Параметр filter задаёт условие отбора публикаций (yaFilter).
 
         """
-        return yaEntries(self.links['posts'], by_type).get()
+        return yaEntries(self.links['posts'], by_type, session=self._session).get(filter=filter)
 
     def members(self):
         """Запрашивает с сервера членов клуба и возвращает их
         в виде объекта-контейнера yaPersons.
 
         """
-        return yaPersons(self.links['club_members']).get()
+        return yaPersons(self.links['club_members'], session=self._session).get()
 
 
 class yaClubs(yaCollection):
@@ -655,17 +1667,28 @@ class yaEntry(yaBase):
         super(self.__class__, self).__init__(id, **kwargs)
 
     def make_comment(self, entry_content, entry_type='text', access='public', comments_disabled=False):
-        """Добавляет комментарий указанного типа к текущей записи."""
+        """Добавляет комментарий указанного типа к текущей записи.
+        Если сессией задана очередь отложенной записи, вернёт объект yaFuture.
+
+        """
         entry = yaEntry(
             attributes={
                 'type': entry_type,
                 'content': entry_content,
                 'access': access,
                 'comments_disabled': comments_disabled,
-            }
+            },
+            session=self._session
         )
-        entry.save(self.links['comments'])
-        return entry
+        result = _publish(self.links['comments'], entry, self._session)
+        if self._session.write_queue is None:
+            return entry
+        return result
+
+    def _loaded(self):
+        """Передаёт загруженную публикацию указателю сессии, если он задан."""
+        if self._session.index is not None:
+            self._session.index.update([self])
 
     def _set_type(self, entry_type):
         """Устанавливает тип записи, сверяясь со списком разрешенных типов."""
@@ -709,12 +1732,34 @@ class yaEntry(yaBase):
         return self._comments_disabled
     comments_disabled = property(_get_comments_disabled, _set_comments_disabled)  # Методы выше определяют свойство comments_disabled.
 
-    def _parse(self, resource_data):
+    def _get_author_person(self):
+        """Профиль автора публикации (объект yaPerson), либо None, если автор не указан.
+        Профиль загружается лишь при обращении к его свойствам. Профили авторов
+        публикаций коллекции можно загрузить разом (см. yaEntries.hydrate_authors()),
+        тогда публикации одного автора разделяют общий объект.
+
+        """
+        person = self.__dict__.get('_author_person')
+        if person is None:
+            author_id = (getattr(self, 'author', None) or {}).get('id')
+            if author_id is None:
+                return None
+            person = self.__dict__['_author_person'] = yaPerson(author_id, session=self._session)
+        return person
+    author_person = property(_get_author_person)  # Метод выше определяет свойство author_person.
+
+    def __getstate__(self):
+        """Профиль автора в состояние не попадает."""
+        state = super(yaEntry, self).__getstate__()
+        state.pop('_author_person', None)
+        return state
+
+    def _parse_element(self, root):
         """Парсит xml-документ с учетом специфики ресурса entry.
         Утилизирует парсер класса-родителя.
 
         """
-        super(self.__class__, self)._parse(resource_data)
+        super(self.__class__, self)._parse_element(root)
 
         if 'access' in self.__dict__:
             self.access = self.__dict__['access']
@@ -740,9 +1785,8 @@ class yaEntry(yaBase):
 
         if self.__dict__.get('updated') is not None:
             self.__dict__['updated'] = datetime.datetime.strptime(self.__dict__['updated'], '%Y-%m-%dT%H:%M:%SZ')
-        root = etree.fromstring(resource_data[1])
         self.__dict__['categories'] = []
-        for category in root.xpath('/*/a:category', namespaces=NAMESPACES):
+        for category in root.xpath('a:category', namespaces=NAMESPACES):
             if category.attrib['scheme'] == 'urn:ya.ru:posttypes':
                 self.type = category.attrib['term']
             else:
@@ -753,45 +1797,74 @@ class yaEntry(yaBase):
         else:
             self.content = self._html_unescape(self.content)
 
-    def _compose_recursion(self, root, namespace, property_name, property_value):
-        """Рекурсивно собирает ветку xml документа на основе данных словаря."""
+        # Сведения об обсуждении (Atom Threading Extensions): на что отвечает
+        # публикация (URN) и сколько у неё ответов
+        for key in [key for key in self.__dict__ if key.startswith(NS_THR)]:
+            del(self.__dict__[key])
+        in_reply_to = root.find(NS_THR + 'in-reply-to')
+        total = root.findtext(NS_THR + 'total')
+        self.__dict__['thread'] = {
+            'in_reply_to': in_reply_to.get('ref') if in_reply_to is not None else None,
+            'total': int(total) if total else None,
+        }
+        self._mark_clean()
+
+    def _compose_recursion(self, xf, namespace, property_name, property_value):
+        """Рекурсивно записывает ветку xml документа на основе данных словаря."""
         if isinstance(property_value, basestring):
-            property_value = unicode(property_value)
-            etree.SubElement(root, namespace + property_name).text = property_value
+            with xf.element(namespace + property_name):
+                xf.write(_to_unicode(property_value))
         elif isinstance(property_value, dict):
-            xml = etree.SubElement(root, namespace + property_name)
-            for element in property_value:
-                self._compose_recursion(xml, namespace, element, property_value[element])
-
-    def _compose(self):
-        """Компонует xml-документ для публикации на ресурсе."""
+            with xf.element(namespace + property_name):
+                for element in property_value:
+                    self._compose_recursion(xf, namespace, element, property_value[element])
 
-        ns_a = '{%s}' % NAMESPACES['a']
-        ns_y = '{%s}' % NAMESPACES['y']
+    _COMPOSE_NSMAP = {None: NAMESPACES['a'], 'y': NAMESPACES['y']}
+    _COMPOSE_POSTTYPES = URN_PREFIX + 'posttypes'
 
-        xml = etree.Element(ns_a + 'entry', nsmap={None: NAMESPACES['a'], 'y': NAMESPACES['y']})
-        etree.SubElement(xml, ns_a + 'category', term=self.type, scheme=URN_PREFIX + 'posttypes')
-        etree.SubElement(xml, ns_y + 'access').text = self.access
+    def _compose_to(self, xf, nsmap=None):
+        """Инкрементально записывает xml-элемент публикации в объект
+        etree.xmlfile. Параметр nsmap следует задавать, если элемент
+        является корневым.
 
-        if self.comments_disabled:
-            etree.SubElement(xml, ns_y + 'comments-disabled')
-
-        # FIXME: API не даёт возможности угадать uid в схеме
-        #for category in self.categories:
-        #    etree.SubElement(xml, ns_a+'category', term=category, scheme='https://api-yaru.yandex.ru/person/{uid}/tag')
+        """
+        ns_a = NS_A
+        ns_y = NS_Y
+
+        with xf.element(ns_a + 'entry', nsmap=nsmap):
+            with xf.element(ns_a + 'category', term=self.type, scheme=self._COMPOSE_POSTTYPES):
+                pass
+            with xf.element(ns_y + 'access'):
+                xf.write(self.access)
+
+            if self.comments_disabled:
+                with xf.element(ns_y + 'comments-disabled'):
+                    pass
+
+            # FIXME: API не даёт возможности угадать uid в схеме
+            #for category in self.categories:
+            #    etree.SubElement(xml, ns_a+'category', term=category, scheme='https://api-yaru.yandex.ru/person/{uid}/tag')
+
+            for property_name, property_value in self:
+                if isinstance(property_value, basestring):
+                    if property_name == 'content':
+                        property_value = self._html_escape(property_value)
+                    with xf.element(ns_a + property_name):
+                        xf.write(_to_unicode(property_value))
+                elif isinstance(property_value, dict):
+                    if property_name == 'meta':  # Словари с метаданными обрабатываем рекурсивно
+                        self._compose_recursion(xf, ns_y, property_name, property_value)
 
-        for property_name, property_value in self:
-            if isinstance(property_value, basestring):
-                if property_name == 'content':
-                    property_value = self._html_escape(property_value)
-                property_value = unicode(property_value.decode('utf-8'))
-                etree.SubElement(xml, ns_a + property_name).text = property_value
-            elif isinstance(property_value, dict):
-                if property_name == 'meta':  # Словари с метаданными обрабатываем рекурсивно
-                    self._compose_recursion(xml, ns_y, property_name, property_value)
+    def _compose(self):
+        """Компонует xml-документ для публикации на ресурсе."""
+        output = io.BytesIO()
+        with etree.xmlfile(output, encoding='utf-8') as xf:
+            xf.write_declaration()
+            self._compose_to(xf, self._COMPOSE_NSMAP)
+        xml = output.getvalue()
 
-        xml = etree.tostring(xml, encoding='utf-8', pretty_print=True, xml_declaration=True)
-        self.__logger.debug('Composed XML:\n%s\n%s%s' % ('-----' * 4, xml, '____' * 25))
+        if self.__logger.isEnabledFor(logging.DEBUG):
+            self.__logger.debug('Composed XML:\n%s\n%s%s' % ('-----' * 4, xml, '____' * 25))
 
         return xml
 
@@ -813,6 +1886,8 @@ class yaEntries(yaCollection):
 
     """
 
+    __logger = Logger()
+
     _content_type = 'application/atom+xml;'
 
     def __init__(self, id, by_type='ANY', **kwargs):
@@ -830,13 +1905,254 @@ class yaEntries(yaCollection):
 
         super(self.__class__, self).__init__(id, **kwargs)
 
+    def _loaded(self):
+        """Передаёт загруженные публикации указателю сессии, если он задан.
+        Следующие порции (см. more()) загружаются отдельными объектами
+        и попадают в указатель по мере загрузки.
+
+        """
+        if self._session.index is not None:
+            self._session.index.update(self.objects)
+
+    def hydrate_authors(self, workers=None, walk=False, persons=None):
+        """Загружает профили авторов публикаций коллекции и прикрепляет их
+        к публикациям (см. yaEntry.author_person). Профиль каждого автора
+        запрашивается один раз, профили разных авторов - одновременно
+        (не более workers запросов, по умолчанию BATCH_WORKERS); публикации
+        одного автора получают общий объект yaPerson.
+        Если задан флаг walk, предварительно загружаются все порции коллекции.
+        Параметр persons - словарь уже загруженных профилей по URN авторов,
+        например, полученный при обработке предыдущей порции; он дополняется
+        новыми профилями.
+        Вернёт словарь профилей по URN авторов. Профили, загрузить которые
+        не удалось, не прикрепляются.
+
+        """
+        if walk:
+            for entry in self.iter():
+                pass
+        return _hydrate_authors(self.objects, self._session, workers, persons)
+
+    def save_all(self, workers=None, ordered=True):
+        """Сохраняет изменённые публикации коллекции одновременно, пропуская
+        неизменённые (см. функцию save_all()).
+        Вернёт пару из списка кортежей (публикация, исключение или None)
+        и количества пропущенных публикаций.
+
+        """
+        return save_all(self.objects, workers, ordered)
+
+
+class yaConnectionPool(object):
+    """Пул постоянных (keep-alive) соединений с серверами.
+    Соединения выдаются потокам в монопольное пользование и возвращаются
+    в пул по прочтении ответа, что избавляет от установки нового
+    соединения на каждый запрос.
+
+    """
+
+    def __init__(self, max_idle=10):
+        """max_idle - максимальное количество простаивающих соединений с одним сервером."""
+        self.max_idle = max_idle
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def acquire(self, netloc):
+        """Выдает соединение с сервером netloc.
+        Вернет кортеж из соединения и флага, указывающего на то, что
+        соединение уже использовалось ранее.
+
+        """
+        with self._lock:
+            if self._idle[netloc]:
+                return self._idle[netloc].pop(), True
+        return self.connect(netloc), False
+
+    def connect(self, netloc):
+        """Создает новое соединение с сервером netloc."""
+        connection = httplib.HTTPConnection(netloc)
+        if LOG_LEVEL == logging.DEBUG:
+            connection.set_debuglevel(1)
+        return connection
+
+    def release(self, netloc, connection, response=None):
+        """Возвращает соединение в пул. Соединения, которые сервер
+        намерен закрыть, в пул не попадают.
+
+        """
+        if response is None or not response.will_close:
+            with self._lock:
+                if len(self._idle[netloc]) < self.max_idle:
+                    self._idle[netloc].append(connection)
+                    return
+        connection.close()
+
+    def clear(self):
+        """Закрывает все простаивающие соединения."""
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+
+CONNECTION_POOL = yaConnectionPool()
+
+
+class yaDeadline(object):
+    """Срок выполнения операций с сервером, задаваемый контекстным менеджером.
+    Все запросы, выполняемые в текущем потоке внутри блока with, в том числе
+    перенаправления, повторы и загрузка следующих порций коллекций,
+    укладываются в общий бюджет времени timeout (в секундах): таймауты
+    сокетов сокращаются до оставшегося времени, а по его истечении возбуждается
+    yaTimeoutError. Вложенные сроки не могут продлить внешний.
+    Пакетные операции передают срок своим потокам.
+
+    Пример:
+        with yaDeadline(5):
+            for entry in person.entries().iter():
+                print entry.title
+
+    """
+
+    _local = threading.local()
+
+    def __init__(self, timeout):
+        """timeout - бюджет времени в секундах; None не ограничивает выполнение."""
+        self.timeout = timeout
+        self.expires = None
+
+    @classmethod
+    def _stack(cls):
+        """Возвращает стек сроков текущего потока."""
+        if not hasattr(cls._local, 'stack'):
+            cls._local.stack = []
+        return cls._local.stack
+
+    @classmethod
+    def current(cls):
+        """Возвращает момент истечения действующего в потоке срока (метка времени Unix), либо None."""
+        stack = cls._stack()
+        if stack:
+            return stack[-1]
+        return None
+
+    @classmethod
+    def time_left(cls):
+        """Возвращает время в секундах до истечения действующего в потоке срока, либо None."""
+        expires = cls.current()
+        if expires is None:
+            return None
+        return expires - time.time()
+
+    @classmethod
+    def check(cls):
+        """Возбуждает yaTimeoutError, если действующий в потоке срок истёк."""
+        time_left = cls.time_left()
+        if time_left is not None and time_left <= 0:
+            raise yaTimeoutError('Deadline exceeded.')
+
+    @classmethod
+    def bind(cls, func):
+        """Возвращает обёртку над func, выполняющую её в рамках срока,
+        действующего в текущем потоке. Используется для передачи срока
+        потокам пула.
+
+        """
+        expires = cls.current()
+        if expires is None:
+            return func
+
+        def bound(*args, **kwargs):
+            with cls(expires - time.time()):
+                return func(*args, **kwargs)
+        return bound
+
+    def remaining(self):
+        """Возвращает время в секундах до истечения срока, либо None."""
+        if self.expires is None:
+            return None
+        return self.expires - time.time()
+
+    def __enter__(self):
+        stack = self._stack()
+        expires = stack[-1] if stack else None
+        if self.timeout is not None:
+            own = time.time() + self.timeout
+            if expires is None or own < expires:
+                expires = own
+        self.expires = expires
+        stack.append(expires)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stack().pop()
+        return False
+
+
+def _min_timeout(timeout, time_left):
+    """Возвращает меньший из таймаутов, считая None отсутствием ограничения."""
+    if time_left is None:
+        return timeout
+    if timeout is None:
+        return time_left
+    return min(timeout, time_left)
+
+
+class yaResponseStream(object):
+    """Поток тела ответа сервера, передаваемый парсеру вместо строки.
+    По закрытии потока соединение возвращается в пул, если ответ
+    был прочитан полностью, иначе закрывается.
+
+    """
+
+    def __init__(self, response, connection, netloc, pool, traffic=None):
+        self._response = response
+        self._connection = connection
+        self._netloc = netloc
+        self._pool = pool
+        self._traffic = traffic
+
+    @property
+    def status(self):
+        """Код ответа сервера."""
+        return self._response.status
+
+    def getheader(self, name, default=None):
+        """Возвращает значение заголовка ответа name, либо default."""
+        return self._response.getheader(name, default)
+
+    def read(self, size=-1):
+        """Читает очередную порцию тела ответа."""
+        yaDeadline.check()
+        try:
+            if size is None or size < 0:
+                data = self._response.read()
+            else:
+                data = self._response.read(size)
+        except socket.timeout:
+            raise yaTimeoutError('Timed out reading response from "%s".' % self._netloc)
+        if self._traffic is not None:
+            self._traffic.add(0, len(data))
+        return data
+
+    def close(self):
+        """Закрывает поток, освобождая соединение с сервером."""
+        if self._connection is not None:
+            if self._response.isclosed():
+                self._pool.release(self._netloc, self._connection, self._response)
+            else:
+                self._response.close()
+                self._connection.close()
+            self._connection = None
+
 
 class yaResource(object):
     """Класс получает абстрактный ресурс Я.ру и/или создает на его основе объект pyyaru."""
 
     __logger = Logger()
 
-    def __init__(self, resource_name):
+    def __init__(self, resource_name, session=None):
         """Получая на вход имя ресура, определяет для него подхоящий URL.
 
         Понимает следующие виды имён:
@@ -844,24 +2160,43 @@ class yaResource(object):
         2. ya-идентификатор URN (н.п. urn:ya.ru:person/153990);
         3. URI (н.п. /me/).
 
+        Параметр session задаёт сессию yaSession, в рамках которой производятся
+        запросы. По умолчанию используется DEFAULT_SESSION.
+
         """
         self.__logger.debug('Resource defined as "%s".' % resource_name)
 
+        self.session = session or DEFAULT_SESSION
+
         resource_name = resource_name.lstrip('/')
         url = resource_name
         if not resource_name.startswith('http'):
             if resource_name.startswith(URN_PREFIX):
-                url = '%s/resource/?id=%s' % (API_SERVER, resource_name)
+                url = '%s/resource/?id=%s' % (self.session.api_server, resource_name)
             else:
-                url = '%s/%s' % (API_SERVER, resource_name)
+                url = '%s/%s' % (self.session.api_server, resource_name)
 
         self.url = url
 
     def __make_request(self, connection, request_method, request_url, data, headers):
         """Производит запросы к серверу в рамках одного соединения.
         Рекурсивно проходит перенаправления.
+        Перед каждым запросом таймауты сокета сокращаются до времени,
+        оставшегося до истечения срока yaDeadline.
 
         """
+        yaDeadline.check()
+        time_left = yaDeadline.time_left()
+        if connection.sock is None:
+            connection.timeout = _min_timeout(self.session.connect_timeout, time_left)
+            try:
+                connection.connect()
+            except socket.timeout:
+                raise
+            except socket.error as e:
+                raise yaConnectionError('Unable to connect to "%s": %s' % (connection.host, e))
+        connection.sock.settimeout(_min_timeout(self.session.read_timeout, time_left))
+
         parsed_url = urlparse.urlparse(request_url)
         request_url = parsed_url.path
         query_string = parsed_url.query
@@ -876,11 +2211,13 @@ class yaResource(object):
             response = self.__make_request(connection, request_method, location, data, headers)
         return response
 
-    def __open_url(self, data=None, request_method="GET", content_type=None):
+    def __open_url(self, data=None, request_method="GET", content_type=None, stream=False, timeout=None,
+                   headers=None, raw=False):
         """Открывает URL, опционально используя токен авторизации.
 
         Реализована упрощенная схема, без взаимодействия с OAuth-сервером.
-        Для аутентификации необходимо задать ACCESS_TOKEN равным токену,
+        Для аутентификации необходимо задать токен сессии (для сессии
+        по умолчанию — ACCESS_TOKEN) равным токену,
         полученному на странице
         https://oauth.yandex.ru/authorize?client_id=25df5dd8e3064e188fbbf56f7c667d5f&response_type=code
         Внимание: для получения токена по приведенному ниже адресу
@@ -890,28 +2227,88 @@ class yaResource(object):
         реквизиты будут взяты из него автоматически.
 
         Вернёт кортеж из типа ресурса, полученных с него данных и флага успешности запроса, либо None.
+        Если задан флаг stream, то вместо данных в случае успешного запроса
+        будет возвращен поток yaResponseStream, который следует закрыть по прочтении.
+        Параметр timeout ограничивает время выполнения запроса в секундах
+        (см. yaDeadline). При превышении таймаутов возбуждается yaTimeoutError.
+
+        Параметр headers задаёт дополнительные заголовки запроса. Если задан
+        флаг raw, то при успешном запросе (либо ответе 304 Not Modified)
+        возвращается только поток yaResponseStream, а токен авторизации
+        передаётся лишь серверу API сессии.
 
         """
+        with yaDeadline(timeout):
+            return self.__open_url_within(data, request_method, content_type, stream, headers, raw)
+
+    def __open_url_within(self, data, request_method, content_type, stream, extra_headers=None, raw=False):
+        """Открывает URL в рамках действующего срока. См. __open_url()."""
         url = self.url
         headers = {'User-Agent': 'pyyaru %s' % '.'.join(map(str, VERSION))}
 
         if content_type is not None:
             headers['Content-Type'] = '%s charset=utf-8' % content_type
 
-        if ACCESS_TOKEN is not None:
-            headers.update({'Authorization': 'OAuth ' + ACCESS_TOKEN})
+        session = self.session
+        netloc = urlparse.urlparse(url).netloc
+        if session.access_token is not None and \
+                (not raw or netloc == urlparse.urlparse(session.api_server).netloc):
+            headers.update({'Authorization': 'OAuth ' + session.access_token})
+
+        if extra_headers:
+            headers.update(extra_headers)
+
+        if session.rate_limiter is not None:
+            session.rate_limiter.acquire()
 
         self.__logger.info('Opening URL "%s" with "%s"...' % (url, headers))
 
         resource_data = None
         try:
-            parsed_url = urlparse.urlparse(url)
-            connection = httplib.HTTPConnection(parsed_url.netloc)
-            if LOG_LEVEL == logging.DEBUG:
-                connection.set_debuglevel(1)
-            response = self.__make_request(connection, request_method, url, data, headers)
-            resource_data = response.read()
-            connection.close()
+            pool = session.pool
+            connection, reused = pool.acquire(netloc)
+            try:
+                try:
+                    response = self.__make_request(connection, request_method, url, data, headers)
+                except socket.timeout:
+                    raise
+                except (httplib.HTTPException, socket.error):
+                    connection.close()
+                    # Запрос, изменяющий данные, мог дойти до сервера до сбоя:
+                    # повторная отправка может, например, опубликовать запись дважды
+                    if not reused or request_method not in ('GET', 'HEAD'):
+                        raise
+                    # Сервер мог закрыть простаивавшее в пуле соединение, пробуем заново
+                    self.__logger.info('Pooled connection to "%s" is stale, reconnecting.' % netloc)
+                    connection = pool.connect(netloc)
+                    response = self.__make_request(connection, request_method, url, data, headers)
+            except (socket.timeout, yaTimeoutError):
+                connection.close()
+                error_text = 'Timed out opening "%s".' % url
+                self.__logger.error(' ' + error_text)
+                raise yaTimeoutError(error_text)
+
+            if raw and (200 <= response.status < 300 or response.status == 304):
+                if response.status == 304:
+                    response.read()  # Пустое тело, соединение вернётся в пул при закрытии потока
+                if session.traffic is not None:
+                    session.traffic.add(1, 0)
+                return yaResponseStream(response, connection, netloc, pool, session.traffic)
+            elif stream and 200 <= response.status < 300:
+                resource_data = yaResponseStream(response, connection, netloc, pool, session.traffic)
+                if session.traffic is not None:
+                    session.traffic.add(1, 0)
+            else:
+                try:
+                    resource_data = response.read()
+                except socket.timeout:
+                    connection.close()
+                    error_text = 'Timed out reading response from "%s".' % url
+                    self.__logger.error(' ' + error_text)
+                    raise yaTimeoutError(error_text)
+                pool.release(netloc, connection, response)
+                if session.traffic is not None:
+                    session.traffic.add(1, len(resource_data))
         except httplib.HTTPException as e:
             self.__logger.error('Failed to open "%s".\n Error: "%s"' % (url, e))
             raise
@@ -937,13 +2334,18 @@ class yaResource(object):
         elif 200 <= response.status < 300:
             successful = True
 
+        if raw:
+            error_text = 'Unexpected response status %s while opening "%s".' % (response.status, url)
+            self.__logger.error(' ' + error_text)
+            raise yaError(error_text)
+
         if resource_data is not None:
-            if resource_data != '':
+            if not stream and resource_data != '':
                 self.__logger.debug('Response Body:\n%s\n%s\n%s' % ('-----' * 4, resource_data, '____' * 25))
 
             resource_type = None
 
-            for ctype_data in response.getheader('Content-Type').split(';'):
+            for ctype_data in (response.getheader('Content-Type') or '').split(';'):
                 type_index = ctype_data.rfind('type')
                 if type_index > -1:
                     resource_type = ctype_data[type_index + 5:]
@@ -952,40 +2354,549 @@ class yaResource(object):
 
         return resource_data
 
-    def get(self):
-        """Забирает данные ресурса."""
-        return self.__open_url()
+    def get(self, stream=False, timeout=None):
+        """Забирает данные ресурса.
+        Если задан флаг stream, вместо строки с данными вернёт поток yaResponseStream.
+        Параметр timeout ограничивает время выполнения запроса в секундах.
 
-    def create(self, data, content_type):
+        """
+        return self.__open_url(stream=stream, timeout=timeout)
+
+    def open(self, headers=None, timeout=None):
+        """Открывает ресурс для чтения произвольных данных (например, изображений).
+        Вернёт поток yaResponseStream, который следует закрыть по прочтении;
+        код ответа (200, либо 304 для условных запросов) и его заголовки
+        доступны через status и getheader().
+        Параметр headers задаёт дополнительные заголовки запроса
+        (например, If-None-Match). Токен авторизации передаётся только
+        серверу API сессии.
+
+        """
+        return self.__open_url(stream=True, timeout=timeout, headers=headers, raw=True)
+
+    def create(self, data, content_type, timeout=None):
         """Отсылает запрос на создание ресурса."""
-        return self.__open_url(data, 'POST', content_type)
+        return self.__open_url(data, 'POST', content_type, timeout=timeout)
 
-    def delete(self):
+    def delete(self, timeout=None):
         """Отсылает запрос на удаление ресурса."""
-        return self.__open_url(request_method='DELETE')
+        return self.__open_url(request_method='DELETE', timeout=timeout)
 
-    def update(self, data, content_type):
+    def update(self, data, content_type, timeout=None):
         """Отсылает запрос на модификацию ресурса."""
-        return self.__open_url(data, 'PUT', content_type)
+        return self.__open_url(data, 'PUT', content_type, timeout=timeout)
 
-    def get_object(self):
+    def get_object(self, stream=None, timeout=None):
         """Забирает данные ресура и, по возможности, преобразует ресурс
         в подходящий ya-объект.
+        Параметр timeout ограничивает время получения объекта в секундах,
+        включая чтение ответа, полученного потоком.
 
         """
+        with yaDeadline(timeout):
+            return self.__get_object(stream)
+
+    def __get_object(self, stream):
+        """Забирает данные ресурса и создает объект. См. get_object()."""
+        if stream is None:
+            stream = self.session.stream
+
         obj = None
-        resource_data = self.get()
+        resource_data = self.get(stream)
 
         if resource_data is not None:
             resource_type = resource_data[0]
 
-            if resource_type in URN_TYPES.keys():
-                self.__logger.debug('Resource type "%s" is a valid resource. Now spawning the appropriate object "%s".' % (resource_type, URN_TYPES[resource_type]))
-                obj = globals()[URN_TYPES[resource_type]](None)
-                obj._parse(resource_data)
-            elif resource_type is None:
-                self.__logger.warning('Resource type is none')
-            else:
-                self.__logger.error('Resource type "%s" is unknown' % resource_type)
+            try:
+                if resource_type in URN_TYPES.keys():
+                    self.__logger.debug('Resource type "%s" is a valid resource. Now spawning the appropriate object "%s".' % (resource_type, URN_TYPES[resource_type]))
+                    obj = globals()[URN_TYPES[resource_type]](None, session=self.session)
+                    obj._parse(resource_data)
+                    obj._loaded()
+                elif resource_type is None:
+                    self.__logger.warning('Resource type is none')
+                else:
+                    self.__logger.error('Resource type "%s" is unknown' % resource_type)
+            finally:
+                # Ответ с неожиданным кодом прочитан целиком, а не потоком
+                if stream and hasattr(resource_data[1], 'close'):
+                    resource_data[1].close()
 
         return obj
+
+
+# Версия формата снимков объектов (см. dump()).
+SNAPSHOT_VERSION = 1
+
+
+def _snapshot_encode(value):
+    """Приводит значение свойства объекта к виду, пригодному для JSON."""
+    if isinstance(value, yaBase):
+        return {'$obj': _snapshot_record(value)}
+    if isinstance(value, datetime.datetime):
+        return {'$dt': value.strftime('%Y-%m-%dT%H:%M:%S')}
+    if isinstance(value, dict):
+        return dict((key, _snapshot_encode(item)) for key, item in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [_snapshot_encode(item) for item in value]
+    return value
+
+
+def _snapshot_decode(value, session):
+    """Восстанавливает значение свойства объекта из JSON."""
+    if isinstance(value, dict):
+        if '$obj' in value:
+            return _snapshot_restore(value['$obj'], session)
+        if '$dt' in value:
+            return datetime.datetime.strptime(value['$dt'], '%Y-%m-%dT%H:%M:%S')
+        return dict((str(key), _snapshot_decode(item, session)) for key, item in value.iteritems())
+    if isinstance(value, list):
+        return [_snapshot_decode(item, session) for item in value]
+    return value
+
+
+def _snapshot_record(obj, exclude=()):
+    """Формирует запись снимка объекта: словарь с версией формата,
+    именем класса и состоянием объекта.
+
+    """
+    state = obj.__getstate__()
+    for name in exclude:
+        state.pop(name, None)
+    return {'v': SNAPSHOT_VERSION, 'class': obj.__class__.__name__, 'state': _snapshot_encode(state)}
+
+
+def _snapshot_restore(record, session=None):
+    """Создает объект по записи снимка, не обращаясь к серверу."""
+    if record.get('v', 0) > SNAPSHOT_VERSION:
+        raise yaError('Unsupported snapshot version "%s".' % record.get('v'))
+
+    class_name = record.get('class')
+    if class_name not in URN_TYPES.values():
+        raise yaError('Unable to restore object of unknown class "%s".' % class_name)
+
+    obj = globals()[class_name].__new__(globals()[class_name])
+    obj.__setstate__(_snapshot_decode(record['state'], session))
+    obj.__dict__['_session'] = session or DEFAULT_SESSION
+    return obj
+
+
+def _write_atomic(path, data):
+    """Записывает строку data в файл path. Запись идёт во временный файл,
+    которым затем заменяется path целиком, чтобы сбой во время записи
+    не испортил прежнее содержимое (контрольные точки, указатели и т.п.).
+
+    """
+    temp_path = '%s.tmp' % path
+    temp_file = open(temp_path, 'wb')
+    try:
+        temp_file.write(data)
+    finally:
+        temp_file.close()
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(temp_path, path)
+
+
+def _dump_json_atomic(path, state):
+    """Записывает state в файл path в формате JSON. См. _write_atomic()."""
+    import json
+    _write_atomic(path, json.dumps(state))
+
+
+def _snapshot_json(record):
+    """Сериализует запись снимка в строку JSON."""
+    import json
+    return json.dumps(record, separators=(',', ':'))
+
+
+def dumps(obj):
+    """Возвращает снимок объекта pyyaru (yaPerson, yaEntry, коллекции и т.п.)
+    в виде строки JSON.
+    Снимок содержит уже разобранные данные объекта, поэтому при восстановлении
+    повторного разбора xml и обращений к серверу не требуется.
+
+    """
+    return _snapshot_json(_snapshot_record(obj))
+
+
+def loads(data, session=None):
+    """Восстанавливает объект из снимка, полученного от dumps().
+    Восстановленный объект привязывается к сессии session
+    (по умолчанию DEFAULT_SESSION).
+
+    """
+    import json
+    return _snapshot_restore(json.loads(data), session)
+
+
+def dump(obj, fp):
+    """Записывает снимок объекта в файлоподобный объект fp."""
+    fp.write(dumps(obj))
+    fp.write('\n')
+
+
+def dump_collection(collection, fp, walk=False):
+    """Записывает снимок коллекции в fp в формате JSON Lines: первой строкой
+    идёт запись самой коллекции, а за ней — по строке на каждый объект.
+    Если задан флаг walk, коллекция проходится целиком (см. yaCollection.iter()),
+    при этом объекты записываются по мере получения с сервера.
+    Вернёт количество записанных объектов.
+
+    """
+    record = _snapshot_record(collection, exclude=('objects',))
+    record['stream'] = True
+    fp.write(_snapshot_json(record))
+    fp.write('\n')
+
+    count = 0
+    if walk:
+        objects = collection.iter()
+    else:
+        objects = collection.objects
+    for obj in objects:
+        dump(obj, fp)
+        count += 1
+    return count
+
+
+def load_iter(fp, session=None):
+    """Итератор, восстанавливающий объекты построчно из fp (см. dump(),
+    dump_collection()). Запись коллекции, предваряющая её объекты, пропускается.
+
+    """
+    import json
+    for line in fp:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if record.get('stream'):
+            continue
+        yield _snapshot_restore(record, session)
+
+
+def load(fp, session=None):
+    """Восстанавливает объект из снимка, записанного в fp функцией dump(),
+    либо коллекцию вместе с её объектами, записанную функцией dump_collection().
+
+    """
+    import json
+    line = fp.readline()
+    record = json.loads(line)
+    obj = _snapshot_restore(record, session)
+    if record.get('stream'):
+        obj.__dict__['objects'] = list(load_iter(fp, session))
+    return obj
+
+
+def _compact_record(obj):
+    """Формирует компактную запись объекта для передачи между процессами:
+    кортеж из имени класса и состояния объекта (вложенные объекты
+    коллекций также представлены записями).
+
+    """
+    state = obj.__getstate__()
+    if 'objects' in state:
+        state['objects'] = [_compact_record(item) for item in state['objects']]
+    return (obj.__class__.__name__, state)
+
+
+def _compact_restore(record, session=None):
+    """Воссоздаёт объект из компактной записи, привязывая его к сессии session."""
+    class_name = record[0]
+    if class_name not in URN_TYPES.values():
+        raise yaError('Unable to restore object of unknown class "%s".' % class_name)
+    obj = globals()[class_name].__new__(globals()[class_name])
+    obj.__dict__['_session'] = session or DEFAULT_SESSION
+    obj._load_record(record)
+    return obj
+
+
+def _parse_in_worker(task):
+    """Разбирает тело ответа сервера в дочернем процессе.
+    task - кортеж из имени класса pyyaru и тела ответа.
+    Возвращает компактную запись разобранного объекта.
+
+    """
+    class_name, body = task
+    if class_name not in URN_TYPES.values():
+        raise yaError('Unable to parse data for unknown class "%s".' % class_name)
+    obj = globals()[class_name](None)
+    obj._parse((None, body, True))
+    return _compact_record(obj)
+
+
+class yaParseExecutor(object):
+    """Исполнитель, разбирающий xml в пуле дочерних процессов.
+    Разбор xml требователен к процессору и при одновременной загрузке
+    многих страниц упирается в GIL. Исполнитель передаёт тела ответов
+    дочерним процессам, а обратно получает компактные записи (имя класса
+    и состояние объекта), из которых в родительском процессе
+    без повторного разбора воссоздаются объекты pyyaru.
+
+    Для использования исполнителя при запросах задайте его сессии:
+        session = yaSession(parse_executor=yaParseExecutor())
+
+    """
+
+    def __init__(self, processes=None, batch_size=8):
+        """processes - количество дочерних процессов (по умолчанию — по числу ядер);
+        batch_size - количество тел ответов, передаваемых дочернему процессу за раз
+        в parse_many().
+
+        """
+        import multiprocessing
+        self.batch_size = batch_size
+        self._pool = multiprocessing.Pool(processes)
+
+    def parse(self, class_name, body):
+        """Разбирает тело ответа для объекта класса class_name
+        в дочернем процессе и возвращает компактную запись.
+
+        """
+        return self._pool.apply_async(_parse_in_worker, ((class_name, body),)).get()
+
+    def parse_many(self, bodies, class_name='yaEntries', session=None):
+        """Разбирает тела ответов bodies пакетами по batch_size в дочерних
+        процессах и возвращает список объектов класса class_name,
+        привязанных к сессии session.
+
+        """
+        tasks = [(class_name, body) for body in bodies]
+        records = self._pool.map(_parse_in_worker, tasks, self.batch_size)
+        return [_compact_restore(record, session) for record in records]
+
+    def close(self):
+        """Останавливает дочерние процессы."""
+        self._pool.close()
+        self._pool.join()
+
+
+class yaRateLimiter(object):
+    """Ограничитель частоты запросов (алгоритм «ведро с маркерами»).
+    Потокобезопасен: один ограничитель может использоваться несколькими
+    сессиями, чтобы соблюдать общий для них лимит.
+
+    """
+
+    def __init__(self, rate, burst=1):
+        """rate - допустимое количество запросов в секунду;
+        burst - количество запросов, которые допустимо выполнить разом.
+
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Дожидается возможности выполнить очередной запрос.
+        Вернёт время ожидания в секундах.
+
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            delay = 0
+            if self._tokens < 0:
+                delay = -self._tokens / self.rate
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class yaTrafficCounter(object):
+    """Счётчик запросов к серверу и полученных от него байт (тел ответов).
+    Потокобезопасен. Задаётся сессии параметром traffic.
+
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, requests, bytes):
+        """Учитывает запросы и полученные байты."""
+        with self._lock:
+            self.requests += requests
+            self.bytes += bytes
+
+
+class yaItemCache(object):
+    """Кэш объектов элементов коллекций по отпечаткам их xml.
+
+    Отпечаток элемента - контрольная сумма (zlib.crc32) его xml. При повторной
+    загрузке коллекции объект элемента, отпечаток которого не изменился,
+    берётся из кэша, а не разбирается заново; изменившиеся элементы разбираются
+    и замещают прежние объекты. Кэш хранит не более capacity объектов,
+    вытесняя давно не встречавшиеся. Потокобезопасен.
+    Задаётся сессии параметром item_cache (для сессии по умолчанию - ITEM_CACHE).
+
+    Пример:
+        session = pyyaru.yaSession(access_token, item_cache=pyyaru.yaItemCache())
+        feed = session.entries(url).get()
+        ...
+        feed = session.entries(url).get()
+        for entry in feed.changes()['added']:
+            print entry.title
+
+    """
+
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def fingerprint(self, element):
+        """Вычисляет отпечаток xml-элемента."""
+        return zlib.crc32(etree.tostring(element))
+
+    def lookup(self, item_id, fingerprint):
+        """Ищет объект элемента в кэше. Вернёт пару из объекта (None, если
+        элемент изменился или не встречался) и состояния элемента: 'unchanged',
+        'changed' или 'added'.
+
+        """
+        if item_id is None:
+            return None, 'added'
+        with self._lock:
+            cached = self._items.pop(item_id, None)
+            if cached is None:
+                return None, 'added'
+            # Элемент переносится в конец очереди вытеснения
+            self._items[item_id] = cached
+        if cached[0] != fingerprint:
+            return None, 'changed'
+        return cached[1], 'unchanged'
+
+    def store(self, item_id, fingerprint, obj):
+        """Запоминает объект элемента с его отпечатком."""
+        if item_id is None:
+            return
+        with self._lock:
+            self._items.pop(item_id, None)
+            self._items[item_id] = (fingerprint, obj)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        """Очищает кэш."""
+        with self._lock:
+            self._items.clear()
+
+
+class yaSession(object):
+    """Сессия работы с API Я.ру.
+    Объединяет токен доступа, адрес сервера, пул соединений, кэш
+    идентификаторов, ограничитель частоты запросов, очередь отложенной записи
+    и исполнитель разбора xml в дочерних процессах (yaParseExecutor).
+    Параметры connect_timeout и read_timeout задают таймауты установки
+    соединения и ожидания данных от сервера в секундах.
+    Если задан указатель index (pyyaru.index.yaEntryIndex), в него попадают
+    все публикации, загружаемые в рамках сессии.
+    Если задан счётчик traffic (yaTrafficCounter), в нём учитываются запросы
+    сессии и объём полученных данных.
+    Если задан кэш item_cache (yaItemCache), неизменившиеся элементы коллекций
+    не разбираются повторно.
+    Флаг offline включает строгий автономный режим, в котором обращение
+    к незагруженным свойствам объектов не приводит к запросам на сервер.
+    Объекты pyyaru, привязанные к разным сессиям, могут безопасно
+    использоваться одновременно в одном процессе из разных потоков.
+
+    """
+
+    def __init__(self, access_token=None, api_server=None, pool=None, cache=None,
+                 rate_limiter=None, write_queue=None, stream=False, offline=False,
+                 parse_executor=None, connect_timeout=None, read_timeout=None, index=None,
+                 traffic=None, item_cache=None):
+        self.access_token = access_token
+        self.api_server = api_server or API_SERVER
+        self.pool = pool or yaConnectionPool()
+        self.cache = cache or yaResolutionCache()
+        self.rate_limiter = rate_limiter
+        self.write_queue = write_queue
+        self.stream = stream
+        self.offline = offline
+        self.parse_executor = parse_executor
+        # Таймауты по умолчанию берутся из CONNECT_TIMEOUT и READ_TIMEOUT
+        self.connect_timeout = connect_timeout if connect_timeout is not None else CONNECT_TIMEOUT
+        self.read_timeout = read_timeout if read_timeout is not None else READ_TIMEOUT
+        self.index = index
+        self.traffic = traffic
+        self.item_cache = item_cache
+
+    def me(self, refresh=False):
+        """Возвращает закэшированный профиль текущего пользователя.
+        См. yaResolutionCache.me().
+
+        """
+        return self.cache.me(refresh, self)
+
+    def resource(self, resource_name):
+        """Возвращает объект yaResource, привязанный к сессии."""
+        return yaResource(resource_name, self)
+
+    def person(self, id):
+        """Возвращает объект yaPerson, привязанный к сессии."""
+        return yaPerson(id, session=self)
+
+    def club(self, id):
+        """Возвращает объект yaClub, привязанный к сессии."""
+        return yaClub(id, session=self)
+
+    def entry(self, id=None, **kwargs):
+        """Возвращает объект yaEntry, привязанный к сессии."""
+        return yaEntry(id, session=self, **kwargs)
+
+    def entries(self, id, by_type='ANY'):
+        """Возвращает объект yaEntries, привязанный к сессии."""
+        return yaEntries(id, by_type, session=self)
+
+    def close(self):
+        """Дожидается выполнения отложенной записи, закрывает соединения сессии
+        и останавливает исполнитель разбора xml.
+
+        """
+        if self.write_queue is not None:
+            self.write_queue.close()
+        if self.parse_executor is not None:
+            self.parse_executor.close()
+        self.pool.clear()
+
+
+class yaDefaultSession(yaSession):
+    """Сессия по умолчанию. Токен доступа, адрес сервера, очередь отложенной
+    записи, режимы потокового разбора и автономной работы, а также таймауты,
+    указатель публикаций и кэш элементов коллекций берутся из глобальных переменных
+    модуля (ACCESS_TOKEN, API_SERVER, WRITE_QUEUE, STREAM_RESPONSES, OFFLINE,
+    CONNECT_TIMEOUT, READ_TIMEOUT, ENTRY_INDEX, ITEM_CACHE).
+    Если ACCESS_TOKEN не задан, токен берется из файла (см. load_token_file()).
+
+    """
+
+    access_token = property(lambda self: ACCESS_TOKEN if ACCESS_TOKEN is not None else load_token_file())
+    api_server = property(lambda self: API_SERVER)
+    write_queue = property(lambda self: WRITE_QUEUE)
+    stream = property(lambda self: STREAM_RESPONSES)
+    offline = property(lambda self: OFFLINE)
+    connect_timeout = property(lambda self: CONNECT_TIMEOUT)
+    read_timeout = property(lambda self: READ_TIMEOUT)
+    index = property(lambda self: ENTRY_INDEX)
+    item_cache = property(lambda self: ITEM_CACHE)
+
+    def __init__(self):
+        self.pool = CONNECTION_POOL
+        self.cache = RESOLUTION_CACHE
+        self.rate_limiter = None
+        self.parse_executor = None
+        self.traffic = None
+
+
+DEFAULT_SESSION = yaDefaultSession()
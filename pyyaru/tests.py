@@ -3,8 +3,26 @@
 """Юнит тесты для pyyaru."""
 
 import pyyaru
+import crawler
+import feeds
+import index
+import export
+import cli
+import comments
+import membership
+import media
 import unittest
 import datetime
+import os
+import sys
+import base64
+import copy
+import io
+import json
+import pickle
+import subprocess
+import tempfile
+import time
 
 resource_uri_me = '/me/'
 
@@ -56,6 +74,43 @@ class yaPersonCheck(unittest.TestCase):
         city = person.city
         self.assertEqual(person.id, resource_urn_person)
 
+    def test_no_refetch_on_miss(self):
+        """Отсутствующее после загрузки свойство не вызывает повторной загрузки."""
+        person = pyyaru.yaPerson(resource_url_person)
+        self.assertEqual(hasattr(person, 'notanattribute'), False)
+        self.assertEqual(person.is_loaded(), True)
+        person.__dict__['_session'] = pyyaru.yaSession(offline=True)
+        self.assertRaises(AttributeError, getattr, person, 'notanattribute')
+
+    def test_private_names_not_loaded(self):
+        """Служебные имена не вызывают загрузки."""
+        person = pyyaru.yaPerson(resource_url_person, session=pyyaru.yaSession(offline=True))
+        self.assertEqual(hasattr(person, '__length_hint__'), False)
+        self.assertRaises(AttributeError, getattr, person, '_notanattribute')
+        self.assertEqual(copy.copy(person).id, resource_url_person)
+        self.assertEqual(person.is_loaded(), False)
+
+    def test_copy_keeps_session(self):
+        """Копия объекта остаётся привязанной к его сессии и сохраняет сведения об изменениях."""
+        session = pyyaru.yaSession(offline=True)
+        entry = pyyaru.yaEntry(None, session=session)
+        entry.title = 'title'
+        person = pyyaru.yaPerson(resource_url_person, session=session)
+        for copied in (copy.copy(entry), copy.deepcopy(entry)):
+            self.assertEqual(copied._session is session, True)
+            self.assertEqual(copied.is_dirty(), True)
+        self.assertEqual(copy.deepcopy([person])[0]._session is session, True)
+        copied = copy.copy(person)
+        copied.mark_dirty('name')
+        self.assertEqual(person.is_dirty(), False)
+        self.assertEqual(copied.is_loaded(), False)
+        self.assertEqual(pickle.loads(pickle.dumps(person))._session is pyyaru.DEFAULT_SESSION, True)
+
+    def test_offline_mode(self):
+        """Крушение при обращении к незагруженному свойству в автономном режиме."""
+        person = pyyaru.yaPerson(resource_url_person, session=pyyaru.yaSession(offline=True))
+        self.assertRaises(pyyaru.yaOfflineError, getattr, person, 'city')
+
     def test_me_resource(self):
         """Загрузка профиля с ресурса /me/.
         Требует авторизации.
@@ -102,6 +157,31 @@ class yaPersonCheck(unittest.TestCase):
         """Проверка типа объекта, переданного в publish_entry()."""
         self.assertRaises(pyyaru.yaError, PERSON_FIXTURE.publish_entry, 'notanentry')
 
+    def test_publish_entries_object_check(self):
+        """Проверка типа объектов, переданных в publish_entries()."""
+        self.assertRaises(pyyaru.yaError, PERSON_FIXTURE.publish_entries, [pyyaru.yaEntry(), 'notanentry'])
+
+    def test_publish_entries_empty(self):
+        """Пакетная публикация пустого списка не обращается к серверу."""
+        self.assertEqual(PERSON_FIXTURE.publish_entries([]), [])
+
+    def test_friend_many_resolve_errors(self):
+        """Цели, идентификатор которых выяснить не удалось, не прерывают пакет."""
+        session = pyyaru.yaSession()
+        def resolve(resource_type, target, session):
+            if target == 'missing':
+                raise pyyaru.yaResourceNotFoundError(target)
+            return 'urn:ya.ru:person/%s' % target
+        session.cache.resolve = resolve
+        person = pyyaru.yaPerson(None, session=session)
+        person.__dict__['publish_entries'] = lambda entries, workers: [(entry, 'created', None) for entry in entries]
+
+        results = person.friend_many(['1', 'missing', '2'])
+        self.assertEqual([result[0].meta['person']['id'] for result in results],
+                         ['urn:ya.ru:person/1', 'missing', 'urn:ya.ru:person/2'])
+        self.assertEqual([result[1] for result in results], ['created', None, 'created'])
+        self.assertEqual(isinstance(results[1][2], pyyaru.yaResourceNotFoundError), True)
+
     def test_friend_errors(self):
         """Проверка испускания ошибок для метода friend()."""
         self.assertRaises(pyyaru.yaResourceNotFoundError, PERSON_FIXTURE.friend, 'notaresource')
@@ -205,6 +285,21 @@ class yaEntryCheck(unittest.TestCase):
         self.assertEqual(entry.comments_disabled, False)
         self.assertEqual(entry.type, 'text')
 
+    def test_compose_unicode(self):
+        """Компоновка xml из свойств, заданных как байтовыми строками, так и unicode."""
+        entry = pyyaru.yaEntry(attributes={'type': 'text', 'title': 'Заголовок', 'content': u'Содержимое'})
+        xml = entry._compose()
+        self.assertEqual('<title>Заголовок</title>' in xml, True)
+        self.assertEqual('<content>Содержимое</content>' in xml, True)
+
+    def test_compose_entries(self):
+        """Компоновка нескольких публикаций в единый документ."""
+        output = pyyaru.io.BytesIO()
+        entries = [pyyaru.yaEntry(attributes={'type': 'status', 'content': 'status %s' % i}) for i in range(3)]
+        self.assertEqual(pyyaru.compose_entries(entries, output), 3)
+        root = pyyaru.etree.fromstring(output.getvalue())
+        self.assertEqual(len(root.xpath('a:entry', namespaces=pyyaru.NAMESPACES)), 3)
+
     def test_make_comment(self):
         """Проверка создания комментария."""
         entry = pyyaru.yaEntry(resource_url_entry)
@@ -281,9 +376,196 @@ class yaEntriesCheck(unittest.TestCase):
             self.assertEqual(entry.__class__.__name__, 'yaEntry')
             break
 
+    def test_objects_not_shared(self):
+        """Списки objects разных коллекций не пересекаются."""
+        entries = pyyaru.yaEntries(resource_url_entries).get()
+        persons = pyyaru.yaPersons(resource_url_persons).get()
+        self.assertEqual(set([obj.__class__.__name__ for obj in entries.objects]), set(['yaEntry']))
+        self.assertEqual(set([obj.__class__.__name__ for obj in persons.objects]), set(['yaPerson']))
+
+    def test_stream_parsing(self):
+        """Разбор коллекции потоком дает тот же результат, что и разбор строки."""
+        entries = pyyaru.yaEntries(resource_url_entries).get()
+        entries_streamed = pyyaru.yaEntries(resource_url_entries).get(stream=True)
+        self.assertEqual([entry.id for entry in entries.objects], [entry.id for entry in entries_streamed.objects])
+        self.assertEqual(entries.links, entries_streamed.links)
+
+    def test_filter(self):
+        """Отбор публикаций условием yaFilter при загрузке и проходе коллекции."""
+        entries = pyyaru.yaEntries(resource_url_entries).get()
+        first = entries.objects[0]
+        by_id = pyyaru.yaFilter(ids=[first.id])
+        self.assertEqual([entry.id for entry in pyyaru.yaEntries(resource_url_entries).get(filter=by_id).objects],
+                         [first.id])
+        by_type = pyyaru.yaFilter(type=first.type, author=first.author['id'])
+        for entry in pyyaru.yaEntries(resource_url_entries).get(stream=True, filter=by_type).objects:
+            self.assertEqual(entry.type, first.type)
+        self.assertEqual(pyyaru.yaEntries(resource_url_entries).get(filter=pyyaru.yaFilter(type='unknown')).objects, [])
+
+    def test_filter_stops_paging(self):
+        """Проход с условием по дате прекращается на первой публикации старше нижней границы."""
+        entries = pyyaru.yaEntries(resource_url_entries).get()
+        since = entries.objects[-1].updated
+        found = list(entries.iter(filter=pyyaru.yaFilter(since=since)))
+        self.assertEqual(len(found), len([entry for entry in entries.objects if entry.updated >= since]))
+        self.assertEqual(entries.more(pyyaru.yaFilter(since=since)), False)
+
+    def test_item_cache(self):
+        """Неизменившиеся элементы не разбираются повторно, а их объекты берутся из кэша."""
+        page = ('<?xml version="1.0" encoding="utf-8"?><feed xmlns="http://www.w3.org/2005/Atom">'
+                '<entry><id>urn:ya.ru:post/153990/1</id><title>%s</title></entry>'
+                '<entry><id>urn:ya.ru:post/153990/2</id><title>Second</title></entry></feed>')
+        session = pyyaru.yaSession(item_cache=pyyaru.yaItemCache(capacity=2))
+        first = pyyaru.yaEntries(resource_url_entries, session=session)
+        first._parse(('entries', page % 'First', True))
+        self.assertEqual(len(first.changes()['added']), 2)
+
+        second = pyyaru.yaEntries(resource_url_entries, session=session)
+        second._parse(('entries', page % 'Edited', True))
+        self.assertEqual([entry.title for entry in second.changes()['changed']], ['Edited'])
+        self.assertEqual(second.changes()['unchanged'], [first.objects[1]])
+        self.assertEqual(second.objects[1] is first.objects[1], True)
+        self.assertEqual('_changes' in second.__getstate__(), False)
+
+        # Изменённый локально объект из кэша не выдаётся
+        second.objects[1].title = 'Local'
+        third = pyyaru.yaEntries(resource_url_entries, session=session)
+        third._parse(('entries', page % 'Edited', True))
+        self.assertEqual(third.objects[1] is second.objects[1], False)
+        self.assertEqual([entry.title for entry in third.changes()['unchanged']], ['Edited', 'Second'])
+        self.assertEqual(pyyaru.yaEntries(resource_url_entries).changes(), None)
+
+    def test_publish_batch_errors(self):
+        """Сетевой сбой одной публикации пакета не прерывает остальные."""
+        def saver(entry):
+            def save(target_url=None, force=False):
+                if entry.title == 'fail':
+                    raise pyyaru.socket.error('reset')
+                entry.id = 'urn:ya.ru:post/153990/%s' % entry.title
+                return entry
+            return save
+
+        entries = [pyyaru.yaEntry(attributes={'title': title}) for title in ('1', 'fail', '2')]
+        for entry in entries:
+            entry.__dict__['save'] = saver(entry)
+        results = pyyaru._publish_batch(resource_url_entries, entries, pyyaru.DEFAULT_SESSION)
+        self.assertEqual([result[1] for result in results], ['urn:ya.ru:post/153990/1', None, 'urn:ya.ru:post/153990/2'])
+        self.assertEqual(isinstance(results[1][2], pyyaru.socket.error), True)
+
+    def test_dirty_tracking(self):
+        """Изменённые свойства отслеживаются, неизменённые публикации не отправляются."""
+        page = ('<?xml version="1.0" encoding="utf-8"?>'
+                '<feed xmlns="http://www.w3.org/2005/Atom" xmlns:y="http://api.yandex.ru/yaru/">'
+                '<entry><id>urn:ya.ru:post/153990/%s</id><title>Post</title><y:access>friends</y:access>'
+                '<link rel="edit" href="%s%s/"/></entry></feed>')
+        traffic = pyyaru.yaTrafficCounter()
+        entries = pyyaru.yaEntries(resource_url_entries, session=pyyaru.yaSession(traffic=traffic))
+        entries._parse(('entries', page % (1, resource_url_entries, 1), True))
+        entry = entries.objects[0]
+        self.assertEqual(entry.access, 'friends')
+        self.assertEqual(entry.is_dirty(), False)
+        self.assertEqual(entry.save() is entry, True)
+        self.assertEqual(entries.save_all(), ([], 1))
+        self.assertEqual(traffic.requests, 0)
+
+        entry.access = 'public'
+        self.assertEqual(entry.is_dirty(), True)
+        self.assertEqual(pickle.loads(pickle.dumps(entry)).is_dirty(), False)
+        entry._mark_clean()
+        entry.meta = {}
+        entry._mark_clean()
+        entry.meta['key'] = 'value'
+        self.assertEqual(entry.is_dirty(), False)
+        entry.mark_dirty('meta')
+        self.assertEqual(entry.is_dirty(), True)
+        self.assertEqual(pyyaru.yaEntry().is_dirty(), True)
+
+        # Сетевой сбой одного объекта не прерывает сохранение остальных
+        def failing_save():
+            raise pyyaru.socket.error('reset')
+        entry.__dict__['save'] = failing_save
+        saved = pyyaru.yaEntry(attributes={'title': 'New'})
+        saved.__dict__['save'] = lambda: saved
+        results, skipped = pyyaru.save_all([entry, saved, pyyaru.yaEntry('urn:ya.ru:post/153990/2')])
+        self.assertEqual(skipped, 1)
+        self.assertEqual(isinstance(results[0][1], pyyaru.socket.error), True)
+        self.assertEqual(results[1], (saved, None))
+
+    def test_hydrate_authors(self):
+        """Профиль каждого автора загружается один раз и разделяется публикациями."""
+        traffic = pyyaru.yaTrafficCounter()
+        entries = pyyaru.yaEntries(resource_url_entries, session=pyyaru.yaSession(traffic=traffic)).get()
+        requests = traffic.requests
+        persons = entries.hydrate_authors()
+        authors = set(entry.author['id'] for entry in entries.objects if entry.__dict__.get('author'))
+        self.assertEqual(sorted(persons), sorted(authors))
+        self.assertEqual(traffic.requests - requests, len(authors))
+        by_author = {}
+        for entry in entries.objects:
+            if entry.author_person is not None:
+                self.assertEqual(by_author.setdefault(entry.author['id'], entry.author_person) is entry.author_person, True)
+                self.assertEqual(entry.author_person.is_loaded(), True)
+        entries.hydrate_authors(persons=persons)
+        self.assertEqual(traffic.requests - requests, len(authors))
+
+
+    def test_hydrate_authors_transport_error(self):
+        """Сетевой сбой загрузки одного автора не мешает прикрепить профили остальных."""
+        import socket
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(2)
+        person = ('<?xml version="1.0" encoding="utf-8"?><person xmlns="http://api.yandex.ru/yaru/">'
+                  '<id>urn:ya.ru:person/2</id><name>Second</name></person>')
+
+        def respond():
+            for i in range(2):
+                client = server.accept()[0]
+                if '/person/2/' in client.recv(65536):
+                    client.sendall('HTTP/1.1 200 OK\r\nContent-Type: application/x-yaru+xml; type=person;\r\n'
+                                   'Content-Length: %s\r\nConnection: close\r\n\r\n%s' % (len(person), person))
+                client.close()
+        responder = pyyaru.threading.Thread(target=respond)
+        responder.daemon = True
+        responder.start()
+        try:
+            entries = [pyyaru.yaEntry(None, attributes={'author': {
+                'id': 'http://127.0.0.1:%s/person/%s/' % (server.getsockname()[1], number)}}) for number in (1, 2)]
+            persons = pyyaru._hydrate_authors(entries, pyyaru.DEFAULT_SESSION, workers=2)
+        finally:
+            responder.join(5)
+            server.close()
+        self.assertEqual(sorted(persons), [entries[1].author['id']])
+        self.assertEqual('_author_person' in entries[0].__dict__, False)
+        self.assertEqual(entries[1].author_person.name, 'Second')
 
 class yaResourceCheck(unittest.TestCase):
 
+    def test_unexpected_status_stream(self):
+        """Ответ с неожиданным кодом при загрузке потоком не приводит к AttributeError."""
+        import socket
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(2)
+
+        def respond():
+            for i in range(2):
+                client = server.accept()[0]
+                client.recv(65536)
+                client.sendall('HTTP/1.1 503 Service Unavailable\r\nContent-Type: text/html\r\n'
+                               'Content-Length: 4\r\nConnection: close\r\n\r\nbusy')
+                client.close()
+        responder = pyyaru.threading.Thread(target=respond)
+        responder.daemon = True
+        responder.start()
+        try:
+            session = pyyaru.yaSession(api_server='http://127.0.0.1:%s' % server.getsockname()[1])
+            self.assertRaises(pyyaru.yaObjectTypeMismatchError, session.person(resource_uri_me).get, True)
+            self.assertEqual(pyyaru.yaResource(resource_uri_me, session).get_object(stream=True), None)
+        finally:
+            responder.join(5)
+            server.close()
+
     def test_id_without_fails(self):
         """Крушение без указания первого параметра конструктора."""
         self.assertRaises(TypeError, pyyaru.yaResource)
@@ -303,6 +585,14 @@ class yaResourceCheck(unittest.TestCase):
         resource = pyyaru.yaResource(resource_url_person)
         self.assertEqual(resource.url, resource_url_person)
 
+    def test_connection_pool_reuse(self):
+        """Повторная выдача соединения, возвращенного в пул."""
+        pool = pyyaru.yaConnectionPool()
+        connection, reused = pool.acquire('api-yaru.yandex.ru')
+        self.assertEqual(reused, False)
+        pool.release('api-yaru.yandex.ru', connection)
+        self.assertEqual(pool.acquire('api-yaru.yandex.ru'), (connection, True))
+
     def test_resource_get_object_person(self):
         """Возвращение с ресурса объекта yaPerson."""
         resource = pyyaru.yaResource(resource_url_person).get_object()
@@ -329,5 +619,1048 @@ class yaResourceCheck(unittest.TestCase):
         self.assertEqual(resource.__class__.__name__, 'yaClubs')
 
 
+# Допустимое время импорта pyyaru в секундах (см. benchmarks.bench_import()).
+IMPORT_TIME_BUDGET = 0.1
+
+
+class yaImportCheck(unittest.TestCase):
+
+    def run_python(self, code):
+        """Выполняет код в отдельном интерпретаторе рядом с модулем pyyaru."""
+        return subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(pyyaru.__file__))).strip()
+
+    def test_import_side_effects(self):
+        """Импорт не загружает lxml и не настраивает корневой журнал."""
+        result = self.run_python('import sys, logging, pyyaru; print "lxml.etree" in sys.modules, len(logging.getLogger().handlers)')
+        self.assertEqual(result, 'False 0')
+
+    def test_configure_logging_package(self):
+        """Настройка журнала охватывает журналы всех модулей пакета."""
+        code = ('import logging; from pyyaru import pyyaru, crawler; pyyaru.configure_logging(logging.INFO); '
+                'crawler.yaCrawler._yaCrawler__logger.error("crawler message")')
+        process = subprocess.Popen([sys.executable, '-c', code], stderr=subprocess.PIPE,
+                                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(pyyaru.__file__))))
+        output = process.communicate()[1]
+        self.assertEqual('pyyaru.crawler.yaCrawler' in output and 'crawler message' in output, True)
+
+    def test_import_time(self):
+        """Время импорта укладывается в IMPORT_TIME_BUDGET."""
+        result = self.run_python('import time; started = time.time(); import pyyaru; print time.time() - started')
+        self.assertTrue(float(result) < IMPORT_TIME_BUDGET, 'Import took %ss' % result)
+
+    def test_load_token_file(self):
+        """Чтение токена из файла в формате JSON."""
+        token_file, token_filepath = tempfile.mkstemp()
+        os.write(token_file, '{"access_token": "sometoken", "token_type": "bearer"}')
+        os.close(token_file)
+        try:
+            self.assertEqual(pyyaru.load_token_file(token_filepath), 'sometoken')
+        finally:
+            os.remove(token_filepath)
+
+    def test_load_token_file_unsafe(self):
+        """Содержимое файла с токеном не исполняется."""
+        token_file, token_filepath = tempfile.mkstemp()
+        os.write(token_file, '__import__("os").getcwd()')
+        os.close(token_file)
+        try:
+            self.assertEqual(pyyaru.load_token_file(token_filepath), None)
+        finally:
+            os.remove(token_filepath)
+
+
+class yaSessionCheck(unittest.TestCase):
+
+    def test_default_session(self):
+        """Привязка объектов к сессии по умолчанию."""
+        person = pyyaru.yaPerson(resource_urn_person)
+        self.assertEqual(person._session is pyyaru.DEFAULT_SESSION, True)
+        self.assertEqual(pyyaru.DEFAULT_SESSION.api_server, pyyaru.API_SERVER)
+
+    def test_session_binding(self):
+        """Привязка объектов и ресурсов к заданной сессии."""
+        session = pyyaru.yaSession('sometoken', api_server='http://localhost')
+        self.assertEqual(session.person(resource_urn_person)._session is session, True)
+        self.assertEqual(pyyaru.yaEntry(session=session)._session is session, True)
+        self.assertEqual(session.resource(resource_uri_me).url, 'http://localhost' + resource_uri_me)
+
+    def test_session_propagation(self):
+        """Объекты коллекции наследуют сессию коллекции."""
+        session = pyyaru.yaSession()
+        persons = pyyaru.yaPersons(resource_url_persons, session=session).get()
+        self.assertEqual(set([person._session for person in persons.objects]), set([session]))
+
+    def test_rate_limiter(self):
+        """Ограничение частоты запросов."""
+        limiter = pyyaru.yaRateLimiter(100, burst=2)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertNotEqual(limiter.acquire(), 0)
+
+
+class yaResolutionCacheCheck(unittest.TestCase):
+
+    def test_resolve_urn(self):
+        """URN-идентификатор возвращается без обращения к серверу."""
+        cache = pyyaru.yaResolutionCache()
+        self.assertEqual(cache.resolve('person', resource_urn_person), resource_urn_person)
+        self.assertEqual(cache.resolve('person', pyyaru.yaPerson(resource_urn_person)), resource_urn_person)
+
+    def test_resolve_cached(self):
+        """Повторное выяснение идентификатора берется из кэша."""
+        cache = pyyaru.yaResolutionCache()
+        self.assertEqual(cache.resolve('person', resource_url_person), resource_urn_person)
+        cache._ids[('person', resource_url_person)] = 'urn:ya.ru:person/cached'
+        self.assertEqual(cache.resolve('person', resource_url_person), 'urn:ya.ru:person/cached')
+        cache.invalidate(resource_url_person)
+        self.assertEqual(cache.resolve('person', resource_url_person), resource_urn_person)
+
+    def test_me_memoized(self):
+        """Профиль текущего пользователя запрашивается однажды.
+        Требует авторизации.
+
+        """
+        cache = pyyaru.yaResolutionCache()
+        me = cache.me()
+        self.assertEqual(cache.me() is me, True)
+        self.assertEqual(cache.me(refresh=True) is me, False)
+
+
+class yaSnapshotCheck(unittest.TestCase):
+
+    def test_entry_roundtrip(self):
+        """Восстановление публикации из снимка."""
+        entry = pyyaru.yaEntry(attributes={'type': 'status', 'access': 'friends', 'content': 'Снимок'})
+        entry.updated = datetime.datetime(2010, 6, 1, 12, 30)
+        restored = pyyaru.loads(pyyaru.dumps(entry))
+        self.assertEqual(restored.__class__, pyyaru.yaEntry)
+        self.assertEqual((restored.type, restored.access, restored.updated), ('status', 'friends', entry.updated))
+        self.assertEqual(restored.content, u'Снимок')
+
+    def test_restore_offline(self):
+        """Восстановление снимка не обращается к серверу."""
+        session = pyyaru.yaSession(offline=True)
+        restored = pyyaru.loads(pyyaru.dumps(PERSON_FIXTURE), session)
+        self.assertEqual(restored.id, PERSON_FIXTURE.id)
+        self.assertEqual(restored.links, PERSON_FIXTURE.links)
+        self.assertEqual(restored.is_loaded(), True)
+
+    def test_collection_stream(self):
+        """Потоковая запись коллекции и её восстановление."""
+        entries = pyyaru.yaEntries(resource_url_entries).get()
+        output = pyyaru.io.BytesIO()
+        self.assertEqual(pyyaru.dump_collection(entries, output), len(entries))
+        output.seek(0)
+        restored = pyyaru.load(output)
+        self.assertEqual([entry.id for entry in restored.objects], [entry.id for entry in entries.objects])
+
+    def test_unknown_class(self):
+        """Крушение при восстановлении объекта неизвестного класса."""
+        self.assertRaises(pyyaru.yaError, pyyaru.loads, '{"v": 1, "class": "yaSession", "state": {}}')
+
+    def test_pickle(self):
+        """Сериализация объекта модулем pickle."""
+        entry = pyyaru.yaEntry(attributes={'type': 'status', 'content': 'pickled'})
+        restored = pickle.loads(pickle.dumps(entry))
+        self.assertEqual(restored.content, 'pickled')
+        self.assertEqual(restored._session is pyyaru.DEFAULT_SESSION, True)
+
+
+class yaParseExecutorCheck(unittest.TestCase):
+
+    feed = ('<feed xmlns="http://www.w3.org/2005/Atom" xmlns:y="http://api.yandex.ru/yaru/">'
+            '<link rel="next" href="%s"/>'
+            '<entry><id>%s</id><updated>2010-06-01T12:00:00Z</updated>'
+            '<category scheme="urn:ya.ru:posttypes" term="status"/><content>Разбор</content></entry>'
+            '</feed>' % (resource_url_entries, resource_urn_entry))
+
+    def test_parse_many(self):
+        """Разбор страниц в дочерних процессах."""
+        executor = pyyaru.yaParseExecutor(1)
+        session = pyyaru.yaSession()
+        try:
+            entries = executor.parse_many([self.feed, self.feed], session=session)
+        finally:
+            executor.close()
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0].links['next'], resource_url_entries)
+        entry = entries[1].objects[0]
+        self.assertEqual((entry.id, entry.type, entry.updated), (resource_urn_entry, 'status', datetime.datetime(2010, 6, 1, 12)))
+        self.assertEqual(entry._session is session, True)
+
+    def test_session_executor(self):
+        """Разбор ответов сервера в дочерних процессах, заданных сессией."""
+        session = pyyaru.yaSession(parse_executor=pyyaru.yaParseExecutor(2))
+        try:
+            entries = pyyaru.yaEntries(resource_url_entries, session=session).get()
+        finally:
+            session.close()
+        self.assertNotEqual(len(entries.objects), 0)
+
+
+class yaWriteQueueCheck(unittest.TestCase):
+
+    def test_submit_result(self):
+        """Получение результата операции, поставленной в очередь."""
+        queue = pyyaru.yaWriteQueue(workers=1)
+        future = queue.submit(lambda x: x * 2, (21,))
+        self.assertEqual(future.result(5), 42)
+        queue.close()
+
+    def test_coalesce(self):
+        """Схлопывание операций с одинаковым ключом."""
+        calls = []
+        queue = pyyaru.yaWriteQueue(workers=0)
+        futures = [queue.submit(calls.append, (status,), 'status') for status in ('one', 'two', 'three')]
+        queue._workers.append(pyyaru.threading.Thread(target=queue._work))
+        queue._workers[0].start()
+        self.assertEqual(queue.close(5), True)
+        self.assertEqual(calls, ['three'])
+        self.assertEqual([future.done() for future in futures], [True, True, True])
+
+    def test_exception(self):
+        """Передача исключения, возбужденного операцией."""
+        queue = pyyaru.yaWriteQueue(workers=1, retries=0)
+        future = queue.submit(pyyaru.yaPerson(None).clubs, ('notarole',))
+        self.assertRaises(pyyaru.yaPersonInclubRoleUnkwnownError, future.result, 5)
+        queue.close()
+
+    def test_retry_idempotent_only(self):
+        """После сбоя сети повторяются только идемпотентные операции."""
+        def failing(calls, error):
+            calls.append(error)
+            raise error
+        queue = pyyaru.yaWriteQueue(workers=1, retries=2, retry_delay=0)
+        calls = []
+        future = queue.submit(failing, (calls, pyyaru.socket.error('reset')))
+        self.assertRaises(pyyaru.socket.error, future.result, 5)
+        self.assertEqual(len(calls), 1)
+        calls = []
+        future = queue.submit(failing, (calls, pyyaru.socket.error('reset')), idempotent=True)
+        self.assertRaises(pyyaru.socket.error, future.result, 5)
+        self.assertEqual(len(calls), 3)
+        calls = []
+        future = queue.submit(failing, (calls, pyyaru.yaConnectionError('refused')))
+        self.assertRaises(pyyaru.yaConnectionError, future.result, 5)
+        self.assertEqual(len(calls), 3)
+        queue.close()
+
+    def test_closed_queue(self):
+        """Крушение при постановке операции в закрытую очередь."""
+        queue = pyyaru.yaWriteQueue(workers=1)
+        queue.close()
+        self.assertRaises(pyyaru.yaOperationError, queue.submit, len, ([],))
+
+
+class yaCrawlerCheck(unittest.TestCase):
+
+    def test_visited_set(self):
+        """Отметка посещённых объектов и восстановление множества из контрольной точки."""
+        visited = crawler.yaVisitedSet(1000)
+        self.assertEqual(visited.add(resource_urn_person), True)
+        self.assertEqual(visited.add(resource_urn_person), False)
+        self.assertEqual(resource_urn_person in crawler.yaVisitedSet.load(visited.dump()), True)
+        self.assertEqual(resource_urn_club in visited, False)
+
+    def test_unknown_relation(self):
+        """Крушение при указании неизвестного отношения."""
+        self.assertRaises(pyyaru.yaError, crawler.yaCrawler, [resource_url_person], expand=('enemies',))
+
+    def test_crawl_with_checkpoint(self):
+        """Обход друзей пользователя и продолжение обхода с контрольной точки."""
+        checkpoint = tempfile.mktemp()
+        try:
+            events = list(crawler.yaCrawler([resource_url_person], depth=1, checkpoint=checkpoint).crawl())
+            self.assertEqual(events[0], ('node', events[0][1]))
+            self.assertEqual(events[1][0], 'edge')
+            self.assertEqual(events[1][1][0], resource_urn_person)
+            # Обход завершён, поэтому продолжать нечего
+            self.assertEqual(list(crawler.yaCrawler([resource_url_person], depth=1, checkpoint=checkpoint).crawl()), [])
+        finally:
+            for path in (checkpoint, checkpoint + '.bloom'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_crawl_transport_error(self):
+        """Сетевой сбой загрузки узла отмечает узел неудавшимся, не прерывая обход."""
+        import socket
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+
+        def reset():
+            client = server.accept()[0]
+            client.recv(65536)
+            client.close()
+        responder = pyyaru.threading.Thread(target=reset)
+        responder.daemon = True
+        responder.start()
+        try:
+            graph_crawler = crawler.yaCrawler(['http://127.0.0.1:%s/person/1/' % server.getsockname()[1]],
+                                              capacity=1000)
+            self.assertEqual(list(graph_crawler.crawl()), [])
+        finally:
+            responder.join(5)
+            server.close()
+        self.assertEqual(graph_crawler.stats['errors'], 1)
+
+    def test_checkpoint_bloom_file(self):
+        """Битовый массив посещённых объектов пишется в отдельный файл, только если изменился."""
+        checkpoint = tempfile.mktemp()
+        try:
+            graph_crawler = crawler.yaCrawler([resource_url_person], checkpoint=checkpoint, capacity=1000)
+            graph_crawler._visited.add(resource_urn_person)
+            graph_crawler._save_checkpoint()
+            self.assertEqual('bits' in json.load(open(checkpoint, 'rb'))['visited'], False)
+            self.assertEqual(os.path.exists(checkpoint + '.bloom'), True)
+
+            os.remove(checkpoint + '.bloom')
+            graph_crawler._save_checkpoint()
+            self.assertEqual(os.path.exists(checkpoint + '.bloom'), False)
+            graph_crawler._visited.add(resource_urn_club)
+            graph_crawler._save_checkpoint()
+
+            resumed = crawler.yaCrawler([resource_url_person], checkpoint=checkpoint, capacity=1000)
+            self.assertEqual(resource_urn_person in resumed._visited, True)
+            self.assertEqual(resource_urn_club in resumed._visited, True)
+            self.assertEqual(len(resumed._visited), 2)
+        finally:
+            for path in (checkpoint, checkpoint + '.bloom'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+class yaCrawlCoordinatorCheck(unittest.TestCase):
+
+    def test_queue_lease(self):
+        """Аренда задач, отказ от чужих задач и возврат задач с истекшей арендой."""
+        queue = crawler.yaCrawlQueue(':memory:', shards=2, lease_time=0.05, max_attempts=2)
+        self.assertEqual(queue.add(resource_urn_person, 'person', 0), True)
+        self.assertEqual(queue.add(resource_urn_person, 'person', 0), False)
+        shard = queue.shard_of(resource_urn_person)
+        self.assertEqual(queue.lease(1 - shard, 'first', 10), [])
+        self.assertEqual(queue.lease(shard, 'first', 10), [['person', resource_urn_person, 0]])
+        self.assertEqual(queue.lease(shard, 'second', 10), [])
+        time.sleep(0.1)
+        self.assertEqual(len(queue.lease(shard, 'second', 10)), 1)
+        # Задача уже принадлежит другому владельцу
+        queue.complete('first', [resource_urn_person])
+        self.assertEqual(queue.counts()['leased'], 1)
+        time.sleep(0.1)
+        self.assertEqual(queue.lease(shard, 'third', 10), [])
+        self.assertEqual(queue.counts()['failed'], 1)
+
+    def test_crawl(self):
+        """Обход друзей пользователя двумя процессами и повторный запуск с той же базой."""
+        path = tempfile.mktemp()
+        try:
+            coordinator = crawler.yaCrawlCoordinator([resource_url_person], path, processes=2, poll_interval=0.1)
+            events = list(coordinator.crawl())
+            self.assertEqual(events[0][0], 'node')
+            self.assertEqual(coordinator.stats['fetched'], 1)
+            self.assertEqual(coordinator.stats['edges'], len(events) - coordinator.stats['nodes'])
+            self.assertEqual(list(crawler.yaCrawlCoordinator([resource_url_person], path, processes=2).crawl()), [])
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+    def test_worker_transport_error(self):
+        """Сетевой сбой одного узла отмечает неудавшимся лишь этот узел, не закрывая сегмент."""
+        import socket
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(2)
+        person = ('<?xml version="1.0" encoding="utf-8"?><person xmlns="http://api.yandex.ru/yaru/">'
+                  '<id>urn:ya.ru:person/2</id><name>Second</name></person>')
+
+        def respond():
+            for i in range(2):
+                client = server.accept()[0]
+                if '/person/2/' in client.recv(65536):
+                    client.sendall('HTTP/1.1 200 OK\r\nContent-Type: application/x-yaru+xml; type=person;\r\n'
+                                   'Content-Length: %s\r\nConnection: close\r\n\r\n%s' % (len(person), person))
+                client.close()
+        responder = pyyaru.threading.Thread(target=respond)
+        responder.daemon = True
+        responder.start()
+
+        path = tempfile.mktemp()
+        seeds = ['http://127.0.0.1:%s/person/%s/' % (server.getsockname()[1], number) for number in (1, 2)]
+        try:
+            coordinator = crawler.yaCrawlCoordinator(seeds, path, expand=(), processes=1, workers=1,
+                                                     max_restarts=0, poll_interval=0.1)
+            events = list(coordinator.crawl())
+            self.assertEqual([event[1][0] for event in events if event[0] == 'error'], [seeds[0]])
+            self.assertEqual([event[1].name for event in events if event[0] == 'node'], ['Second'])
+            self.assertEqual(coordinator.stats['restarts'], 0)
+        finally:
+            responder.join(5)
+            server.close()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+    def test_dead_worker_while_busy(self):
+        """Аварийно завершившийся процесс перезапускается, пока другие процессы присылают события."""
+        import threading
+
+        class Worker(object):
+            def __init__(self, alive, exitcode):
+                self.alive = alive
+                self.exitcode = exitcode
+
+            def is_alive(self):
+                return self.alive
+
+            def join(self):
+                pass
+
+            def terminate(self):
+                self.alive = False
+
+        sent = []
+        stop = threading.Event()
+        workers = {}
+
+        def send(events):
+            while not stop.is_set() and len(sent) < 200:
+                sent.append(len(sent))
+                events.put(('node', len(sent)))
+                time.sleep(0.01)
+
+        def start(shard, events):
+            if shard == 1:
+                workers[1] = Worker(True, None)
+                sender = threading.Thread(target=send, args=(events,))
+                sender.daemon = True
+                sender.start()
+            elif shard in workers:
+                # Перезапуск: обход завершается
+                workers[1].alive, workers[1].exitcode = False, 0
+                stop.set()
+                workers['restarted'] = len(sent)
+                return Worker(False, 0)
+            else:
+                workers[0] = Worker(False, 1)
+            return workers[shard]
+
+        path = tempfile.mktemp()
+        try:
+            coordinator = crawler.yaCrawlCoordinator([resource_url_person], path, processes=2, poll_interval=0.1)
+            coordinator.__dict__['_start'] = start
+            list(coordinator.crawl())
+            self.assertEqual(coordinator.stats['restarts'], 1)
+            self.assertEqual(workers['restarted'] < 100, True)
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+
+class yaTimelineCheck(unittest.TestCase):
+
+    def test_merge_order(self):
+        """Выдача публикаций нескольких лент в порядке убывания даты обновления без повторов."""
+        timeline = feeds.yaTimeline([resource_url_entries, PERSON_FIXTURE, resource_url_entries])
+        entries = timeline.latest(30)
+        self.assertEqual(len(set(entry.id for entry in entries)), len(entries))
+        for newer, older in zip(entries, entries[1:]):
+            self.assertEqual(newer.updated >= older.updated, True)
+        self.assertEqual(timeline.stats['duplicates'] > 0, True)
+
+    def test_latest_fetches_first_pages(self):
+        """Для получения одной публикации загружаются лишь первые страницы лент."""
+        timeline = feeds.yaTimeline([resource_url_entries, PERSON_FIXTURE], prefetch=False)
+        self.assertEqual(len(timeline.latest(1)), 1)
+        self.assertEqual(timeline.stats['pages'], 2)
+
+    def test_transport_error(self):
+        """Сетевой сбой и испорченный ответ ленты не прерывают объединённую ленту."""
+        import socket
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(2)
+
+        def respond():
+            for i in range(2):
+                client = server.accept()[0]
+                if '/broken/' in client.recv(65536):
+                    client.sendall('HTTP/1.1 200 OK\r\nContent-Type: application/atom+xml;\r\n'
+                                   'Content-Length: 5\r\nConnection: close\r\n\r\n<feed')
+                client.close()
+        responder = pyyaru.threading.Thread(target=respond)
+        responder.daemon = True
+        responder.start()
+        try:
+            timeline = feeds.yaTimeline(['http://127.0.0.1:%s/%s/' % (server.getsockname()[1], name)
+                                         for name in ('reset', 'broken')])
+            self.assertEqual(timeline.latest(5), [])
+        finally:
+            responder.join(5)
+            server.close()
+        self.assertEqual(timeline.stats['errors'], 2)
+
+
+class yaFilterCheck(unittest.TestCase):
+
+    ENTRY_XML = ('''<entry xmlns="http://www.w3.org/2005/Atom" xmlns:y="http://api.yandex.ru/yaru/">'''
+                 '''<id>urn:ya.ru:post/153990/219</id><author><y:id>urn:ya.ru:person/153990</y:id></author>'''
+                 '''<updated>2010-06-01T12:00:00Z</updated>'''
+                 '''<category scheme="urn:ya.ru:posttypes" term="status"/></entry>''')
+
+    def test_match_element(self):
+        """Проверка xml-элемента без создания объекта."""
+        from lxml import etree
+        element = etree.fromstring(self.ENTRY_XML)
+        self.assertEqual(pyyaru.yaFilter(type=['status', 'text'], author='urn:ya.ru:person/153990').match(element), True)
+        self.assertEqual(pyyaru.yaFilter(type='text').match(element), False)
+        self.assertEqual(pyyaru.yaFilter(ids=[resource_urn_entry]).match(element), True)
+        self.assertEqual(pyyaru.yaFilter(since=datetime.datetime(2010, 6, 1, 12, 0)).match(element), True)
+        self.assertEqual(pyyaru.yaFilter(until=datetime.datetime(2010, 6, 1, 11, 59)).match(element), False)
+
+    def test_match_object(self):
+        """Проверка созданного объекта теми же условиями."""
+        from lxml import etree
+        entry = pyyaru.yaEntry(None)
+        entry._parse_element(etree.fromstring(self.ENTRY_XML))
+        self.assertEqual(pyyaru.yaFilter(type='status', ids=[resource_urn_entry]).match_object(entry), True)
+        self.assertEqual(pyyaru.yaFilter(author='urn:ya.ru:person/1').match_object(entry), False)
+        self.assertEqual(pyyaru.yaFilter(since=datetime.datetime(2010, 6, 2)).is_past(entry.updated), True)
+
+
+class yaFeedPollerCheck(unittest.TestCase):
+
+    def make_entries(self, count, step, newest=datetime.datetime(2010, 6, 1, 12, 0)):
+        entries = []
+        for i in range(count):
+            entry = pyyaru.yaEntry('urn:ya.ru:post/1/%s' % i)
+            entry.__dict__['updated'] = newest - datetime.timedelta(seconds=step * i)
+            entries.append(entry)
+        return entries
+
+    def test_adaptive_interval(self):
+        """Подбор интервала опроса по частоте публикаций в пределах заданных границ."""
+        poller = feeds.yaFeedPoller(min_interval=60, max_interval=3600, jitter=0)
+        key = poller.watch(resource_url_entries, now=0)
+        watched = poller._feeds[key]
+        entries = self.make_entries(5, 600)
+        poller._reschedule(watched, entries, feeds._timestamp(entries[0].updated))
+        self.assertEqual(poller.interval(key), 600)
+        # Новых публикаций нет - опрашиваем реже
+        poller._reschedule(watched, [], feeds._timestamp(entries[0].updated) + 600)
+        self.assertEqual(poller.interval(key), 1200)
+        # Всплеск публикаций - опрашиваем чаще, но не чаще min_interval
+        burst = self.make_entries(100, 1, entries[0].updated + datetime.timedelta(seconds=1200))
+        poller._reschedule(watched, burst, feeds._timestamp(burst[0].updated))
+        self.assertEqual(poller.interval(key), 60)
+        poller._reschedule(watched, None, 0)
+        self.assertEqual(poller.interval(key), 120)
+
+    def test_poll_due(self):
+        """Опрос ленты и отсутствие новых публикаций при повторном опросе."""
+        poller = feeds.yaFeedPoller(min_interval=1, report_existing=True)
+        key = poller.watch(resource_url_entries)
+        self.assertEqual(poller.poll_due(time.time() - 10), [])
+        polled = poller.poll_due(time.time() + 1)
+        self.assertEqual(polled[0][0], key)
+        self.assertEqual(len(polled[0][1]) > 0, True)
+        self.assertEqual(poller.poll_due(time.time() + 10 ** 6), [])
+
+    def test_poll_transport_error(self):
+        """Сетевой сбой ленты не прерывает опрос, а отодвигает следующий опрос ленты."""
+        import socket
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+
+        def reset():
+            client = server.accept()[0]
+            client.recv(65536)
+            client.close()
+        responder = pyyaru.threading.Thread(target=reset)
+        responder.daemon = True
+        responder.start()
+        try:
+            poller = feeds.yaFeedPoller(min_interval=1, jitter=0)
+            broken = poller.watch('http://127.0.0.1:%s/person/1/post/' % server.getsockname()[1], now=0)
+            interval = poller.interval(broken)
+            self.assertEqual(poller.poll_due(1), [])
+        finally:
+            responder.join(5)
+            server.close()
+        self.assertEqual(poller.stats['errors'], 1)
+        self.assertEqual(poller.interval(broken) > interval, True)
+
+
+class yaDeadlineCheck(unittest.TestCase):
+
+    def setUp(self):
+        # Сервер принимает соединения, но ничего не отвечает
+        import socket
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(5)
+        self.api_server = 'http://127.0.0.1:%s' % self.server.getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_read_timeout(self):
+        """Крушение по таймауту ожидания ответа, заданному сессией."""
+        session = pyyaru.yaSession(api_server=self.api_server, read_timeout=0.1)
+        self.assertRaises(pyyaru.yaTimeoutError, session.person(resource_uri_me).get)
+
+    def test_call_timeout(self):
+        """Крушение по таймауту, заданному при вызове."""
+        session = pyyaru.yaSession(api_server=self.api_server)
+        started = time.time()
+        self.assertRaises(pyyaru.yaTimeoutError, session.resource(resource_uri_me).get_object, timeout=0.1)
+        self.assertEqual(time.time() - started < 1, True)
+
+    def test_nested_deadline(self):
+        """Вложенный срок не продлевает внешний."""
+        session = pyyaru.yaSession(api_server=self.api_server)
+        started = time.time()
+        with pyyaru.yaDeadline(0.1) as deadline:
+            with pyyaru.yaDeadline(10):
+                self.assertEqual(pyyaru.yaDeadline.time_left() <= 0.1, True)
+                self.assertRaises(pyyaru.yaTimeoutError, session.person(resource_uri_me).get)
+        self.assertEqual(time.time() - started < 1, True)
+        self.assertEqual(deadline.remaining() < 0, True)
+        self.assertEqual(pyyaru.yaDeadline.current(), None)
+
+    def test_deadline_in_workers(self):
+        """Передача срока потокам пакетных операций."""
+        with pyyaru.yaDeadline(10):
+            bound = pyyaru._map_concurrently(lambda item: pyyaru.yaDeadline.current() is not None, range(3))
+        self.assertEqual(bound, [True] * 3)
+
+    def test_deadline_in_pools(self):
+        """Срок действует в потоках обходчика, объединённой ленты и обхода обсуждений."""
+        session = pyyaru.yaSession(api_server=self.api_server, read_timeout=5)
+        entry = pyyaru.yaEntry('urn:ya.ru:post/153990/1', session=session)
+        entry.__dict__.update(thread={'total': 2}, links={'comments': self.api_server + '/person/1/post/1/comments/'})
+        started = time.time()
+        with pyyaru.yaDeadline(0.1):
+            graph_crawler = crawler.yaCrawler([self.api_server + '/person/1/'], session=session, capacity=1000)
+            self.assertEqual(list(graph_crawler.crawl()), [])
+            timeline = feeds.yaTimeline([self.api_server + '/person/1/post/'], session=session)
+            self.assertEqual(timeline.latest(1), [])
+            walker = comments.yaThreadWalker()
+            walker.walk([entry])
+        self.assertEqual(time.time() - started < 2, True)
+        self.assertEqual((graph_crawler.stats['errors'], timeline.stats['errors'], walker.stats['errors']), (1, 1, 1))
+
+
+class yaEntryIndexCheck(unittest.TestCase):
+
+    def make_entry(self, number, title, entry_type='text', day=1):
+        entry = pyyaru.yaEntry('urn:ya.ru:post/153990/%s' % number)
+        entry.__dict__.update(title=title, content=u'<b>Текст</b> публикации', categories=['python'],
+                              author={'id': 'urn:ya.ru:person/153990'},
+                              updated=datetime.datetime(2010, 6, day, 12, 0))
+        entry.type = entry_type
+        return entry
+
+    def test_search(self):
+        """Поиск публикаций по словам, типу, автору и дате обновления."""
+        entries_index = index.yaEntryIndex()
+        entries_index.update([self.make_entry(1, 'Hello world', day=1),
+                              self.make_entry(2, 'Hello again', 'status', day=2),
+                              self.make_entry(3, 'Goodbye', day=3)])
+        self.assertEqual([entry.id for entry in entries_index.search('hello')],
+                         ['urn:ya.ru:post/153990/2', 'urn:ya.ru:post/153990/1'])
+        self.assertEqual(len(entries_index.search(u'ТЕКСТ публикации')), 3)
+        self.assertEqual(len(entries_index.search('b')), 0)
+        self.assertEqual(len(entries_index.search('hello', type='status')), 1)
+        self.assertEqual(len(entries_index.search(author='urn:ya.ru:person/153990', category='python', limit=2)), 2)
+        self.assertEqual(len(entries_index.search(since=datetime.datetime(2010, 6, 2),
+                                                  until=datetime.datetime(2010, 6, 3, 12, 0))), 2)
+
+    def test_replace_and_remove(self):
+        """Замещение повторно добавленной публикации и удаление публикации."""
+        entries_index = index.yaEntryIndex()
+        entries_index.add(self.make_entry(1, 'Hello'))
+        entries_index.add(self.make_entry(1, 'Goodbye'))
+        self.assertEqual(len(entries_index), 1)
+        self.assertEqual(entries_index.search('hello'), [])
+        self.assertEqual(entries_index.remove('urn:ya.ru:post/153990/1'), True)
+        self.assertEqual(entries_index.search('goodbye'), [])
+
+    def test_clear(self):
+        """Очистка указателя не заменяет его блокировку."""
+        entries_index = index.yaEntryIndex()
+        entries_index.add(self.make_entry(1, 'Hello'))
+        lock = entries_index._lock
+        entries_index.clear()
+        self.assertEqual(entries_index._lock is lock, True)
+        self.assertEqual(len(entries_index), 0)
+        self.assertEqual(entries_index.search('hello'), [])
+
+    def test_session_index(self):
+        """Наполнение указателя публикациями, загружаемыми в рамках сессии."""
+        entries_index = index.yaEntryIndex()
+        session = pyyaru.yaSession(index=entries_index)
+        entries = session.entries(resource_url_entries).get()
+        self.assertEqual(len(entries_index), len(entries.objects))
+        entries.more()
+        self.assertEqual(len(entries_index), len(entries.objects))
+
+
+class yaExportCheck(unittest.TestCase):
+
+    PAGE_XML = ('''<?xml version="1.0" encoding="utf-8"?>'''
+                '''<feed xmlns="http://www.w3.org/2005/Atom" xmlns:y="http://api.yandex.ru/yaru/">'''
+                '''<link rel="next" href="https://api-yaru.yandex.ru/person/153990/post/?p=2"/>'''
+                '''<entry><id>urn:ya.ru:post/153990/1</id><author><y:id>urn:ya.ru:person/153990</y:id></author>'''
+                '''<title>First</title><updated>2010-06-02T12:00:00Z</updated><y:access>friends</y:access>'''
+                '''<category scheme="urn:ya.ru:posttypes" term="status"/><content>&amp;lt;b>Hi&amp;lt;/b></content></entry>'''
+                '''<entry><id>urn:ya.ru:post/153990/2</id><author><y:id>urn:ya.ru:person/153990</y:id></author>'''
+                '''<title>Second</title><updated>2010-06-01T12:00:00Z</updated>'''
+                '''<category scheme="urn:ya.ru:posttypes" term="text"/></entry></feed>''')
+
+    def test_parse_columns(self):
+        """Разбор страницы публикаций прямо в столбцы."""
+        columns = export.yaEntryColumns(content=True)
+        next_url, crossed = columns.parse(self.PAGE_XML)
+        self.assertEqual(next_url, 'https://api-yaru.yandex.ru/person/153990/post/?p=2')
+        self.assertEqual(crossed, False)
+        self.assertEqual(list(columns.types), [columns.TYPES.index('status'), columns.TYPES.index('text')])
+        self.assertEqual(list(columns.access), [columns.ACCESS_LEVELS.index('friends'), 0])
+        self.assertEqual(list(columns.authors), [0, 0])
+        self.assertEqual(columns.strings.values, ['urn:ya.ru:person/153990'])
+        row = next(columns.rows())
+        self.assertEqual(row['updated'], datetime.datetime(2010, 6, 2, 12, 0))
+        self.assertEqual(row['content'], '<b>Hi</b>')
+
+    def test_parse_filtered(self):
+        """Отбор публикаций при разборе в столбцы."""
+        columns = export.yaEntryColumns()
+        next_url, crossed = columns.parse(self.PAGE_XML, pyyaru.yaFilter(since=datetime.datetime(2010, 6, 2)))
+        self.assertEqual(columns.ids, ['urn:ya.ru:post/153990/1'])
+        self.assertEqual(crossed, True)
+
+    def test_iter_columns(self):
+        """Выгрузка ленты порциями ограниченного размера."""
+        chunks = list(export.iter_columns(resource_url_entries, chunk_size=5, filter=pyyaru.yaFilter(ids=[resource_urn_entry])))
+        self.assertEqual(sum(len(chunk) for chunk in chunks) <= 1, True)
+        chunks = []
+        for chunk in export.iter_columns(resource_url_entries, chunk_size=5):
+            chunks.append(chunk)
+            if len(chunks) == 3:
+                break
+        self.assertEqual([len(chunk) for chunk in chunks], [5, 5, 5])
+        self.assertEqual(chunks[0].strings is chunks[2].strings, True)
+
+
+class yaCliCheck(unittest.TestCase):
+
+    def test_writers(self):
+        """Запись строк выгрузки в JSON Lines и CSV."""
+        row = {'id': 'urn:ya.ru:post/153990/1', 'updated': datetime.datetime(2010, 6, 2, 12, 0), 'title': u'Привет'}
+        output = io.BytesIO()
+        cli.yaJsonLinesWriter(output, cli.ENTRY_FIELDS).write(row)
+        self.assertEqual(json.loads(output.getvalue())['updated'], '2010-06-02T12:00:00Z')
+        self.assertEqual(output.getvalue().endswith('\n'), True)
+        output = io.BytesIO()
+        cli.yaCsvWriter(output, ('id', 'title', 'author')).write(row)
+        self.assertEqual(output.getvalue().splitlines(), ['id,title,author', 'urn:ya.ru:post/153990/1,Привет,'])
+
+    def test_export_resume(self):
+        """Выгрузка ленты с контрольной точкой и её продолжение."""
+        path = tempfile.mktemp()
+        checkpoint = cli.yaFeedCheckpoint(path)
+        checkpoint.feeds['feed'] = resource_url_entries
+        output = io.BytesIO()
+        traffic = pyyaru.yaTrafficCounter()
+        session = pyyaru.yaSession(pyyaru.load_token_file(), traffic=traffic)
+        progress = cli.yaProgress(traffic, enabled=False)
+        # Выгрузка ограничивается первой страницей ленты
+        first_page = pyyaru.yaEntries(resource_url_entries).get()
+        entries_filter = pyyaru.yaFilter(since=first_page.objects[-1].updated)
+        failed = cli.export_feeds('person', ['feed'], cli.yaJsonLinesWriter(output, cli.ENTRY_FIELDS),
+                                  session, checkpoint, progress, filter=entries_filter)
+        self.assertEqual(failed, [])
+        self.assertEqual(len(output.getvalue().splitlines()), progress.items)
+        self.assertEqual(traffic.requests > 0 and traffic.bytes > 0, True)
+
+        resumed = cli.yaFeedCheckpoint(path)
+        os.remove(path)
+        self.assertEqual(resumed.resumed, True)
+        self.assertEqual(resumed.feeds['feed'], None)
+        self.assertEqual(resumed.items, progress.items)
+        output = io.BytesIO()
+        cli.export_feeds('person', ['feed'], cli.yaJsonLinesWriter(output, cli.ENTRY_FIELDS),
+                         session, resumed, progress)
+        self.assertEqual(output.getvalue(), '')
+
+
+    def test_export_broken_page(self):
+        """Ответ, не являющийся xml, отмечает ленту неудавшейся, не попадая в контрольную точку."""
+        import socket
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        page = '<html><body>Bad gateway<br></body></html>'
+
+        def respond():
+            client = server.accept()[0]
+            client.recv(65536)
+            client.sendall('HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: %s\r\n'
+                           'Connection: close\r\n\r\n%s' % (len(page), page))
+            client.close()
+        responder = pyyaru.threading.Thread(target=respond)
+        responder.daemon = True
+        responder.start()
+
+        url = 'http://127.0.0.1:%s/person/1/post/' % server.getsockname()[1]
+        checkpoint = cli.yaFeedCheckpoint(None)
+        checkpoint.feeds['feed'] = url
+        progress = cli.yaProgress(pyyaru.yaTrafficCounter(), enabled=False)
+        output = io.BytesIO()
+        try:
+            failed = cli.export_feeds('person', ['feed'], cli.yaJsonLinesWriter(output, cli.ENTRY_FIELDS),
+                                      pyyaru.DEFAULT_SESSION, checkpoint, progress)
+        finally:
+            responder.join(5)
+            server.close()
+        self.assertEqual([target for target, error in failed], ['feed'])
+        self.assertEqual(checkpoint.feeds['feed'], url)
+        self.assertEqual(output.getvalue(), '')
+        self.assertEqual(progress.line().endswith('failed: 1'), True)
+
+class yaThreadWalkerCheck(unittest.TestCase):
+
+    COMMENTS_XML = ('''<?xml version="1.0" encoding="utf-8"?>'''
+                    '''<feed xmlns="http://www.w3.org/2005/Atom" xmlns:y="http://api.yandex.ru/yaru/" '''
+                    '''xmlns:thr="http://purl.org/syndication/thread/1.0">'''
+                    '''<entry><id>urn:ya.ru:post/153990/12</id><updated>2010-06-01T12:02:00Z</updated>'''
+                    '''<thr:in-reply-to ref="urn:ya.ru:post/153990/11"/><thr:total>0</thr:total></entry>'''
+                    '''<entry><id>urn:ya.ru:post/153990/11</id><updated>2010-06-01T12:01:00Z</updated>'''
+                    '''<thr:in-reply-to ref="urn:ya.ru:post/153990/1"/><thr:total>1</thr:total></entry>'''
+                    '''<entry><id>urn:ya.ru:post/153990/13</id><updated>2010-06-01T12:03:00Z</updated>'''
+                    '''<thr:in-reply-to ref="urn:ya.ru:post/153990/1"/><thr:total>0</thr:total></entry></feed>''')
+
+    def test_assemble(self):
+        """Сборка дерева ответов по thr:in-reply-to."""
+        collection = pyyaru.yaEntries('urn:ya.ru:post/153990/1/comments')
+        collection._parse(('entries', self.COMMENTS_XML, True))
+        self.assertEqual(collection.objects[1].thread, {'in_reply_to': 'urn:ya.ru:post/153990/1', 'total': 1})
+        self.assertEqual('thread' in collection.objects[1]._compose(), False)
+
+        tree = comments.yaCommentNode(pyyaru.yaEntry('urn:ya.ru:post/153990/1'))
+        comments.yaThreadWalker()._assemble(tree, collection.objects)
+        self.assertEqual(len(tree), 3)
+        self.assertEqual([(depth, comment.id) for depth, comment in tree],
+                         [(1, 'urn:ya.ru:post/153990/11'), (2, 'urn:ya.ru:post/153990/12'),
+                          (1, 'urn:ya.ru:post/153990/13')])
+
+    def test_assemble_nested_refetch(self):
+        """Дозагрузка ответов на вложенный комментарий не дублирует известные ответы."""
+        collection = pyyaru.yaEntries('urn:ya.ru:post/153990/1/comments')
+        collection._parse(('entries', self.COMMENTS_XML, True))
+        tree = comments.yaCommentNode(pyyaru.yaEntry('urn:ya.ru:post/153990/1'))
+        walker = comments.yaThreadWalker()
+        walker._assemble(tree, collection.objects[:2])
+        child = tree.replies[0]
+
+        # Ответы на комментарий 11: уже известный 12 и новый 14
+        more = pyyaru.yaEntries('urn:ya.ru:post/153990/11/comments')
+        more._parse(('entries', self.COMMENTS_XML.replace('/13<', '/14<').replace('/1"/><thr:total>0', '/11"/><thr:total>0'), True))
+        created = walker._assemble(child, [more.objects[0], more.objects[2]])
+        self.assertEqual([node.entry.id for node in created], ['urn:ya.ru:post/153990/14'])
+        self.assertEqual([(depth, comment.id) for depth, comment in tree],
+                         [(1, 'urn:ya.ru:post/153990/11'), (2, 'urn:ya.ru:post/153990/12'),
+                          (2, 'urn:ya.ru:post/153990/14')])
+
+    def test_walk_transport_error(self):
+        """Сетевой сбой загрузки обсуждения отмечает обсуждение неудавшимся, не прерывая обход."""
+        import socket
+        import struct
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+
+        def reset():
+            client = server.accept()[0]
+            client.recv(65536)
+            # Соединение сбрасывается (RST), и чтение ответа завершается socket.error
+            client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            client.close()
+        responder = pyyaru.threading.Thread(target=reset)
+        responder.daemon = True
+        responder.start()
+        try:
+            entry = pyyaru.yaEntry('urn:ya.ru:post/153990/1')
+            entry.__dict__.update(thread={'total': 2}, links={
+                'comments': 'http://127.0.0.1:%s/person/153990/post/1/comments/' % server.getsockname()[1]})
+            walker = comments.yaThreadWalker()
+            trees = walker.walk([entry])
+        finally:
+            responder.join(5)
+            server.close()
+        self.assertEqual(len(trees[entry.id]), 0)
+        self.assertEqual(walker.stats['errors'], 1)
+        self.assertEqual(walker.threads, {})
+
+    def test_walk_skips_unchanged(self):
+        """Повторный обход не загружает обсуждения, в которых не прибавилось ответов."""
+        entries = pyyaru.yaEntries(resource_url_entries).get()
+        walker = comments.yaThreadWalker()
+        trees = walker.walk(entries)
+        self.assertEqual(sorted(trees), sorted(entry.id for entry in entries.objects))
+        self.assertEqual(walker.stats['errors'], 0)
+        fetched = walker.stats['fetched']
+
+        known = [entry for entry in entries.objects if entry.thread['total'] is not None]
+        again = walker.walk(entries)
+        self.assertEqual(walker.stats['skipped'], len(known))
+        for entry in known:
+            self.assertEqual(again[entry.id] is trees[entry.id], True)
+        if known:
+            known[0].thread['total'] += 1
+            walker.walk(entries)
+            self.assertEqual(walker.stats['fetched'] > fetched, True)
+
+
+class yaMembershipCheck(unittest.TestCase):
+
+    def test_snapshot_diff(self):
+        """Разность снимков состава."""
+        before = membership.yaMembershipSnapshot(['urn:ya.ru:person/%s' % i for i in (5, 1, 3, 100)])
+        after = membership.yaMembershipSnapshot(['urn:ya.ru:person/%s' % i for i in (1, 3, 7, 200)])
+        self.assertEqual(len(after.ids), 4)
+        self.assertEqual('urn:ya.ru:person/7' in after, True)
+        self.assertEqual('urn:ya.ru:person/5' in after, False)
+        self.assertEqual('urn:ya.ru:club/7' in after, False)
+        self.assertEqual(after.diff(before), (['urn:ya.ru:person/7', 'urn:ya.ru:person/200'],
+                                              ['urn:ya.ru:person/5', 'urn:ya.ru:person/100']))
+        mixed = membership.yaMembershipSnapshot(['urn:ya.ru:person/1', 'urn:ya.ru:club/5'])
+        self.assertEqual(mixed.prefix, None)
+        self.assertEqual(mixed.diff(before), (['urn:ya.ru:club/5'], ['urn:ya.ru:person/100', 'urn:ya.ru:person/3',
+                                                                     'urn:ya.ru:person/5']))
+
+    def test_dump_load(self):
+        """Восстановление снимка из словаря."""
+        snapshot = membership.yaMembershipSnapshot(['urn:ya.ru:person/%s' % i for i in range(1000)])
+        restored = membership.yaMembershipSnapshot.load(json.loads(json.dumps(snapshot.dump())))
+        self.assertEqual(list(restored), list(snapshot))
+        self.assertEqual(restored.diff(snapshot), ([], []))
+        # Номера записываются независимо от платформы
+        state = snapshot.dump()
+        self.assertEqual(base64.b64decode(state['ids'])[8:16], '\x01' + '\x00' * 7)
+        state['format'] = '=L'
+        self.assertRaises(pyyaru.yaError, membership.yaMembershipSnapshot.load, state)
+
+    def test_page_ids(self):
+        """Из страницы коллекции выбираются только элементы коллекции."""
+        page = ('<?xml version="1.0" encoding="utf-8"?><persons xmlns="http://api.yandex.ru/yaru/">'
+                '<person><id>urn:ya.ru:person/1</id></person><group><id>urn:ya.ru:group/1</id></group>'
+                '<person><id>urn:ya.ru:person/2</id></person><link rel="next" href="/next/"/></persons>')
+        item_tag = membership._item_tag('/persons/', 'persons', pyyaru.DEFAULT_SESSION)
+        self.assertEqual(list(membership._iter_page_ids(page, item_tag)),
+                         ['urn:ya.ru:person/1', 'urn:ya.ru:person/2', '/next/'])
+        self.assertRaises(pyyaru.yaObjectTypeMismatchError, membership._item_tag, '/me/', 'person',
+                          pyyaru.DEFAULT_SESSION)
+
+    def test_check_transport_error(self):
+        """Сетевой сбой одной коллекции не прерывает проверку остальных."""
+        monitor = membership.yaMembershipMonitor()
+        def take(task):
+            if task[0] == 'urn:ya.ru:person/2':
+                return (task[0], task[1]), None, pyyaru.socket.error('reset')
+            return (task[0], task[1]), membership.yaMembershipSnapshot(['urn:ya.ru:person/5']), None
+        monitor._take = take
+        changes = monitor.check([('urn:ya.ru:person/1', 'friends'), ('urn:ya.ru:person/2', 'friends')])
+        self.assertEqual(changes, {('urn:ya.ru:person/1', 'friends'): None})
+
+        def failing_snapshot(subject, relation=None, session=None):
+            raise pyyaru.socket.error('reset')
+        monitor = membership.yaMembershipMonitor()
+        take_snapshot = membership.take_snapshot
+        membership.take_snapshot = failing_snapshot
+        try:
+            key, snapshot, error = monitor._take(('urn:ya.ru:person/2', 'friends'))
+        finally:
+            membership.take_snapshot = take_snapshot
+        self.assertEqual((key, snapshot), (('urn:ya.ru:person/2', 'friends'), None))
+        self.assertEqual(isinstance(error, pyyaru.socket.error), True)
+
+    def test_take_snapshot(self):
+        """Снимок состава коллекции совпадает с её объектами."""
+        snapshot = membership.take_snapshot(resource_url_persons)
+        friends = pyyaru.yaPersons(resource_url_persons).get()
+        self.assertEqual(list(snapshot), sorted(set(friend.id for friend in friends.iter()),
+                                                key=lambda urn: int(urn.rsplit('/', 1)[1])))
+
+
+class yaMediaCacheCheck(unittest.TestCase):
+
+    def test_byte_budget(self):
+        """Резервирование бюджета загружаемых байтов."""
+        budget = media._yaByteBudget(100)
+        self.assertEqual(budget.acquire(60), 60)
+        self.assertEqual(budget.acquire(40), 40)
+        budget.release(100)
+        self.assertEqual(budget.acquire(1000), 100)
+
+    def test_unknown_length_reserves_budget(self):
+        """Ответ без Content-Length занимает весь бюджет на время загрузки."""
+        cache = media.yaMediaCache(tempfile.mkdtemp(), max_in_flight=10 ** 6)
+        used = []
+
+        class Stream(object):
+            chunks = ['data', '']
+            def getheader(self, name, default=None):
+                return default
+            def read(self, size):
+                used.append(cache._budget.used)
+                return self.chunks.pop(0)
+
+        digest, size = cache._download(Stream())
+        self.assertEqual((size, used[0], cache._budget.used), (4, 10 ** 6, 0))
+        self.assertEqual(open(cache._object_path(digest)).read(), 'data')
+
+    def test_fetch_many_transport_error(self):
+        """Сетевой сбой одного адреса даёт None, не прерывая загрузку остальных."""
+        import socket
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+
+        def reset():
+            client = server.accept()[0]
+            client.recv(65536)
+            client.close()
+        responder = pyyaru.threading.Thread(target=reset)
+        responder.daemon = True
+        responder.start()
+        url = 'http://127.0.0.1:%s/pic/1.png' % server.getsockname()[1]
+        try:
+            cache = media.yaMediaCache(tempfile.mkdtemp())
+            self.assertEqual(cache.fetch_many([url]), {url: None})
+        finally:
+            responder.join(5)
+            server.close()
+        self.assertEqual(cache.stats['errors'], 1)
+
+    def test_userpics(self):
+        """Загрузка аватаров и их повторная проверка условными запросами."""
+        path = tempfile.mkdtemp()
+        friends = pyyaru.yaPersons(resource_url_persons).get()
+        cache = media.yaMediaCache(path)
+        paths = cache.userpics(friends)
+        self.assertEqual(sorted(paths), sorted(friend.id for friend in friends.objects))
+        self.assertEqual(all(os.path.exists(paths[friend_id]) for friend_id in paths), True)
+        self.assertEqual(cache.stats['downloaded'], len(set(paths.values())))
+
+        # Свежие копии выдаются без запросов, устаревшие - проверяются
+        self.assertEqual(media.yaMediaCache(path).userpics(friends), paths)
+        stale = media.yaMediaCache(path, max_age=0)
+        self.assertEqual(stale.userpics(friends), paths)
+        self.assertEqual(stale.stats['downloaded'] + stale.stats['revalidated'], len(paths))
+
+
 if __name__ == "__main__":
     unittest.main()
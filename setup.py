@@ -17,6 +17,9 @@ setup(
     packages=['pyyaru'],
     include_package_data=True,
     zip_safe=False,
+    entry_points={
+        'console_scripts': ['pyyaru = pyyaru.cli:main'],
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Environment :: Web Environment',